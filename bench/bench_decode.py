@@ -0,0 +1,68 @@
+"""Compares the JSON decoders on the mempool files.
+
+The files are read into memory first, so the decode timings do not include
+any I/O; reading them is timed separately for comparison.
+
+Usage: python bench/bench_decode.py [--mempool mempool] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python_files"))
+
+from decoder import DECODERS
+from ingest import list_mempool
+
+
+def read_files(paths):
+    contents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    return contents
+
+
+def best_of(repeat, function, *args):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def decode_all(decoder, contents):
+    return sum(decoder.decode(data) is not None for data in contents)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mempool", default="mempool")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = list_mempool(args.mempool)
+    read_seconds, contents = best_of(args.repeat, read_files, paths)
+    size = sum(len(data) for data in contents)
+    print(f"{len(paths)} files, {size / 1e6:.1f} MB")
+    print(f"{'read':<10} {read_seconds:8.3f}s {size / 1e6 / read_seconds:8.1f} MB/s")
+
+    timings = {}
+    for name, decoder_class in DECODERS.items():
+        try:
+            decoder = decoder_class()
+        except ImportError:
+            print(f"{name:<10} not installed")
+            continue
+        timings[name] = best_of(args.repeat, decode_all, decoder, contents)
+
+    # Speedups are relative to the standard library decoder
+    baseline = timings["json"][0]
+    for name, (seconds, decoded) in timings.items():
+        print(
+            f"{name:<10} {seconds:8.3f}s {size / 1e6 / seconds:8.1f} MB/s "
+            f"{baseline / seconds:5.2f}x  {decoded} transactions"
+        )
@@ -0,0 +1,354 @@
+"""Times every stage of the pipeline on the mempool and scaled copies of it.
+
+Stages: read, decode, structural check, txid/wtxid, policy tiers, type
+mask, one validator per script template, block selection, tail optimizer
+(search nodes per second, with its fee and weight gain), merkle trees and
+mining. Per transaction stages report latency percentiles; every stage
+reports its throughput. Each scale runs in its own process so its peak RSS
+is measured separately.
+
+A scale of k clones every transaction k times. Clones spend the clones of
+their in-mempool parents and fresh outpoints otherwise, so the graph keeps
+its shape; their signatures no longer match (the cost of a check is the
+same), and at most --validate-sample transactions go through the validators.
+
+Usage: python bench/bench_pipeline.py [--scale 1 10 100] [--json out.json]
+       [--compare old.json]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "python_files"))
+
+from block_builder import build_graph, select_transactions
+from classifier import classify_script, type_mask
+from decoder import get_decoder
+from ingest import list_mempool
+from merkle import BlockMerkleTrees, MerkleTree
+from mining import _search_range, build_header
+from policy import policy_reject
+from result_cache import CachedInput, CachedTransaction
+from structural_check import check_transaction
+from tail_optimizer import optimize_tail
+from transaction import Transaction, TxIn, hash256
+from validation import TEMPLATE_VALIDATORS
+from verifier import get_backend, set_signature_cache
+
+
+PERCENTILES = (50, 90, 99)
+
+
+class StageTimer:
+    # Latencies of the items of one stage, in nanoseconds
+
+    def __init__(self):
+        self.samples = []
+        self.seconds = 0.0
+
+    def add(self, nanoseconds):
+        self.samples.append(nanoseconds)
+
+    def result(self):
+        samples = sorted(self.samples)
+        seconds = self.seconds or sum(samples) / 1e9
+        result = {
+            "items": len(samples),
+            "seconds": round(seconds, 6),
+            "per_second": round(len(samples) / seconds, 1) if seconds else None,
+        }
+        if samples:
+            for p in PERCENTILES:
+                index = min(len(samples) - 1, len(samples) * p // 100)
+                result[f"p{p}_us"] = round(samples[index] / 1000, 2)
+            result["max_us"] = round(samples[-1] / 1000, 2)
+        return result
+
+
+def single(items, seconds, **extra):
+    # Result of a stage timed as a whole
+    result = {
+        "items": items,
+        "seconds": round(seconds, 6),
+        "per_second": round(items / seconds, 1) if seconds else None,
+    }
+    result.update(extra)
+    return result
+
+
+def load_mempool(folder):
+    timer = StageTimer()
+    contents = []
+    for path in list_mempool(folder):
+        started = time.perf_counter_ns()
+        with open(path, "rb") as f:
+            contents.append(f.read())
+        timer.add(time.perf_counter_ns() - started)
+    return contents, timer
+
+
+def parents_first(transactions):
+    by_txid = {tx.txid: tx for tx in transactions}
+    ordered = []
+    seen = set()
+
+    def visit(tx):
+        seen.add(tx.txid)
+        for vin in tx.vin:
+            parent = by_txid.get(vin.txid)
+            if parent is not None and parent.txid not in seen:
+                visit(parent)
+        ordered.append(tx)
+
+    for tx in transactions:
+        if tx.txid not in seen:
+            visit(tx)
+    return ordered
+
+
+def clone_transaction(tx, copy, clone_txids):
+    # Copy 0 is the transaction itself; others get new txids
+    if copy == 0:
+        vin = [
+            TxIn(v.prev_hash, v.prev_index, v.script_sig, v.sequence, v.witness, v.prevout, v.is_coinbase)
+            for v in tx.vin
+        ]
+    else:
+        vin = []
+        for v in tx.vin:
+            prev_hash = clone_txids.get(v.prev_hash)
+            if prev_hash is None:
+                prev_hash = hash256(v.prev_hash + copy.to_bytes(4, "little"))
+            vin.append(TxIn(prev_hash, v.prev_index, v.script_sig, v.sequence, v.witness, v.prevout, v.is_coinbase))
+    return Transaction(tx.version, tx.locktime, vin, tx.vout)
+
+
+def run_scale(mempool, scale, validate_sample, hashes):
+    """Runs every stage at one scale.
+
+    Returns:
+      A dict of stage name -> result, plus the scale and the peak RSS.
+    """
+    set_signature_cache(None)
+    decoder = get_decoder()
+    stages = {}
+
+    contents, read_timer = load_mempool(mempool)
+    stages["read"] = read_timer.result()
+
+    decode_timer = StageTimer()
+    originals = []
+    for copy in range(scale):
+        for data in contents:
+            started = time.perf_counter_ns()
+            tx = decoder.decode(data)
+            decode_timer.add(time.perf_counter_ns() - started)
+            if copy == 0 and tx is not None:
+                originals.append(tx)
+    stages["decode"] = decode_timer.result()
+
+    # check_transaction() on dicts that are already decoded
+    structural_timer = StageTimer()
+    dicts = [json.loads(data) for data in contents]
+    for _ in range(scale):
+        for tx_data in dicts:
+            started = time.perf_counter_ns()
+            check_transaction(tx_data)
+            structural_timer.add(time.perf_counter_ns() - started)
+    del dicts
+    stages["structural"] = structural_timer.result()
+
+    txid_timer = StageTimer()
+    policy_timer = StageTimer()
+    classify_timer = StageTimer()
+    validator_timers = {}
+    ordered = parents_first(originals)
+    total = len(ordered) * scale
+    stride = max(1, total // validate_sample) if validate_sample else 0
+    light = []
+    position = 0
+    for copy in range(scale):
+        clone_txids = {}
+        for tx in ordered:
+            clone = clone_transaction(tx, copy, clone_txids)
+            started = time.perf_counter_ns()
+            clone.txid_bytes
+            clone.wtxid_bytes
+            txid_timer.add(time.perf_counter_ns() - started)
+            clone_txids[tx.txid_bytes] = clone.txid_bytes
+
+            started = time.perf_counter_ns()
+            policy_reject(clone)
+            policy_timer.add(time.perf_counter_ns() - started)
+
+            started = time.perf_counter_ns()
+            type_mask(clone)
+            classify_timer.add(time.perf_counter_ns() - started)
+
+            if stride and position % stride == 0:
+                for index, vin in enumerate(clone.vin):
+                    if vin.prevout is None:
+                        continue
+                    template = classify_script(vin.prevout.script_pubkey)
+                    timer = validator_timers.setdefault(template or "generic", StageTimer())
+                    started = time.perf_counter_ns()
+                    TEMPLATE_VALIDATORS[template](clone, index)
+                    timer.add(time.perf_counter_ns() - started)
+            position += 1
+
+            # What the block builder needs, without the scripts and witnesses
+            light.append(
+                CachedTransaction(
+                    clone.txid_bytes,
+                    clone.wtxid_bytes,
+                    clone.fee,
+                    clone.weight,
+                    [CachedInput(vin.outpoint, vin.sequence) for vin in clone.vin],
+                )
+            )
+    del ordered, originals, contents
+    stages["txid"] = txid_timer.result()
+    stages["policy"] = policy_timer.result()
+    stages["classify"] = classify_timer.result()
+    for template, timer in sorted(validator_timers.items()):
+        stages[f"validate_{template}"] = timer.result()
+
+    started = time.perf_counter()
+    graph = build_graph(light)
+    graph_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    template = select_transactions(graph)
+    select_seconds = time.perf_counter() - started
+    stages["graph"] = single(len(light), graph_seconds)
+    stages["selection"] = single(len(light), select_seconds, selected=len(template.transactions))
+    _, tail = optimize_tail(graph, template)
+    stages["tail"] = single(
+        tail.nodes,
+        tail.seconds,
+        fee_gain=tail.fee_gain,
+        weight_gain=tail.weight_gain,
+        complete=tail.complete,
+    )
+
+    started = time.perf_counter()
+    trees = BlockMerkleTrees(template.transactions)
+    trees.witness_root
+    stages["merkle_block"] = single(len(template.transactions), time.perf_counter() - started)
+    started = time.perf_counter()
+    MerkleTree([tx.txid_bytes for tx in light]).root
+    stages["merkle_mempool"] = single(len(light), time.perf_counter() - started)
+
+    # Nonces against an impossible target, so exactly `hashes` are tried
+    header = build_header(trees.merkle_root, int(time.time()))
+    started = time.perf_counter()
+    _, tried = _search_range(header, 0, hashes, 0)
+    stages["mining"] = single(tried, time.perf_counter() - started)
+
+    return {
+        "scale": scale,
+        "transactions": len(light),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "stages": stages,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "decoder": get_decoder().name,
+        "verifier": get_backend().name,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def print_run(run):
+    print(f"\nscale {run['scale']}x: {run['transactions']} transactions, peak RSS {run['peak_rss_mb']} MB")
+    print(f"{'stage':<22}{'items':>10}{'seconds':>10}{'per sec':>12}{'p50 us':>10}{'p90 us':>10}{'p99 us':>10}")
+    for name, stage in run["stages"].items():
+        percentiles = "".join(
+            f"{stage[key]:>10.1f}" if key in stage else f"{'':>10}"
+            for key in ("p50_us", "p90_us", "p99_us")
+        )
+        per_second = stage["per_second"] or 0
+        print(f"{name:<22}{stage['items']:>10}{stage['seconds']:>10.3f}{per_second:>12.0f}{percentiles}")
+
+
+def compare(results, baseline, threshold):
+    """Prints the throughput change of every stage against a baseline.
+
+    Returns:
+      The number of stages slower than the threshold.
+    """
+    old_runs = {run["scale"]: run for run in baseline["runs"]}
+    regressions = 0
+    print(f"\nagainst {baseline['environment'].get('commit')} ({baseline['environment'].get('time')}):")
+    for run in results["runs"]:
+        old = old_runs.get(run["scale"])
+        if old is None:
+            continue
+        for name, stage in run["stages"].items():
+            old_stage = old["stages"].get(name)
+            if not old_stage or not old_stage["per_second"] or not stage["per_second"]:
+                continue
+            ratio = stage["per_second"] / old_stage["per_second"]
+            flag = ""
+            if ratio < 1 - threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{run['scale']:>4}x {name:<22}{ratio:>8.2f}x{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mempool", default=os.path.join(ROOT, "mempool"))
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--validate-sample", type=int, default=5000, help="transactions validated per scale")
+    parser.add_argument("--hashes", type=int, default=200000, help="nonces tried by the mining stage")
+    parser.add_argument("--json", help="where the results are written (default: bench/results/<time>.json)")
+    parser.add_argument("--compare", help="earlier results to compare the throughputs with")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown reported as a regression")
+    args = parser.parse_args()
+
+    results = {"environment": environment(), "runs": []}
+    for scale in args.scale:
+        # A fresh process per scale keeps the peak RSS of each one apart
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            run = executor.submit(run_scale, args.mempool, scale, args.validate_sample, args.hashes).result()
+        print_run(run)
+        results["runs"].append(run)
+
+    path = args.json
+    if path is None:
+        folder = os.path.join(ROOT, "bench", "results")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
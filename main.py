@@ -1,53 +1,188 @@
+import argparse
+import atexit
 import os
-import json
-
-
-def count_transaction_types(folder_path):
-    p2pkh_count = 0
-    p2wpkh_count = 0
-    p2tr_count = 0
-
-    # Iterate over all files in the folder
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".json"):
-            file_path = os.path.join(folder_path, filename)
-
-            # Read the JSON file
-            with open(file_path, "r") as file:
-                data = json.load(file)
-
-            is_p2pkh = False
-            is_p2wpkh = False
-            is_p2tr = False
-
-            # Check the transaction type for each input (vin)
-            for input_data in data["vin"]:
-                if "prevout" in input_data:
-                    if input_data["prevout"]["scriptpubkey_type"] == "p2pkh":
-                        is_p2pkh = True
-                    elif input_data["prevout"]["scriptpubkey_type"] == "v0_p2wpkh":
-                        is_p2wpkh = True
-                    elif input_data["prevout"]["scriptpubkey_type"] == "v1_p2tr":
-                        is_p2tr = True
-
-            # Increment the count based on the transaction type
-            if is_p2pkh:
-                p2pkh_count += 1
-            elif is_p2wpkh:
-                p2wpkh_count += 1
-            elif is_p2tr:
-                p2tr_count += 1
-
-    return p2pkh_count, p2wpkh_count, p2tr_count
-
-
-# Specify the folder path containing the JSON transaction files
-folder_path = "mempool_valid"
-
-# Count the number of p2pkh, p2wpkh & p2tr_count transactions
-p2pkh_count, p2wpkh_count, p2tr_count = count_transaction_types(folder_path)
-
-# Print the results
-print(f"Number of P2PKH transactions: {p2pkh_count}")
-print(f"Number of P2WPKH transactions: {p2wpkh_count}")
-print(f"Number of P2TR transactions: {p2tr_count}")
+import sys
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_files"))
+
+from block_builder import build_graph, select_transactions
+from classifier import mask_names
+from ingest import ingest_mempool
+from metrics import METRICS, SamplingProfiler
+from mining import mine_block, write_block
+from out_of_core import load_selected, select_candidates, spill_mempool
+from outpoint_index import OutpointIndex
+from result_cache import ResultCache
+from sigcache import SignatureCache
+from snapshot import Snapshot, write_snapshot
+from tail_optimizer import TAIL_BUDGET, TAIL_WEIGHT, optimize_tail
+from validation import validate_records
+from verifier import set_signature_cache
+from watch import MempoolWatcher
+
+
+def count_transaction_types(records):
+    # Transactions spending each template; a mixed one counts for each of its
+    # templates and once more as mixed
+    counts = Counter()
+    for record in records:
+        counts.update(mask_names(record["mask"]))
+    return counts
+
+
+def print_type_counts(total, counts):
+    print(f"Number of valid transactions: {total}")
+    for name in ("p2pkh", "p2sh", "p2wpkh", "p2wsh", "p2tr", "mixed"):
+        print(f"Number of {name.upper()} transactions: {counts[name]}")
+
+
+def build_out_of_core(args, profiler):
+    """Block template of the mempool folder with bounded memory.
+
+    The folder is validated in shards spilled to sorted run files, the
+    merged runs feed the selection by fee rate, and only the selected files
+    are parsed again.
+    """
+    cache = ResultCache(os.path.join(args.cache_dir, "results.sqlite"))
+    with tempfile.TemporaryDirectory(prefix="spill-", dir=args.cache_dir) as directory:
+        with METRICS.timer("stage_seconds", stage="ingest"):
+            mempool = spill_mempool(args.mempool, directory, args.shard_size, args.workers, cache, profiler)
+        cache.close()
+        print_type_counts(mempool.transactions, mempool.counts)
+        print(f"Number of transactions with valid inputs: {mempool.valid}")
+
+        with METRICS.timer("stage_seconds", stage="select"):
+            block, _, _ = select_candidates(mempool)
+        with METRICS.timer("stage_seconds", stage="reread"):
+            template = load_selected(mempool, args.mempool, block)
+        mempool.close()
+    return template
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Validate the mempool and mine a block")
+    parser.add_argument("--mempool", default="mempool", help="folder of transaction JSON files")
+    parser.add_argument("--output", default="output.txt", help="where the block is written")
+    parser.add_argument("--cache-dir", default=".cache", help="folder for the result cache and the outpoint index")
+    parser.add_argument("--signature-cache", help="sqlite file keeping the verified signatures between runs (default: signatures.sqlite in the cache folder)")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use (default: all cores)")
+    parser.add_argument("--snapshot", help="read the mempool from this snapshot file instead of the folder")
+    parser.add_argument("--export-snapshot", help="write the validated mempool to this snapshot file")
+    parser.add_argument("--watch", action="store_true", help="keep running and follow the changes of the mempool folder")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between two scans when inotify is not available")
+    parser.add_argument("--metrics-file", help="write the metrics to this file in the Prometheus text format")
+    parser.add_argument("--metrics-port", type=int, help="serve the metrics on http://127.0.0.1:PORT/metrics in watch mode")
+    parser.add_argument("--profile-validators", type=int, metavar="N", help="run cProfile on one validated input out of N")
+    parser.add_argument("--profile-output", help="file for the raw cProfile stats of --profile-validators")
+    parser.add_argument("--tail-budget", type=float, default=TAIL_BUDGET, help="seconds spent refilling the end of the block (0 to keep the greedy selection)")
+    parser.add_argument("--tail-weight", type=int, default=TAIL_WEIGHT, help="weight at the end of the block the tail optimizer may replace")
+    parser.add_argument("--shard-size", type=int, metavar="N", help="bounded memory mode: validate N files at a time and select from sorted run files")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.makedirs(args.cache_dir, exist_ok=True)
+    profiler = SamplingProfiler(args.profile_validators) if args.profile_validators else None
+    # Signatures verified by an earlier run are not checked again; the new
+    # ones are written to the file when the program ends
+    sigcache = SignatureCache(path=args.signature_cache or os.path.join(args.cache_dir, "signatures.sqlite"))
+    set_signature_cache(sigcache)
+    atexit.register(sigcache.close)
+
+    if args.watch:
+        # Incremental mode: only changed files are validated again
+        if args.metrics_port:
+            METRICS.serve(args.metrics_port)
+        watcher = MempoolWatcher(
+            args.mempool,
+            args.cache_dir,
+            args.output,
+            args.workers,
+            metrics_file=args.metrics_file,
+            profiler=profiler,
+            tail_budget=args.tail_budget,
+            tail_weight=args.tail_weight,
+        )
+        watcher.run(args.interval)
+        sys.exit(0)
+
+    if args.shard_size:
+        template = build_out_of_core(args, profiler)
+    else:
+        # Read, check and hash every transaction in one pass, indexing the
+        # outpoints they spend. The index of the last run is loaded first:
+        # only the new transactions are added and the gone ones dropped
+        index_path = os.path.join(args.cache_dir, "outpoints.sqlite")
+        index = OutpointIndex.load(index_path)
+        cache = None
+        # txids of the files failing the structural check
+        rejected = set()
+        with METRICS.timer("stage_seconds", stage="ingest"):
+            if args.snapshot:
+                # One mapped file instead of thousands, verdicts included
+                with Snapshot(args.snapshot) as snapshot:
+                    records = snapshot.records()
+                    rejected = snapshot.rejected_txids()
+                for record in records:
+                    index.add(record)
+            else:
+                # Unchanged files come from the result cache, without parsing
+                # them. A snapshot needs every transaction parsed, so it skips
+                # the cache.
+                if not args.export_snapshot:
+                    cache = ResultCache(os.path.join(args.cache_dir, "results.sqlite"))
+                records = ingest_mempool(args.mempool, args.workers, index, cache, rejected)
+            index.retain({record["txid"] for record in records})
+            if index.dirty:
+                index.save(index_path)
+
+        # Count the transactions of every input type
+        print_type_counts(len(records), count_transaction_types(records))
+        print(f"Number of double spent outpoints: {len(index.double_spends())}")
+        print(f"Number of transactions replacing others (BIP125): {sum(1 for txid in index.entries if index.rbf_candidates(txid))}")
+
+        # Verify the scripts and signatures of every input not in the cache
+        with METRICS.timer("stage_seconds", stage="validate"):
+            valid = validate_records(records, cache, profiler)
+        print(f"Number of transactions with valid inputs: {len(valid)}")
+        if cache is not None:
+            cache.close()
+        if args.export_snapshot:
+            write_snapshot(args.export_snapshot, records, rejected)
+
+        # Select the transactions of the block by ancestor fee rate. The
+        # refused transactions are kept apart from the valid ones: their
+        # descendants can not be mined either
+        excluded = rejected | {record["txid"] for record in records if not record["valid"]}
+        with METRICS.timer("stage_seconds", stage="select"):
+            graph = build_graph(valid, excluded, index)
+            template = select_transactions(graph)
+        if args.tail_budget > 0:
+            # Swap the last packages for a better fitting set
+            with METRICS.timer("stage_seconds", stage="tail"):
+                template, tail = optimize_tail(graph, template, args.tail_budget, args.tail_weight)
+            print(
+                f"Tail optimizer: {tail.fee_gain:+} sats, {tail.weight_gain:+} WU over the greedy selection "
+                f"({tail.nodes} nodes in {tail.seconds:.2f}s, {'optimal' if tail.complete else 'not proven optimal'})"
+            )
+    print(f"Transactions in block: {len(template.transactions)}")
+    print(f"Total fees: {template.fees} sats")
+    print(f"Block weight used: {template.weight} WU")
+
+    # Mine the block and write it to the output file
+    with METRICS.timer("stage_seconds", stage="mine"):
+        block = mine_block(template, workers=args.workers)
+    print(f"Block hash: {block.block_hash}")
+
+    write_block(block, args.output)
+
+    print("\nMetrics:")
+    print(METRICS.summary())
+    if args.metrics_file:
+        METRICS.write_prometheus(args.metrics_file)
+    if profiler is not None:
+        print("\nValidator profile:")
+        print(profiler.report(args.profile_output))
@@ -0,0 +1,400 @@
+import bisect
+import heapq
+
+from outpoint_index import OutpointIndex
+
+MAX_BLOCK_WEIGHT = 4000000
+# Header plus the space kept free for the coinbase transaction
+BLOCK_HEADER_WEIGHT = 80 * 4
+COINBASE_RESERVED_WEIGHT = 4000
+MAX_TEMPLATE_WEIGHT = MAX_BLOCK_WEIGHT - BLOCK_HEADER_WEIGHT - COINBASE_RESERVED_WEIGHT
+
+
+class BlockTemplate:
+    def __init__(self, transactions, fees, weight):
+        # Transactions in the order they go in the block (parents first)
+        self.transactions = transactions
+        self.fees = fees
+        self.weight = weight
+
+
+class MempoolEntry:
+    __slots__ = (
+        "tx",
+        "txid",
+        "fee",
+        "weight",
+        "parents",
+        "children",
+        "ancestors",
+        "ancestor_fee",
+        "ancestor_weight",
+    )
+
+    def __init__(self, tx):
+        self.tx = tx
+        self.txid = tx.txid
+        self.fee = tx.fee
+        self.weight = tx.weight
+        self.parents = set()
+        self.children = set()
+        # Ancestor set (the transaction included) and its totals
+        self.ancestors = {self.txid}
+        self.ancestor_fee = self.fee
+        self.ancestor_weight = self.weight
+
+
+class MempoolGraph:
+    """Validated transactions linked to their in-mempool parents.
+
+    Transactions can be added and removed one at a time; only the ancestor
+    sets of the descendants of the changed transaction are recomputed.
+    Parents, children and conflicts come from an OutpointIndex: the one of
+    the mempool when given, which must hold every transaction added, else
+    one the graph keeps itself.
+    """
+
+    def __init__(self, excluded_txids=None, index=None):
+        self.entries = {}
+        self.own_index = index is None
+        self.index = OutpointIndex() if index is None else index
+        # Transactions known to be in the mempool but not valid: their
+        # descendants can not be mined
+        self.excluded = set(excluded_txids or ())
+        # txids added, removed or given a new ancestor set since the
+        # BlockSelector following the graph last read them, None without one
+        self.changed = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, txid):
+        return txid in self.entries
+
+    def add(self, tx):
+        if self.own_index:
+            self.index.add_transaction(tx)
+        # Spending one outpoint twice is invalid, like a refused parent
+        if self.index.spends_twice(tx.txid) or any(vin.txid in self.excluded for vin in tx.vin):
+            self.exclude(tx.txid)
+            return False
+
+        entry = MempoolEntry(tx)
+        self.entries[entry.txid] = entry
+        for parent_txid in self.index.parents(entry.txid):
+            if parent_txid in self.entries:
+                entry.parents.add(parent_txid)
+                self.entries[parent_txid].children.add(entry.txid)
+        for child_txid in self.index.children(entry.txid):
+            if child_txid in self.entries:
+                entry.children.add(child_txid)
+                self.entries[child_txid].parents.add(entry.txid)
+
+        self._update_ancestors([entry.txid] + list(self.descendants_of(entry.txid)))
+        return True
+
+    def add_all(self, transactions):
+        # Adding parents first keeps every ancestor update local
+        pending = {tx.txid: tx for tx in transactions}
+        added = set()
+
+        def add(tx):
+            for vin in tx.vin:
+                parent = pending.get(vin.txid)
+                if parent is not None and vin.txid not in added:
+                    add(parent)
+            added.add(tx.txid)
+            self.add(tx)
+
+        for tx in pending.values():
+            if tx.txid not in added:
+                add(tx)
+
+    def exclude(self, txid):
+        """Marks txid as an invalid mempool transaction.
+
+        Returns:
+          The txids removed from the graph (txid and its descendants,
+          children that arrived before txid included).
+        """
+        self.excluded.add(txid)
+        if txid in self.entries:
+            return self.remove(txid)
+        removed = []
+        for child_txid in list(self.index.children(txid)):
+            if child_txid in self.entries:
+                removed.extend(self.exclude(child_txid))
+        return removed
+
+    def remove(self, txid):
+        """Removes txid and, when it was excluded, all its descendants.
+
+        Returns:
+          The txids removed from the graph.
+        """
+        entry = self.entries.get(txid)
+        if entry is None:
+            return []
+        descendants = self.descendants_of(txid)
+        removed = [txid]
+        if txid in self.excluded:
+            removed.extend(descendants)
+            self.excluded.update(descendants)
+            descendants = set()
+
+        for removed_txid in removed:
+            removed_entry = self.entries.pop(removed_txid)
+            if self.own_index:
+                self.index.remove(removed_txid)
+            for parent_txid in removed_entry.parents:
+                if parent_txid in self.entries:
+                    self.entries[parent_txid].children.discard(removed_txid)
+            for child_txid in removed_entry.children:
+                if child_txid in self.entries:
+                    self.entries[child_txid].parents.discard(removed_txid)
+
+        if self.changed is not None:
+            self.changed.update(removed)
+        self._update_ancestors(descendants)
+        return removed
+
+    def descendants_of(self, txid):
+        descendants = set()
+        stack = list(self.entries[txid].children)
+        while stack:
+            child = stack.pop()
+            if child not in descendants and child in self.entries:
+                descendants.add(child)
+                stack.extend(self.entries[child].children)
+        return descendants
+
+    def _update_ancestors(self, txids):
+        # Parents are always processed before their children
+        pending = {txid for txid in txids if txid in self.entries}
+        done = set()
+        if self.changed is not None:
+            self.changed.update(pending)
+
+        def visit(txid):
+            if txid in done:
+                return
+            entry = self.entries[txid]
+            ancestors = {txid}
+            for parent_txid in entry.parents:
+                if parent_txid in pending:
+                    visit(parent_txid)
+                ancestors |= self.entries[parent_txid].ancestors
+            entry.ancestors = ancestors
+            entry.ancestor_fee = sum(self.entries[a].fee for a in ancestors)
+            entry.ancestor_weight = sum(self.entries[a].weight for a in ancestors)
+            done.add(txid)
+
+        for txid in pending:
+            visit(txid)
+
+
+def build_graph(transactions, excluded_txids=(), index=None):
+    """Links the transactions to their in-mempool parents.
+
+    Args:
+      transactions: Validated Transaction objects.
+      excluded_txids: txids of the mempool transactions left out of
+        transactions: failing the structural check or with invalid inputs.
+        Their descendants are dropped too, they can not be mined without
+        them.
+      index: Optional OutpointIndex of the mempool, holding at least
+        transactions; the parent, child and conflict lookups use it instead
+        of a new index.
+
+    Returns:
+      A MempoolGraph.
+    """
+    graph = MempoolGraph(excluded_txids, index)
+    graph.add_all(transactions)
+    return graph
+
+
+class BlockSelector:
+    """Ancestor fee rate selection following the changes of a MempoolGraph.
+
+    The selected packages, the per transaction scores and the packages that
+    did not fit are kept between calls of select(). The graph logs the
+    transactions it adds, removes or re-scores; select() rolls the block
+    back to the first package these changes can affect, re-scores only the
+    changed transactions and the descendants of the packages rolled back,
+    and resumes the greedy selection from there.
+    """
+
+    def __init__(self, graph, max_weight=MAX_TEMPLATE_WEIGHT):
+        self.graph = graph
+        self.max_weight = max_weight
+        # txid -> [ancestors not in the block, fee, weight, version]; the
+        # version is bumped when the score changes and older heap entries
+        # are then ignored
+        self.state = {}
+        self.heap = []
+        # Selected packages in block order: (heap key, transactions, fee,
+        # weight)
+        self.packages = []
+        # Highest heap key (lowest score) of packages[: i + 1], never
+        # decreasing
+        self.bounds = []
+        # txid -> index of its package in packages
+        self.position = {}
+        # (len(packages) when skipped, txid) of the packages that did not fit
+        self.skipped = []
+        self.fees = 0
+        self.weight = 0
+        # Every transaction of the graph is new to the first select()
+        graph.changed = set(graph.entries)
+
+    def _rollback(self, cut):
+        # Drops packages[cut:] from the block, returns their txids
+        dropped = set()
+        for _, transactions, fee, weight in self.packages[cut:]:
+            for tx in transactions:
+                del self.position[tx.txid]
+                dropped.add(tx.txid)
+            self.fees -= fee
+            self.weight -= weight
+        del self.packages[cut:]
+        del self.bounds[cut:]
+        return dropped
+
+    def _push(self, txid):
+        # Scores txid against the packages in the block
+        entry = self.graph.entries[txid]
+        ancestors = {ancestor for ancestor in entry.ancestors if ancestor not in self.position}
+        fee = sum(self.graph.entries[ancestor].fee for ancestor in ancestors)
+        weight = sum(self.graph.entries[ancestor].weight for ancestor in ancestors)
+        version = self.state[txid][3] + 1 if txid in self.state else 0
+        self.state[txid] = [ancestors, fee, weight, version]
+        heapq.heappush(self.heap, (-fee / weight, txid, version))
+
+    def select(self):
+        """Brings the block up to date with the graph.
+
+        Returns:
+          A BlockTemplate.
+        """
+        graph = self.graph
+        entries = graph.entries
+        changed, graph.changed = graph.changed, set()
+
+        # A selected transaction that changed invalidates its package and
+        # everything after it; a new score invalidates the packages scoring
+        # below it (its full ancestor package is the estimate, the ancestors
+        # already in the block are not known before the cut)
+        cut = len(self.packages)
+        for txid in changed:
+            if txid in self.position:
+                cut = min(cut, self.position[txid])
+            elif txid in entries:
+                entry = entries[txid]
+                key = -entry.ancestor_fee / entry.ancestor_weight
+                cut = min(cut, bisect.bisect_right(self.bounds, key))
+
+        rescore = set(changed)
+        for txid in self._rollback(cut):
+            rescore.add(txid)
+            if txid in entries:
+                rescore |= graph.descendants_of(txid)
+        for txid in rescore:
+            if txid not in entries:
+                self.state.pop(txid, None)
+            elif txid not in self.position:
+                self._push(txid)
+
+        # Packages skipped before the cut were refused by the same block
+        # prefix, and a prefix only grows: they stay refused. So do the
+        # packages too heavy for the block rolled back to the cut.
+        skipped = []
+        for position, txid in self.skipped:
+            if txid not in entries or txid in rescore:
+                continue
+            if position < cut:
+                skipped.append((position, txid))
+            elif self.weight + self.state[txid][2] > self.max_weight:
+                skipped.append((cut, txid))
+            else:
+                _, fee, weight, version = self.state[txid]
+                heapq.heappush(self.heap, (-fee / weight, txid, version))
+        self.skipped = skipped
+
+        self._fill()
+        return BlockTemplate(
+            [tx for package in self.packages for tx in package[1]], self.fees, self.weight
+        )
+
+    def _fill(self):
+        entries = self.graph.entries
+        conflicts = self.graph.index.conflicts
+        state = self.state
+        heap = self.heap
+        position = self.position
+
+        while heap:
+            key, txid, version = heapq.heappop(heap)
+            if txid in position or txid not in state:
+                continue
+            ancestors, package_fee, package_weight, current = state[txid]
+            if version != current:
+                continue
+            if self.weight + package_weight > self.max_weight:
+                self.skipped.append((len(self.packages), txid))
+                continue
+
+            # Package = the transaction and its ancestors not in the block yet,
+            # parents first (an ancestor always has fewer ancestors)
+            package = sorted(
+                (entries[ancestor] for ancestor in ancestors),
+                key=lambda item: len(item.ancestors),
+            )
+            if any(
+                other in position or other in ancestors
+                for item in package
+                for other in conflicts(item.txid)
+            ):
+                # Conflicts with a transaction already in the block or
+                # within the package
+                self.skipped.append((len(self.packages), txid))
+                continue
+
+            for item in package:
+                position[item.txid] = len(self.packages)
+            self.packages.append((key, [item.tx for item in package], package_fee, package_weight))
+            self.bounds.append(max(key, self.bounds[-1]) if self.bounds else key)
+            self.fees += package_fee
+            self.weight += package_weight
+
+            # Incremental update: descendants of the new transactions lose the
+            # included ancestors from their package and are pushed again
+            updated = set()
+            for item in package:
+                updated |= self.graph.descendants_of(item.txid)
+            for child_txid in updated:
+                if child_txid in position:
+                    continue
+                child = state[child_txid]
+                removed = [txid for txid in child[0] if txid in position]
+                if not removed:
+                    continue
+                child[0] = child[0].difference(removed)
+                child[1] -= sum(entries[txid].fee for txid in removed)
+                child[2] -= sum(entries[txid].weight for txid in removed)
+                child[3] += 1
+                heapq.heappush(heap, (-child[1] / child[2], child_txid, child[3]))
+
+
+def select_transactions(graph, max_weight=MAX_TEMPLATE_WEIGHT):
+    """Selects transactions by ancestor fee rate (CPFP aware).
+
+    A transaction is scored with the fee rate of itself plus all its
+    not yet included ancestors. The best package is taken from a heap, and
+    only the descendants of the included transactions get a new score.
+    The transactions of the graph are not modified.
+
+    Returns:
+      A BlockTemplate.
+    """
+    return BlockSelector(graph, max_weight).select()
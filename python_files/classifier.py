@@ -0,0 +1,109 @@
+from script_validation import (
+    OP_0,
+    OP_1,
+    OP_CHECKSIG,
+    OP_DUP,
+    OP_EQUAL,
+    OP_EQUALVERIFY,
+    OP_HASH160,
+    match_template,
+)
+
+# One bit per template in the type mask of a transaction
+P2PKH = 1 << 0
+P2SH = 1 << 1
+P2WPKH = 1 << 2
+P2WSH = 1 << 3
+P2TR = 1 << 4
+OTHER = 1 << 5
+# Set when the inputs spend more than one template
+MIXED = 1 << 6
+
+TEMPLATE_BITS = {
+    "p2pkh": P2PKH,
+    "p2sh": P2SH,
+    "p2wpkh": P2WPKH,
+    "p2wsh": P2WSH,
+    "p2tr": P2TR,
+    "witness_unknown": OTHER,
+    None: OTHER,
+}
+MASK_NAMES = (
+    (P2PKH, "p2pkh"),
+    (P2SH, "p2sh"),
+    (P2WPKH, "p2wpkh"),
+    (P2WSH, "p2wsh"),
+    (P2TR, "p2tr"),
+    (OTHER, "other"),
+    (MIXED, "mixed"),
+)
+
+# (size, first byte, second byte) of the fixed size templates, the bytes
+# that follow are checked for the legacy ones only
+_SHAPES = {
+    (25, OP_DUP, OP_HASH160): "p2pkh",
+    (23, OP_HASH160, 20): "p2sh",
+    (22, OP_0, 20): "p2wpkh",
+    (34, OP_0, 32): "p2wsh",
+    (34, OP_1, 32): "p2tr",
+}
+
+
+def classify_script(script):
+    """Template of a scriptPubKey, same result as match_template().
+
+    The common templates are found with one dict lookup on the size and the
+    first two bytes instead of trying every template in turn.
+    """
+    if len(script) >= 2:
+        template = _SHAPES.get((len(script), script[0], script[1]))
+        if template == "p2pkh":
+            if script[2] == 20 and script[23] == OP_EQUALVERIFY and script[24] == OP_CHECKSIG:
+                return template
+        elif template == "p2sh":
+            if script[22] == OP_EQUAL:
+                return template
+        elif template is not None:
+            return template
+    return match_template(script)
+
+
+def input_templates(tx):
+    # Template of the prevout of every input
+    return [classify_script(vin.prevout.script_pubkey) for vin in tx.vin]
+
+
+def type_mask(tx):
+    """Bitmask of the templates spent by the inputs of tx.
+
+    Returns:
+      The OR of the template bits, with MIXED added when more than one is
+      set; 0 for a transaction without inputs.
+    """
+    mask = 0
+    for template in input_templates(tx):
+        mask |= TEMPLATE_BITS[template]
+    if mask & (mask - 1):
+        mask |= MIXED
+    return mask
+
+
+def mask_names(mask):
+    return [name for bit, name in MASK_NAMES if mask & bit]
+
+
+def route_inputs(transactions):
+    """Routing table of a batch of transactions.
+
+    Args:
+      transactions: Transactions with their prevouts.
+
+    Returns:
+      A dict of template -> list of (position in transactions, input index),
+      so each validator can be handed all of its inputs at once.
+    """
+    routes = {}
+    for position, tx in enumerate(transactions):
+        for index, template in enumerate(input_templates(tx)):
+            routes.setdefault(template, []).append((position, index))
+    return routes
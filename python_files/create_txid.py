@@ -1,7 +1,8 @@
 import json
 import struct
 import hashlib
-import os
+
+from reader import list_json_files, prefetch_files
 
 
 def compact_size(size):
@@ -15,8 +16,8 @@ def compact_size(size):
         return struct.pack("<B", 255) + struct.pack("<Q", size)
 
 
-def create_txid(json_data):
-    data = json.loads(json_data)
+def serialize_transaction(data):
+    # Legacy (non-witness) serialization of an already parsed transaction
     tx_data = struct.pack("<I", data["version"])
     tx_data += compact_size(len(data["vin"]))
     for vin in data["vin"]:
@@ -36,25 +37,36 @@ def create_txid(json_data):
     return tx_data
 
 
-# Specify the folder path containing the JSON files
-folder_path = "./mempool_valid/"
+def create_txid(json_data):
+    return serialize_transaction(json.loads(json_data))
+
 
-# Iterate over the JSON files in the folder
-for filename in os.listdir(folder_path):
-    if filename.endswith(".json"):
-        file_path = os.path.join(folder_path, filename)
+def compute_txid(tx_bytes):
+    # txid is the byte-reversed double SHA-256 of the legacy serialization
+    return hashlib.sha256(hashlib.sha256(tx_bytes).digest()).digest()[::-1].hex()
 
-        # Read the JSON file
-        with open(file_path, "r") as file:
-            json_data = file.read()
+
+if __name__ == "__main__":
+    # Specify the folder path containing the JSON files
+    folder_path = "./mempool_valid/"
+
+    # Iterate over the JSON files in the folder, read ahead by a thread pool
+    for file_path, json_data in prefetch_files(list_json_files(folder_path)):
+        if json_data is None:
+            continue
 
         # Create the txid for the transaction
         tx_bytes = create_txid(json_data)
-        txid = hashlib.sha256(hashlib.sha256(tx_bytes).digest()).digest()[::-1].hex()
+        txid = compute_txid(tx_bytes)
 
         # Load the JSON data into a dictionary
         data = json.loads(json_data)
 
+        # Already done by an earlier run: leave the file untouched
+        if data.get("txid") == txid:
+            continue
+        data.pop("txid", None)
+
         # Create a new dictionary with txid as the first property
         updated_data = {"txid": txid}
         updated_data.update(data)
@@ -0,0 +1,174 @@
+import json
+import os
+from typing import Any, List, Optional
+
+from structural_check import check_transaction
+from transaction import Transaction, TxIn, TxOut
+
+
+class JsonDecoder:
+    # Standard library fallback, always available
+    name = "json"
+
+    def __init__(self):
+        self._loads = json.loads
+
+    def decode(self, data):
+        try:
+            tx_data = self._loads(data)
+            if not check_transaction(tx_data):
+                return None
+            tx = Transaction.from_dict(tx_data)
+        except (KeyError, TypeError, ValueError):
+            return None
+        # check_transaction() lets an input without a prevout through
+        if any(vin.prevout is None for vin in tx.vin):
+            return None
+        return tx
+
+
+class OrjsonDecoder(JsonDecoder):
+    # Same dicts as json, built by a C parser
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self._loads = orjson.loads
+
+
+class MsgspecDecoder:
+    """Decodes straight into typed structs holding only the used fields.
+
+    The other fields of the files (the *_asm and address strings are only
+    declared for check_transaction()) are skipped by the parser. The fields
+    check_transaction() checks are typed Any and absent ones are
+    msgspec.UNSET, so the same check_transaction() runs on the structs,
+    through getattr(), and gives the verdict of the json path.
+    """
+
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+
+        unset = msgspec.UNSET
+
+        class Output(msgspec.Struct):
+            scriptpubkey: Any
+            value: Any
+            scriptpubkey_type: Any = None
+            scriptpubkey_asm: Any = unset
+            scriptpubkey_address: Any = unset
+
+        class Input(msgspec.Struct):
+            txid: Any
+            vout: Any
+            scriptsig: Any
+            sequence: Any
+            is_coinbase: Any = unset
+            scriptsig_asm: Any = unset
+            prevout: Optional[Output] = None
+            witness: List[str] = []
+
+        class Tx(msgspec.Struct):
+            version: Any
+            locktime: Any
+            vin: List[Input]
+            vout: List[Output]
+
+        self._unset = unset
+        self._decoder = msgspec.json.Decoder(Tx)
+        self._errors = (msgspec.DecodeError, TypeError, ValueError)
+
+    def decode(self, data):
+        try:
+            tx_data = self._decoder.decode(data)
+            if not check_transaction(tx_data, getattr, self._unset):
+                return None
+            # Like the json path: an input without a prevout is refused
+            if any(item.prevout is None for item in tx_data.vin):
+                return None
+            vin = []
+            for item in tx_data.vin:
+                is_coinbase = item.is_coinbase
+                vin.append(
+                    TxIn(
+                        bytes.fromhex(item.txid)[::-1],
+                        item.vout,
+                        bytes.fromhex(item.scriptsig),
+                        item.sequence,
+                        tuple(bytes.fromhex(w) for w in item.witness),
+                        _output(item.prevout),
+                        False if is_coinbase is self._unset else is_coinbase,
+                    )
+                )
+            vout = [_output(item) for item in tx_data.vout]
+        except self._errors:
+            return None
+        return Transaction(tx_data.version, tx_data.locktime, vin, vout)
+
+
+def _output(item):
+    return TxOut(item.value, bytes.fromhex(item.scriptpubkey), item.scriptpubkey_type)
+
+
+# Fastest first
+DECODERS = {
+    "msgspec": MsgspecDecoder,
+    "orjson": OrjsonDecoder,
+    "json": JsonDecoder,
+}
+
+_decoder = None
+
+
+def select_decoder(name=None):
+    """Picks the JSON decoder of the mempool files.
+
+    Args:
+      name: One of DECODERS. When omitted the JSON_DECODER environment
+        variable is used, otherwise the first one whose package imports.
+
+    Returns:
+      The decoder.
+    """
+    global _decoder
+    name = name or os.environ.get("JSON_DECODER")
+    if name:
+        _decoder = DECODERS[name]()
+        return _decoder
+    for decoder in DECODERS.values():
+        try:
+            _decoder = decoder()
+            return _decoder
+        except ImportError:
+            continue
+    raise ImportError("no JSON decoder available")
+
+
+def get_decoder():
+    if _decoder is None:
+        select_decoder()
+    return _decoder
+
+
+def decode_transaction(data):
+    # Transaction of a mempool file, None when it is malformed
+    return get_decoder().decode(data)
+
+
+def decode_unchecked(data):
+    """Transaction of a file that failed the structural check.
+
+    Only its txid is used: a refused transaction still takes its outputs
+    away from the children spending them. The standard library parser is
+    enough for the few files that get here.
+
+    Returns:
+      The Transaction, None when the fields of the txid are missing.
+    """
+    try:
+        return Transaction.from_dict(json.loads(data))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
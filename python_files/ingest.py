@@ -0,0 +1,232 @@
+import hashlib
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from classifier import type_mask
+from decoder import decode_transaction, decode_unchecked
+from metrics import METRICS
+from reader import list_json_files, prefetch_files
+
+# Cache misses handed to the process pool at a time: their contents stay in
+# memory until a worker parsed them
+MISS_BATCH = 1024
+
+
+def ingest_file(filepath):
+    """Reads, checks and serializes a single mempool file.
+
+    Args:
+      filepath: Path of the transaction JSON file.
+
+    Returns:
+      A record dict for a structurally valid transaction, None otherwise.
+    """
+    try:
+        with open(filepath, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    return ingest_bytes(os.path.basename(filepath), data)
+
+
+def ingest_bytes(filename, data):
+    """Same as ingest_file for the raw content of a file that was already read.
+
+    Returns:
+      A record dict, None when the content is not a transaction. A file
+      failing the structural check gets a rejected_record() carrying its
+      txid, so that its descendants can be left out.
+    """
+    tx = decode_transaction(data)
+    if tx is None:
+        tx = decode_unchecked(data)
+        try:
+            return rejected_record(filename, tx.txid) if tx is not None else None
+        except (KeyError, TypeError, ValueError, struct.error):
+            return None
+    try:
+        txid = tx.txid
+        mask = type_mask(tx)
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+    return {
+        "filename": filename,
+        "txid": txid,
+        "mask": mask,
+        "tx": tx,
+    }
+
+
+def rejected_record(filename, txid):
+    # Record of a file failing the structural check; txid None when it can
+    # not be computed
+    return {
+        "filename": filename,
+        "txid": txid,
+        "mask": None,
+        "tx": None,
+        "valid": False,
+        "rejected": "structure",
+    }
+
+
+def is_structural(record):
+    return record is not None and record["tx"] is not None
+
+
+def content_key(data):
+    # Key of a file in the result cache
+    return hashlib.sha256(data).digest()
+
+
+def list_mempool(mempool_folder):
+    return list_json_files(mempool_folder)
+
+
+def _ingest_task(path):
+    # ingest_file plus the number of bytes read, for the metrics of the
+    # parent process
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None, 0
+    return ingest_bytes(os.path.basename(path), data), len(data)
+
+
+def _parse_task(item):
+    # ingest_bytes() in a worker, on content the parent process read
+    filename, data = item
+    return ingest_bytes(filename, data)
+
+
+def _ingest_prefetched(paths):
+    # Single process: reader threads keep the next files coming while this
+    # thread parses
+    for path, data in prefetch_files(paths):
+        if data is None:
+            yield None, 0
+        else:
+            yield ingest_bytes(os.path.basename(path), data), len(data)
+
+
+def _ingest_paths(paths, workers, chunksize):
+    # One result per path, in order, None for the files failing the checks
+    if workers <= 1:
+        results = _ingest_prefetched(paths)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_ingest_task, paths, chunksize=chunksize)
+    try:
+        for record, size in results:
+            METRICS.inc("files_read")
+            METRICS.inc("bytes_read", size)
+            METRICS.inc("structure", verdict="valid" if is_structural(record) else "invalid")
+            yield record
+    finally:
+        if workers > 1:
+            executor.shutdown()
+
+
+def iter_mempool(mempool_folder, workers=None, chunksize=64, cache=None, rejected=None):
+    """Single pass over the mempool: every file is read and parsed once.
+
+    Args:
+      mempool_folder: Folder of transaction JSON files.
+      workers: Number of processes parsing the files.
+      chunksize: Files handed to a worker at a time.
+      cache: Optional ResultCache. Files whose content it knows are not
+        parsed and their records carry the cached verdict.
+      rejected: Optional set, filled with the txids of the files failing the
+        structural check.
+
+    Yields:
+      Record dicts of the structurally valid transactions.
+    """
+    return iter_paths(list_mempool(mempool_folder), workers, chunksize, cache, rejected)
+
+
+def iter_paths(paths, workers=None, chunksize=64, cache=None, rejected=None):
+    # iter_mempool() over a list of files, e.g. one shard of the folder
+    if rejected is None:
+        rejected = set()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if cache is None:
+        for record in _ingest_paths(paths, workers, chunksize):
+            if is_structural(record):
+                yield record
+            else:
+                _reject(record, rejected, None, None)
+        return
+
+    # Every file is read once, here: its cache key and, on a miss, its
+    # parsed content come from the same bytes. Misses are parsed in place
+    # or sent with their content to the workers.
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    # (cache key, (filename, content)) of the misses waiting for a worker
+    missed = []
+    try:
+        for path, data in prefetch_files(paths):
+            if data is None:
+                continue
+            METRICS.inc("files_read")
+            METRICS.inc("bytes_read", len(data))
+            filename = os.path.basename(path)
+            key = content_key(data)
+            record = cache.get(key, filename)
+            if record is not None:
+                if record["tx"] is not None:
+                    yield record
+                elif record["txid"] is not None:
+                    rejected.add(record["txid"])
+            elif executor is None:
+                yield from _parsed([key], [ingest_bytes(filename, data)], rejected, cache)
+            else:
+                missed.append((key, (filename, data)))
+                if len(missed) >= MISS_BATCH:
+                    yield from _parse_missed(executor, missed, chunksize, rejected, cache)
+        if missed:
+            yield from _parse_missed(executor, missed, chunksize, rejected, cache)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def _parse_missed(executor, missed, chunksize, rejected, cache):
+    keys = [key for key, _ in missed]
+    records = list(executor.map(_parse_task, [item for _, item in missed], chunksize=chunksize))
+    missed.clear()
+    yield from _parsed(keys, records, rejected, cache)
+
+
+def _parsed(keys, records, rejected, cache):
+    # Records of parsed cache misses, keyed for validate_records()
+    for key, record in zip(keys, records):
+        METRICS.inc("structure", verdict="valid" if is_structural(record) else "invalid")
+        if is_structural(record):
+            record["key"] = key
+            yield record
+        else:
+            _reject(record, rejected, cache, key)
+
+
+def _reject(record, rejected, cache, key):
+    # Remembers a file failing the structural check, in the cache too
+    txid = record["txid"] if record is not None else None
+    if txid is not None:
+        rejected.add(txid)
+    if cache is not None:
+        cache.put_malformed(key, txid)
+
+
+def ingest_mempool(mempool_folder, workers=None, index=None, cache=None, rejected=None):
+    # index: optional OutpointIndex filled while the records stream in
+    records = []
+    for record in iter_mempool(mempool_folder, workers, cache=cache, rejected=rejected):
+        records.append(record)
+        if index is not None:
+            index.add(record)
+    return records
@@ -0,0 +1,116 @@
+from transaction import hash256
+
+
+class MerkleTree:
+    """Bitcoin merkle tree that keeps every level.
+
+    Changing a leaf only rehashes the nodes on its path to the root, and
+    replacing the leaves after some index only rehashes from that index.
+    Odd levels pair their last node with itself, like Bitcoin does.
+    """
+
+    def __init__(self, leaves=()):
+        # levels[0] are the leaves (internal byte order), levels[-1] the root
+        self.levels = [list(leaves)]
+        self._refresh(0)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    @property
+    def root(self):
+        if not self.levels[0]:
+            return bytes(32)
+        return self.levels[-1][0]
+
+    def _refresh(self, start, end=None):
+        # Recomputes the parents of the level 0 nodes in [start, end), end
+        # defaults to the last node (leaves were replaced from start on)
+        depth = 0
+        while len(self.levels[depth]) > 1:
+            level = self.levels[depth]
+            if depth + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[depth + 1]
+            size = (len(level) + 1) // 2
+            del parents[size:]
+
+            first = start // 2
+            last = size if end is None else min((end - 1) // 2 + 1, size)
+            for j in range(first, last):
+                left = level[2 * j]
+                right = level[2 * j + 1] if 2 * j + 1 < len(level) else left
+                node = hash256(left + right)
+                if j < len(parents):
+                    parents[j] = node
+                else:
+                    parents.append(node)
+
+            start = first
+            if end is not None:
+                end = last
+            depth += 1
+        del self.levels[depth + 1 :]
+
+    def set_leaf(self, index, leaf):
+        self.levels[0][index] = leaf
+        self._refresh(index, index + 1)
+
+    def splice(self, start, leaves):
+        # Replaces the leaves from start on
+        self.levels[0][start:] = leaves
+        self._refresh(start)
+
+
+def merkle_root(hashes):
+    return MerkleTree(hashes).root
+
+
+class BlockMerkleTrees:
+    """txid and wtxid trees of a block, in the order of the block template.
+
+    Leaf 0 is the coinbase: its txid in the txid tree and 32 zero bytes in the
+    witness tree (BIP141).
+    """
+
+    def __init__(self, transactions, coinbase=None):
+        txids = [coinbase.txid_bytes if coinbase else bytes(32)]
+        wtxids = [bytes(32)]
+        for tx in transactions:
+            txids.append(tx.txid_bytes)
+            wtxids.append(tx.wtxid_bytes)
+        self.txid_tree = MerkleTree(txids)
+        self.wtxid_tree = MerkleTree(wtxids)
+
+    @property
+    def merkle_root(self):
+        return self.txid_tree.root
+
+    @property
+    def witness_root(self):
+        return self.wtxid_tree.root
+
+    def set_coinbase(self, coinbase):
+        # Only the path of leaf 0 is rehashed (extranonce roll)
+        self.txid_tree.set_leaf(0, coinbase.txid_bytes)
+
+    def update(self, transactions):
+        """Replaces the transactions of the block.
+
+        The leaves the new order shares with the current one (the block
+        prefix a watch update kept) stay, only the rest of the trees is
+        rehashed.
+
+        Returns:
+          The number of leading transactions kept.
+        """
+        leaves = self.wtxid_tree.levels[0]
+        # A wtxid commits to the txid too
+        kept = 0
+        limit = min(len(transactions), len(leaves) - 1)
+        while kept < limit and leaves[kept + 1] == transactions[kept].wtxid_bytes:
+            kept += 1
+        rest = transactions[kept:]
+        self.txid_tree.splice(kept + 1, [tx.txid_bytes for tx in rest])
+        self.wtxid_tree.splice(kept + 1, [tx.wtxid_bytes for tx in rest])
+        return kept
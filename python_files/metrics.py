@@ -0,0 +1,228 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "mempool_"
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 5e-3, 1e-2, 0.1, 1.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "total", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+
+class Metrics:
+    """Counters, gauges and timing histograms with optional labels.
+
+    Updates are plain dict operations, cheap enough for the per input hot
+    paths; the exporters only read the dicts.
+    """
+
+    def __init__(self):
+        # name -> {sorted label items -> value}
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self.gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, seconds, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def value(self, name, **labels):
+        # Current value of a counter or gauge, 0 when never set
+        key = tuple(sorted(labels.items()))
+        for kind in (self.counters, self.gauges):
+            if name in kind and key in kind[name]:
+                return kind[name][key]
+        return 0
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    def summary(self):
+        """Human readable table of every series."""
+        rows = []
+        for name, series in sorted(self.counters.items()):
+            for key, value in sorted(series.items()):
+                rows.append((_series_name(name, key), f"{value:,}"))
+        for name, series in sorted(self.gauges.items()):
+            for key, value in sorted(series.items()):
+                rows.append((_series_name(name, key), _format_number(value)))
+        for name, series in sorted(self.histograms.items()):
+            for key, histogram in sorted(series.items()):
+                mean = histogram.total / histogram.count if histogram.count else 0.0
+                rows.append(
+                    (
+                        _series_name(name, key),
+                        f"{histogram.count:,} x {_format_seconds(mean)} "
+                        f"(total {_format_seconds(histogram.total)}, max {_format_seconds(histogram.max)})",
+                    )
+                )
+        if not rows:
+            return ""
+        width = max(len(name) for name, _ in rows)
+        return "\n".join(f"{name:<{width}}  {value}" for name, value in rows)
+
+    def prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {PREFIX}{name}_total counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{PREFIX}{name}_total{_labels(key)} {value}")
+        for name, series in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            for key, value in sorted(series.items()):
+                lines.append(f"{PREFIX}{name}{_labels(key)} {value}")
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for key, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{_labels(key, le=repr(bound))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_bucket{_labels(key, le='+Inf')} {histogram.count}")
+                lines.append(f"{PREFIX}{name}_sum{_labels(key)} {histogram.total}")
+                lines.append(f"{PREFIX}{name}_count{_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # For the node exporter textfile collector: written then renamed
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(self.prometheus())
+        os.replace(temporary, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serves /metrics over HTTP from a daemon thread.
+
+        Returns:
+          The HTTP server, shutdown() stops it.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _labels(key, **extra):
+    items = list(key) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+
+def _series_name(name, key):
+    return name + _labels(key)
+
+
+def _format_seconds(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.1f}ms"
+    return f"{seconds:.2f}s"
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return f"{value:,.1f}"
+    return f"{value:,}"
+
+
+class SamplingProfiler:
+    """cProfile on one call out of every `every`.
+
+    Profiling every validator call would distort the timings, sampling
+    keeps the overhead low while still showing where the time goes.
+    """
+
+    def __init__(self, every=100):
+        self.every = every
+        self.calls = 0
+        self.sampled = 0
+        self.profile = cProfile.Profile()
+
+    def run(self, function, *args):
+        self.calls += 1
+        if self.calls % self.every:
+            return function(*args)
+        self.sampled += 1
+        self.profile.enable()
+        try:
+            return function(*args)
+        finally:
+            self.profile.disable()
+
+    def report(self, path=None, limit=20):
+        # Top functions by cumulative time; the raw stats go to path
+        if path:
+            self.profile.dump_stats(path)
+        out = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats("cumulative").print_stats(limit)
+        return f"{self.sampled} of {self.calls} calls profiled\n" + out.getvalue()
+
+
+# Process wide registry used by the pipeline modules
+METRICS = Metrics()
@@ -0,0 +1,209 @@
+import hashlib
+import multiprocessing
+import os
+import struct
+import time
+
+from merkle import BlockMerkleTrees
+from metrics import METRICS
+from transaction import Transaction, TxIn, TxOut, hash256
+
+
+DIFFICULTY_TARGET = 0x0000FFFF00000000000000000000000000000000000000000000000000000000
+# Compact form of DIFFICULTY_TARGET
+BITS = 0x1F00FFFF
+BLOCK_VERSION = 0x20000000
+BLOCK_HEIGHT = 840000
+BLOCK_SUBSIDY = 312500000
+PREVIOUS_BLOCK_HASH = bytes(32)
+# Reward goes to a P2WPKH output
+COINBASE_SCRIPT_PUBKEY = bytes.fromhex("0014" + "89abcdefabbaabbaabbaabbaabbaabbaabbaabba")
+WITNESS_RESERVED_VALUE = bytes(32)
+WITNESS_COMMITMENT_HEADER = bytes.fromhex("aa21a9ed")
+
+MAX_NONCE = 0xFFFFFFFF
+# How many nonces a worker tries between two looks at the stop flag
+CHECK_INTERVAL = 16384
+
+
+class Block:
+    def __init__(self, header, coinbase, transactions, hashes, seconds):
+        self.header = header
+        self.coinbase = coinbase
+        self.transactions = transactions
+        self.hashes = hashes
+        self.seconds = seconds
+
+    @property
+    def block_hash(self):
+        return hash256(self.header)[::-1].hex()
+
+    @property
+    def hash_rate(self):
+        return self.hashes / self.seconds if self.seconds else 0.0
+
+    def txids(self):
+        return [self.coinbase.txid] + [tx.txid for tx in self.transactions]
+
+
+def witness_commitment_script(witness_root):
+    commitment = hash256(witness_root + WITNESS_RESERVED_VALUE)
+    return b"\x6a\x24" + WITNESS_COMMITMENT_HEADER + commitment
+
+
+def create_coinbase(fees, witness_root, extranonce=0, height=BLOCK_HEIGHT):
+    # BIP34 height push followed by the extranonce
+    height_bytes = height.to_bytes((height.bit_length() + 8) // 8, "little")
+    script_sig = bytes([len(height_bytes)]) + height_bytes
+    script_sig += b"\x08" + extranonce.to_bytes(8, "little")
+
+    coinbase_input = TxIn(
+        bytes(32),
+        0xFFFFFFFF,
+        script_sig,
+        0xFFFFFFFF,
+        witness=(WITNESS_RESERVED_VALUE,),
+        is_coinbase=True,
+    )
+    outputs = [
+        TxOut(BLOCK_SUBSIDY + fees, COINBASE_SCRIPT_PUBKEY),
+        TxOut(0, witness_commitment_script(witness_root)),
+    ]
+    return Transaction(1, 0, [coinbase_input], outputs)
+
+
+def build_header(
+    merkle,
+    timestamp,
+    nonce=0,
+    version=BLOCK_VERSION,
+    prev_block=PREVIOUS_BLOCK_HASH,
+    bits=BITS,
+):
+    return struct.pack(
+        "<I32s32sIII", version, prev_block, merkle, timestamp, bits, nonce
+    )
+
+
+def _search_range(header, start, end, target, stop=None):
+    # The first 64 bytes of the header (version, previous hash and most of the
+    # merkle root) never change with the nonce: hash them once and only feed
+    # the last 16 bytes for every nonce
+    midstate = hashlib.sha256(header[:64])
+    tail = header[64:76]
+    sha256 = hashlib.sha256
+    pack = struct.pack
+
+    nonce = start
+    while nonce < end:
+        batch_end = min(nonce + CHECK_INTERVAL, end)
+        for n in range(nonce, batch_end):
+            h = midstate.copy()
+            h.update(tail + pack("<I", n))
+            digest = sha256(h.digest()).digest()
+            if int.from_bytes(digest, "little") < target:
+                return n, n - start + 1
+        nonce = batch_end
+        if stop is not None and stop.is_set():
+            break
+    return None, nonce - start
+
+
+def _worker(header, start, end, target, stop, results):
+    nonce, hashes = _search_range(header, start, end, target, stop)
+    if nonce is not None:
+        stop.set()
+    results.put((nonce, hashes))
+
+
+def search_nonce(header, target=DIFFICULTY_TARGET, workers=None):
+    """Looks for a nonce that puts the header hash below the target.
+
+    Args:
+      header: 80 byte header, its nonce field is ignored.
+      target: Difficulty target as an integer.
+      workers: Number of processes sharing the nonce space.
+
+    Returns:
+      (nonce or None when the whole nonce space failed, hashes tried)
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        return _search_range(header, 0, MAX_NONCE + 1, target)
+
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    step = (MAX_NONCE + 1) // workers
+    processes = []
+    for i in range(workers):
+        start = i * step
+        end = MAX_NONCE + 1 if i == workers - 1 else start + step
+        process = multiprocessing.Process(
+            target=_worker, args=(header, start, end, target, stop, results)
+        )
+        process.start()
+        processes.append(process)
+
+    found = None
+    hashes = 0
+    for _ in processes:
+        nonce, tried = results.get()
+        hashes += tried
+        if nonce is not None and found is None:
+            found = nonce
+    for process in processes:
+        process.join()
+    return found, hashes
+
+
+def mine_block(template, timestamp=None, workers=None, trees=None):
+    """Builds the coinbase and header of a block template and mines it.
+
+    When the nonce space runs out the timestamp is rolled, then the
+    coinbase extranonce (which changes the merkle root).
+
+    Args:
+      trees: BlockMerkleTrees of the previous template, updated in place;
+        new trees are built when None.
+
+    Returns:
+      A Block.
+    """
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    if trees is None:
+        trees = BlockMerkleTrees(template.transactions)
+    else:
+        trees.update(template.transactions)
+
+    started = time.perf_counter()
+    hashes = 0
+    extranonce = 0
+    while True:
+        # A new extranonce only rehashes the coinbase path of the txid tree
+        coinbase = create_coinbase(template.fees, trees.witness_root, extranonce)
+        trees.set_coinbase(coinbase)
+        merkle = trees.merkle_root
+        for time_roll in range(16):
+            header = build_header(merkle, timestamp + time_roll)
+            nonce, tried = search_nonce(header, DIFFICULTY_TARGET, workers)
+            hashes += tried
+            if nonce is not None:
+                header = header[:76] + struct.pack("<I", nonce)
+                seconds = time.perf_counter() - started
+                METRICS.inc("mining_hashes", hashes)
+                METRICS.set("mining_hash_rate", hashes / seconds if seconds else 0.0)
+                return Block(header, coinbase, template.transactions, hashes, seconds)
+        extranonce += 1
+
+
+def write_block(block, path):
+    # Header, coinbase and txids; written to a temporary file first so a
+    # reader never sees half a block
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        file.write(block.header.hex() + "\n")
+        file.write(block.coinbase.serialize().hex() + "\n")
+        for txid in block.txids():
+            file.write(txid + "\n")
+    os.replace(temporary, path)
@@ -0,0 +1,310 @@
+import heapq
+import itertools
+import os
+import struct
+from collections import Counter
+
+from block_builder import MAX_TEMPLATE_WEIGHT, BlockTemplate
+from classifier import mask_names
+from ingest import ingest_bytes, iter_paths
+from metrics import METRICS
+from reader import iter_json_files, prefetch_files
+from validation import validate_records
+
+# Files validated together; with the fixed size buffers below this is what
+# bounds the memory of the out-of-core mode
+SHARD_SIZE = 4096
+# Runs merged at once; more runs are first merged into longer ones
+MAX_MERGE_RUNS = 64
+# Records read from a run at a time
+RUN_BUFFER = 1024
+# Transactions waiting for an in-mempool parent during the selection
+MAX_WAITING = 65536
+
+# txid, fee, weight, offset and size of the file name in names.bin, offset
+# and number of the spent outpoints in inputs.bin
+CANDIDATE = struct.Struct("<32sqIQHQI")
+TXID = struct.Struct("<32s")
+OUTPOINT_SIZE = 36
+
+
+def _fee_rate_key(candidate):
+    # Best fee rate first, txid to break ties
+    return (-candidate[1] / candidate[2], candidate[0])
+
+
+def _txid_key(record):
+    return record[0]
+
+
+def write_run(path, layout, records):
+    """Writes records already in order as fixed size structs.
+
+    Returns:
+      The number of bytes written.
+    """
+    with open(path, "wb") as f:
+        for record in records:
+            f.write(layout.pack(*record))
+        size = f.tell()
+    METRICS.inc("spilled_bytes", size)
+    return size
+
+
+def read_run(path, layout):
+    # Records of a run, RUN_BUFFER at a time
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(layout.size * RUN_BUFFER)
+            if not chunk:
+                return
+            yield from layout.iter_unpack(chunk)
+
+
+def merge_runs(paths, layout, key, directory, fan_in=MAX_MERGE_RUNS):
+    """k-way merge of sorted runs with at most fan_in files open at once.
+
+    While there are more than fan_in runs, groups of them are merged into
+    longer runs first, so the merge memory does not grow with the number of
+    shards.
+
+    Returns:
+      An iterator over all the records in key order.
+    """
+    paths = list(paths)
+    generation = 0
+    while len(paths) > fan_in:
+        merged = []
+        for start in range(0, len(paths), fan_in):
+            group = paths[start : start + fan_in]
+            path = os.path.join(directory, f"merge-{generation}-{start}.run")
+            write_run(path, layout, heapq.merge(*(read_run(p, layout) for p in group), key=key))
+            for p in group:
+                os.remove(p)
+            merged.append(path)
+        paths = merged
+        generation += 1
+    return heapq.merge(*(read_run(path, layout) for path in paths), key=key)
+
+
+class ShardedMempool:
+    """Validated mempool spilled to run files instead of memory.
+
+    Every shard adds one run of its valid transactions sorted by fee rate
+    (CANDIDATE records) and one run of all its transaction ids, those of
+    the files failing the structural check included: a child of a refused
+    transaction waits for a parent that never comes. File names
+    and spent outpoints go to append only side files the records point to,
+    so the records have a fixed size and the runs can be merged without
+    parsing anything again.
+
+    Args:
+      directory: Empty folder for the run and side files.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.candidate_runs = []
+        self.txid_runs = []
+        self.names = open(os.path.join(directory, "names.bin"), "w+b")
+        self.inputs = open(os.path.join(directory, "inputs.bin"), "w+b")
+        self.txids = None
+        self.txid_count = 0
+        # Totals of the shards: structurally valid and valid transactions,
+        # input types and the lightest valid transaction
+        self.transactions = 0
+        self.valid = 0
+        self.counts = Counter()
+        self.lightest = None
+
+    def add_shard(self, records, rejected=()):
+        """Spills the records of one validated shard.
+
+        Args:
+          records: Validated records of the shard.
+          rejected: txids (hex) of the files of the shard failing the
+            structural check.
+        """
+        shard = len(self.txid_runs)
+        txids = {(record["tx"].txid_bytes,) for record in records}
+        txids.update((bytes.fromhex(txid)[::-1],) for txid in rejected)
+        txids = sorted(txids)
+        self.txid_runs.append(os.path.join(self.directory, f"txids-{shard}.run"))
+        write_run(self.txid_runs[-1], TXID, txids)
+
+        candidates = []
+        for record in records:
+            self.counts.update(mask_names(record["mask"]))
+            if not record["valid"]:
+                continue
+            tx = record["tx"]
+            name = record["filename"].encode()
+            name_offset = self.names.seek(0, os.SEEK_END)
+            self.names.write(name)
+            inputs_offset = self.inputs.seek(0, os.SEEK_END)
+            self.inputs.write(b"".join(vin.outpoint for vin in tx.vin))
+            candidates.append(
+                (tx.txid_bytes, tx.fee, tx.weight, name_offset, len(name), inputs_offset, len(tx.vin))
+            )
+            if self.lightest is None or tx.weight < self.lightest:
+                self.lightest = tx.weight
+        candidates.sort(key=_fee_rate_key)
+        self.candidate_runs.append(os.path.join(self.directory, f"candidates-{shard}.run"))
+        write_run(self.candidate_runs[-1], CANDIDATE, candidates)
+
+        self.transactions += len(records)
+        self.valid += len(candidates)
+        METRICS.inc("shards")
+
+    def finish(self):
+        # One sorted file of every mempool txid, for is_mempool_txid()
+        path = os.path.join(self.directory, "txids.bin")
+        merged = merge_runs(self.txid_runs, TXID, _txid_key, self.directory)
+        # The same file can be in the folder twice
+        unique = (record for record, _ in itertools.groupby(merged))
+        self.txid_count = write_run(path, TXID, unique) // TXID.size
+        for run in self.txid_runs:
+            if os.path.exists(run):
+                os.remove(run)
+        self.txid_runs = []
+        self.txids = open(path, "rb")
+        self.names.flush()
+        self.inputs.flush()
+
+    def candidates(self):
+        # Every valid transaction, best fee rate first
+        return merge_runs(self.candidate_runs, CANDIDATE, _fee_rate_key, self.directory)
+
+    def is_mempool_txid(self, txid):
+        # Binary search in txids.bin, one read per step
+        low, high = 0, self.txid_count
+        fd = self.txids.fileno()
+        while low < high:
+            middle = (low + high) // 2
+            value = os.pread(fd, TXID.size, middle * TXID.size)
+            if value == txid:
+                return True
+            if value < txid:
+                low = middle + 1
+            else:
+                high = middle
+        return False
+
+    def name(self, candidate):
+        return os.pread(self.names.fileno(), candidate[4], candidate[3]).decode()
+
+    def outpoints(self, candidate):
+        data = os.pread(self.inputs.fileno(), candidate[6] * OUTPOINT_SIZE, candidate[5])
+        return [data[i : i + OUTPOINT_SIZE] for i in range(0, len(data), OUTPOINT_SIZE)]
+
+    def close(self):
+        for f in (self.names, self.inputs, self.txids):
+            if f is not None:
+                f.close()
+
+
+def spill_mempool(mempool_folder, directory, shard_size=SHARD_SIZE, workers=None, cache=None, profiler=None):
+    """Validates the mempool folder shard by shard into a ShardedMempool.
+
+    Only one shard of records is in memory at a time: it is parsed (or
+    restored from the cache), validated, spilled and dropped before the
+    next one is read.
+
+    Returns:
+      A finished ShardedMempool.
+    """
+    mempool = ShardedMempool(directory)
+    paths = iter_json_files(mempool_folder)
+    while True:
+        shard = [path for _, path in zip(range(shard_size), paths)]
+        if not shard:
+            break
+        rejected = set()
+        records = list(iter_paths(shard, workers, cache=cache, rejected=rejected))
+        validate_records(records, cache, profiler)
+        mempool.add_shard(records, rejected)
+        if cache is not None:
+            cache.commit()
+    mempool.finish()
+    return mempool
+
+
+def select_candidates(mempool, max_weight=MAX_TEMPLATE_WEIGHT, max_waiting=MAX_WAITING):
+    """Fills a block from the merged candidates, best fee rate first.
+
+    A transaction goes in once all its in-mempool parents are in the block.
+    A child seen before one of its parents waits for it (at most
+    max_waiting of them), so a child paying for its parent is taken right
+    after the parent made it on its own fee rate. Only the block, its spent
+    outpoints and the waiting children are held in memory.
+
+    Returns:
+      (CANDIDATE records in block order, fees, weight).
+    """
+    block = []
+    included = set()
+    spent = set()
+    waiting = {}
+    waiting_count = 0
+    totals = [0, 0]
+
+    def admit(candidate):
+        nonlocal waiting_count
+        txid, fee, weight = candidate[:3]
+        if txid in included or totals[1] + weight > max_weight:
+            return
+        outpoints = mempool.outpoints(candidate)
+        if len(set(outpoints)) != len(outpoints) or not spent.isdisjoint(outpoints):
+            # Conflicts with a transaction already in the block
+            return
+        for parent in {outpoint[:32] for outpoint in outpoints}:
+            if parent not in included and mempool.is_mempool_txid(parent):
+                if waiting_count < max_waiting:
+                    waiting.setdefault(parent, []).append(candidate)
+                    waiting_count += 1
+                return
+        block.append(candidate)
+        included.add(txid)
+        spent.update(outpoints)
+        totals[0] += fee
+        totals[1] += weight
+        # Children parked on this transaction get another chance
+        children = waiting.pop(txid, [])
+        waiting_count -= len(children)
+        for child in children:
+            admit(child)
+
+    for candidate in mempool.candidates():
+        if mempool.lightest is None or max_weight - totals[1] < mempool.lightest:
+            # Not even the lightest transaction fits any more
+            break
+        admit(candidate)
+    METRICS.set("waiting_children", waiting_count)
+    return block, totals[0], totals[1]
+
+
+def load_selected(mempool, mempool_folder, block):
+    """Reads and parses the files of the selected transactions only.
+
+    A file that changed since it was validated is dropped, together with
+    the selected transactions spending it.
+
+    Returns:
+      A BlockTemplate.
+    """
+    paths = [os.path.join(mempool_folder, mempool.name(candidate)) for candidate in block]
+    transactions = []
+    dropped = set()
+    for candidate, (path, data) in zip(block, prefetch_files(paths)):
+        record = ingest_bytes(os.path.basename(path), data) if data is not None else None
+        tx = record["tx"] if record is not None else None
+        if tx is None or tx.txid_bytes != candidate[0] or any(vin.outpoint[:32] in dropped for vin in tx.vin):
+            dropped.add(candidate[0])
+            continue
+        transactions.append(tx)
+    METRICS.inc("reread_files", len(paths))
+    return BlockTemplate(
+        transactions,
+        sum(tx.fee for tx in transactions),
+        sum(tx.weight for tx in transactions),
+    )
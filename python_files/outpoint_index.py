@@ -0,0 +1,245 @@
+import os
+import sqlite3
+import struct
+
+# Bumped when the layout of the saved index changes; a file of another
+# version is ignored and rebuilt
+INDEX_VERSION = 1
+# Inputs with a sequence below this signal replaceability (BIP125)
+MAX_BIP125_RBF_SEQUENCE = 0xFFFFFFFD
+# Outpoint: txid (little endian) + vout
+OUTPOINT_SIZE = 36
+
+
+def signals_rbf(tx):
+    return any(vin.sequence <= MAX_BIP125_RBF_SEQUENCE for vin in tx.vin)
+
+
+class IndexEntry:
+    __slots__ = ("txid", "filename", "fee", "weight", "outpoints", "rbf")
+
+    def __init__(self, txid, filename, fee, weight, outpoints, rbf):
+        self.txid = txid
+        self.filename = filename
+        self.fee = fee
+        self.weight = weight
+        # Outpoints spent by the transaction (36 bytes: txid LE + vout)
+        self.outpoints = outpoints
+        self.rbf = rbf
+
+
+class OutpointIndex:
+    """Outpoint -> spending transactions and txid -> transaction maps.
+
+    Built while the mempool is ingested, it answers double spend, RBF and
+    parent/child questions with dict lookups instead of a mempool scan. It
+    is saved to a compact sqlite file, and a warm run loads it back and only
+    adds the transactions that are new and drops the ones that are gone.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.spenders = {}
+        # Parent txid (32 bytes, little endian like in the outpoints) ->
+        # txids spending one of its outputs
+        self.spent_by = {}
+        # File the index was loaded from or saved to, and the txids added or
+        # removed since
+        self.path = None
+        self.changed = set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, txid):
+        return txid in self.entries
+
+    @property
+    def dirty(self):
+        return bool(self.changed) or self.path is None
+
+    def add(self, record):
+        """Indexes the transaction of a record.
+
+        Returns:
+          False when the same transaction of the same file was already
+          indexed, as after load().
+        """
+        tx = record["tx"]
+        known = self.entries.get(record["txid"])
+        if known is not None and (known.filename, known.fee, known.weight) == (
+            record["filename"],
+            tx.fee,
+            tx.weight,
+        ):
+            return False
+        return self.add_transaction(tx, record["filename"])
+
+    def add_transaction(self, tx, filename=None):
+        self.remove(tx.txid)
+        self._insert(
+            IndexEntry(
+                tx.txid,
+                filename,
+                tx.fee,
+                tx.weight,
+                [vin.outpoint for vin in tx.vin],
+                signals_rbf(tx),
+            )
+        )
+        self.changed.add(tx.txid)
+        return True
+
+    def _insert(self, entry):
+        self.entries[entry.txid] = entry
+        for outpoint in entry.outpoints:
+            self.spenders.setdefault(outpoint, []).append(entry.txid)
+            self.spent_by.setdefault(outpoint[:32], set()).add(entry.txid)
+
+    def remove(self, txid):
+        entry = self.entries.pop(txid, None)
+        if entry is None:
+            return
+        for outpoint in entry.outpoints:
+            spenders = self.spenders.get(outpoint)
+            if spenders and txid in spenders:
+                spenders.remove(txid)
+                if not spenders:
+                    del self.spenders[outpoint]
+            parent = outpoint[:32]
+            children = self.spent_by.get(parent)
+            if children is not None:
+                children.discard(txid)
+                if not children:
+                    del self.spent_by[parent]
+        self.changed.add(txid)
+
+    def retain(self, txids):
+        # Drops the transactions not in txids (files removed since the index
+        # was saved)
+        for txid in [txid for txid in self.entries if txid not in txids]:
+            self.remove(txid)
+
+    def spenders_of(self, prev_txid, vout):
+        outpoint = bytes.fromhex(prev_txid)[::-1] + struct.pack("<I", vout)
+        return list(self.spenders.get(outpoint, ()))
+
+    def conflicts(self, txid):
+        # Other transactions spending one of the outpoints of txid
+        found = set()
+        for outpoint in self.entries[txid].outpoints:
+            spenders = self.spenders[outpoint]
+            if len(spenders) > 1:
+                found.update(spenders)
+        found.discard(txid)
+        return found
+
+    def spends_twice(self, txid):
+        outpoints = self.entries[txid].outpoints
+        return len(set(outpoints)) != len(outpoints)
+
+    def rbf_candidates(self, txid):
+        # Conflicting transactions that txid is allowed to replace
+        return {other for other in self.conflicts(txid) if self.entries[other].rbf}
+
+    def double_spends(self):
+        return {
+            outpoint: spenders
+            for outpoint, spenders in self.spenders.items()
+            if len(spenders) > 1
+        }
+
+    def parents(self, txid):
+        # Indexed transactions txid spends an output of
+        found = set()
+        for outpoint in self.entries[txid].outpoints:
+            parent = outpoint[:32][::-1].hex()
+            if parent in self.entries:
+                found.add(parent)
+        return found
+
+    def children(self, txid):
+        # Indexed transactions spending an output of txid, which does not
+        # need to be indexed itself; the set must not be modified
+        return self.spent_by.get(bytes.fromhex(txid)[::-1], frozenset())
+
+    def save(self, path):
+        """Writes the index to a compact sqlite file.
+
+        One row per transaction, its outpoints concatenated in one blob.
+        Saved again to the file it came from, only the rows of the
+        transactions added or removed since are written.
+        """
+        db = sqlite3.connect(path)
+        if path == self.path:
+            txids = self.changed
+            db.executemany(
+                "DELETE FROM transactions WHERE txid = ?",
+                ((bytes.fromhex(txid),) for txid in txids if txid not in self.entries),
+            )
+        else:
+            txids = self.entries
+            db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (INDEX_VERSION,))
+            db.execute("DROP TABLE IF EXISTS transactions")
+            db.execute(
+                "CREATE TABLE transactions (txid BLOB PRIMARY KEY, filename TEXT, "
+                "fee INTEGER, weight INTEGER, rbf INTEGER, outpoints BLOB) WITHOUT ROWID"
+            )
+        db.executemany(
+            "INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    bytes.fromhex(entry.txid),
+                    entry.filename,
+                    entry.fee,
+                    entry.weight,
+                    int(entry.rbf),
+                    b"".join(entry.outpoints),
+                )
+                for entry in (self.entries[txid] for txid in txids if txid in self.entries)
+            ),
+        )
+        db.commit()
+        db.close()
+        self.path = path
+        self.changed = set()
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index saved by save() in a single query.
+
+        Returns:
+          The index, empty when the file is missing or of another version.
+        """
+        index = cls()
+        if not os.path.exists(path):
+            return index
+        db = sqlite3.connect(path)
+        try:
+            row = db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+            if row is None or row[0] != INDEX_VERSION:
+                return index
+            rows = db.execute(
+                "SELECT txid, filename, fee, weight, rbf, outpoints FROM transactions"
+            )
+            for txid, filename, fee, weight, rbf, outpoints in rows:
+                index._insert(
+                    IndexEntry(
+                        txid.hex(),
+                        filename,
+                        fee,
+                        weight,
+                        [
+                            outpoints[i : i + OUTPOINT_SIZE]
+                            for i in range(0, len(outpoints), OUTPOINT_SIZE)
+                        ],
+                        bool(rbf),
+                    )
+                )
+        except sqlite3.DatabaseError:
+            return cls()
+        finally:
+            db.close()
+        index.path = path
+        return index
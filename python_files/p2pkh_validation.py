@@ -1,60 +1,82 @@
-import json
-import hashlib
-from ecdsa import SigningKey, VerifyingKey, SECP256k1
-
-
-def validate_transaction(tx_json):
-    # Parse the transaction JSON
-    tx = json.loads(tx_json)
-
-    # Iterate over the inputs
-    for vin in tx["vin"]:
-        # Get the scriptPubKey and scriptSig
-        scriptpubkey = vin["prevout"]["scriptpubkey"]
-        scriptsig = vin["scriptsig"]
-
-        # Extract the public key hash from the scriptPubKey
-        pubkey_hash = scriptpubkey[6:-4]
-
-        # Extract the signature and public key from the scriptSig
-        sig_len = int(scriptsig[2:4], 16)
-        sig_start = 4
-        sig_end = sig_start + sig_len * 2
-        signature = scriptsig[sig_start:sig_end]
-        pubkey_start = sig_end + 2
-        pubkey = scriptsig[pubkey_start:]
-
-        # Verify the public key hash matches the hash of the public key
-        hash_object = hashlib.sha256(bytes.fromhex(pubkey))
-        pubkey_hash_new = hashlib.new("ripemd160", hash_object.digest()).hexdigest()
-        if pubkey_hash_new != pubkey_hash:
-            print(f"Public key hash mismatch for input {vin['txid']}:{vin['vout']}")
-            return False
-
-        # Verify the signature
-        try:
-            # Decode the public key hash
-            decoded_hash = bytes.fromhex(pubkey_hash)
-
-            # Decode the public key
-            public_key = VerifyingKey.from_string(
-                bytes.fromhex(pubkey), curve=SECP256k1
-            )
-
-            # Verify the signature
-            public_key.verify_digest(
-                bytes.fromhex(signature),
-                decoded_hash,
-                sigdecode=VerifyingKey.from_string(
-                    bytes.fromhex(pubkey), curve=SECP256k1, hashfunc=hashlib.sha256
-                ).verify_digest,
-            )
-        except Exception as e:
-            print(
-                f"Signature verification failed for input {vin['txid']}:{vin['vout']}"
-            )
-            print(f"Error: {str(e)}")
-            return False
-
-    print("All inputs are valid!")
+from metrics import METRICS
+from script_validation import parse_pushes
+from sighash import get_sighash_cache
+from transaction import hash160
+from verifier import verify, verify_batch
+
+
+def p2pkh_signature(tx, index):
+    """Extracts the signature check of a P2PKH input.
+
+    Returns:
+      (pubkey, DER signature, legacy sighash), None when the scriptSig can
+      not be valid.
+    """
+    vin = tx.vin[index]
+
+    # Get the scriptPubKey and scriptSig
+    scriptpubkey = vin.prevout.script_pubkey
+    scriptsig = vin.script_sig
+
+    # Extract the public key hash from the scriptPubKey
+    # (OP_DUP OP_HASH160 <20 bytes> OP_EQUALVERIFY OP_CHECKSIG)
+    pubkey_hash = scriptpubkey[3:23]
+
+    # Extract the signature and public key from the scriptSig
+    try:
+        signature, pubkey = parse_pushes(scriptsig)
+    except ValueError:
+        METRICS.inc("input_failures", template="p2pkh", reason="malformed_scriptsig")
+        return None
+    if not signature:
+        return None
+
+    # Verify the public key hash matches the hash of the public key
+    if hash160(pubkey) != pubkey_hash:
+        METRICS.inc("input_failures", template="p2pkh", reason="pubkey_hash_mismatch")
+        return None
+
+    # The signed message is the legacy sighash, with the scriptPubKey as
+    # scriptCode and the sighash type from the last byte of the signature
+    message = get_sighash_cache(tx).legacy_digest(index, scriptpubkey, signature[-1])
+    return pubkey, signature[:-1], message
+
+
+def validate_p2pkh_input(tx, index):
+    check = p2pkh_signature(tx, index)
+    if check is None:
+        return False
+
+    # Verify the signature
+    if not verify(*check):
+        METRICS.inc("input_failures", template="p2pkh", reason="bad_signature")
+        return False
+
     return True
+
+
+def validate_p2pkh_batch(items):
+    """Verifies the P2PKH inputs of many transactions together.
+
+    Same as verify_p2wpkh_batch(): one verify_batch() call for the
+    signatures of the whole batch.
+
+    Args:
+      items: List of (tx, input index) spending P2PKH outputs.
+
+    Returns:
+      One bool per item.
+    """
+    results = [False] * len(items)
+    checks = []
+    positions = []
+    for position, (tx, index) in enumerate(items):
+        check = p2pkh_signature(tx, index)
+        if check is not None:
+            checks.append(check)
+            positions.append(position)
+    for position, valid in zip(positions, verify_batch(checks)):
+        results[position] = valid
+        if not valid:
+            METRICS.inc("input_failures", template="p2pkh", reason="bad_signature")
+    return results
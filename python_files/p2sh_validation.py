@@ -1,72 +1,85 @@
 import json
-import hashlib
-from ecdsa import SigningKey, VerifyingKey, SECP256k1
 
+from classifier import classify_script
+from metrics import METRICS
+from p2wpkh_validation import verify_p2wpkh_program
+from p2wsh_validation import verify_p2wsh_program
+from script_validation import (
+    TransactionChecker,
+    cached_multisig,
+    check_multisig,
+    parse_pushes,
+    push_data,
+    script_hash160,
+    witness_program,
+)
+from transaction import Transaction
+
+
+def validate_p2sh_input(tx, index):
+    vin = tx.vin[index]
 
-def validate_p2sh_input(input_data):
     # Extract the redeem script from the scriptsig
-    scriptsig_parts = input_data["scriptsig_asm"].split()
+    try:
+        scriptsig_parts = parse_pushes(vin.script_sig)
+    except ValueError:
+        METRICS.inc("input_failures", template="p2sh", reason="malformed_scriptsig")
+        return False
+    if not scriptsig_parts:
+        return False
     redeem_script = scriptsig_parts[-1]
 
-    # Convert the redeem script to bytes and slice the first 71 bytes
-    redeem_script_bytes = bytes.fromhex(redeem_script)
-    redeem_script_slice = redeem_script_bytes[:71]
-
-    # Hash the redeem script using SHA-256 and RIPEMD-160
-    redeem_script_hash = hashlib.new(
-        "ripemd160", hashlib.sha256(redeem_script_slice).digest()
-    ).hexdigest()
+    # Extract the script hash from the scriptPubKey (OP_HASH160 <20> OP_EQUAL)
+    script_hash = vin.prevout.script_pubkey[2:22]
 
-    # Extract the pubkey hash from the pubkey asm
-    pubkey_asm_parts = input_data["prevout"]["scriptpubkey_asm"].split()
-    pubkey_hash = pubkey_asm_parts[2]
+    # Compare the hash of the whole redeem script and the script hash
+    if script_hash160(redeem_script) != script_hash:
+        METRICS.inc("input_failures", template="p2sh", reason="script_hash_mismatch")
+        return False
 
-    # Convert the pubkey hash to bytes and slice the first 20 bytes
-    pubkey_hash_bytes = bytes.fromhex(pubkey_hash)
-    pubkey_hash_slice = pubkey_hash_bytes[:20]
+    program = witness_program(redeem_script)
+    if program is not None:
+        return validate_nested_segwit(tx, index, redeem_script, program)
 
-    # Compare the sliced redeem script and pubkey hash
-    if redeem_script_hash != pubkey_hash_slice.hex():
-        print(
-            f"Redeem script and pubkey hash mismatch for input {input_data['txid']}:{input_data['vout']}"
-        )
+    # Extract the public keys and signatures (OP_0 <sig>... <redeem script>)
+    multisig = cached_multisig(redeem_script)
+    if multisig is None:
+        METRICS.inc("input_failures", template="p2sh", reason="unsupported_redeem_script")
+        return False
+    num_signatures, public_keys = multisig
+    signatures = scriptsig_parts[1:-1]
+    if scriptsig_parts[0] != b"" or len(signatures) != num_signatures:
         return False
 
-    print(
-        f"Redeem script hash match for input {input_data['txid']}:{input_data['vout']}"
+    # Verify the signatures against the legacy sighash of this input, with
+    # the redeem script as scriptCode
+    return check_multisig(
+        signatures, public_keys, redeem_script, TransactionChecker(tx, index)
     )
 
-    # Extract the public keys and signatures from the scriptsig
-    scriptsig_parts = input_data["scriptsig_asm"].split()
-    num_signatures = int(scriptsig_parts[0][9:])
-    signatures = scriptsig_parts[1 : num_signatures + 1]
-    num_public_keys = int(scriptsig_parts[num_signatures + 1][9:])
-    public_keys = scriptsig_parts[num_signatures + 2 :]
-
-    # Verify each signature against the corresponding public key
-    for i in range(num_signatures):
-        signature = bytes.fromhex(signatures[i])
-        public_key = VerifyingKey.from_string(
-            bytes.fromhex(public_keys[i]), curve=SECP256k1
-        )
-
-        # TODO: Implement the actual signature verification logic
-        # This may involve constructing the transaction hash and verifying the signature against it
-
-    return True
 
+def validate_nested_segwit(tx, index, redeem_script, program):
+    # P2SH-P2WPKH / P2SH-P2WSH: the scriptSig is only the push of the
+    # redeem script, which holds the witness program
+    if tx.vin[index].script_sig != push_data(redeem_script):
+        METRICS.inc("input_failures", template="p2sh", reason="malformed_scriptsig")
+        return False
+    version, data = program
+    if version == 0 and len(data) == 20:
+        return verify_p2wpkh_program(tx, index, data)
+    if version == 0 and len(data) == 32:
+        return verify_p2wsh_program(tx, index, data)
+    METRICS.inc("input_failures", template="p2sh", reason="unsupported_witness_program")
+    return False
 
-def validate_transaction(tx_json):
-    # Parse the transaction JSON
-    tx = json.loads(tx_json)
 
+def validate_transaction(tx):
     # Iterate over the inputs
-    for vin in tx["vin"]:
-        if vin["prevout"]["scriptpubkey_type"] == "p2sh":
-            if not validate_p2sh_input(vin):
+    for index, vin in enumerate(tx.vin):
+        if classify_script(vin.prevout.script_pubkey) == "p2sh":
+            if not validate_p2sh_input(tx, index):
                 return False
 
-    print("All P2SH inputs are valid!")
     return True
 
 
@@ -202,4 +215,6 @@ tx_json = """
 }
 """
 
-validate_transaction(tx_json)
+if __name__ == "__main__":
+    if validate_transaction(Transaction.from_dict(json.loads(tx_json))):
+        print("All P2SH inputs are valid!")
@@ -0,0 +1,182 @@
+from create_txid import compact_size
+from metrics import METRICS
+from script_validation import (
+    MAX_SCRIPT_ELEMENT_SIZE,
+    MAX_STACK_SIZE,
+    VALIDATION_WEIGHT_OFFSET,
+    ScriptError,
+    TaprootChecker,
+    cast_to_bool,
+    eval_script,
+)
+from sighash import get_sighash_cache, taproot_hash_type
+from transaction import tagged_hash
+from verifier import tweak_xonly_pubkey, verify_schnorr, verify_schnorr_batch
+
+# First byte of the optional last witness item that BIP341 sets apart
+ANNEX_TAG = 0x50
+# Control block: leaf version and output key parity byte, internal key, then
+# up to 128 hashes of the merkle path
+TAPROOT_CONTROL_BASE_SIZE = 33
+TAPROOT_CONTROL_NODE_SIZE = 32
+TAPROOT_CONTROL_MAX_NODE_COUNT = 128
+TAPROOT_LEAF_MASK = 0xFE
+TAPROOT_LEAF_TAPSCRIPT = 0xC0
+
+
+def split_annex(witness):
+    # (stack, annex or None) of a taproot witness
+    if len(witness) >= 2 and witness[-1][:1] == bytes([ANNEX_TAG]):
+        return witness[:-1], witness[-1]
+    return witness, None
+
+
+def key_path_signature(tx, index):
+    """Extracts the signature check of a key path spend.
+
+    Returns:
+      (32 byte output key, 64 byte signature, BIP341 message), None when the
+      witness can not be a valid key path spend.
+    """
+    vin = tx.vin[index]
+    stack, annex = split_annex(vin.witness)
+    if len(stack) != 1 or vin.script_sig:
+        return None
+    signature = stack[0]
+    hash_type = taproot_hash_type(signature)
+    if hash_type is None:
+        return None
+    message = get_sighash_cache(tx).taproot_digest(index, hash_type, annex)
+    if message is None:
+        return None
+    return vin.prevout.script_pubkey[2:], signature[:64], message
+
+
+def _is_script_path(vin):
+    return len(split_annex(vin.witness)[0]) >= 2
+
+
+def tapleaf_hash(script, leaf_version=TAPROOT_LEAF_TAPSCRIPT):
+    return tagged_hash("TapLeaf", bytes([leaf_version]) + compact_size(len(script)) + script)
+
+
+def script_path_leaf(output_key, script, control):
+    """Checks that a script and its control block commit to an output key.
+
+    The TapLeaf hash of the script is combined with the path of the control
+    block into the merkle root, and the internal key tweaked by
+    TapTweak(internal key || root) must be the output key, with the parity
+    given by the control block.
+
+    Returns:
+      The TapLeaf hash, None when the control block is malformed, the leaf
+      version is not tapscript (other versions are refused by policy) or
+      the commitment does not match.
+    """
+    path_size = len(control) - TAPROOT_CONTROL_BASE_SIZE
+    if (
+        path_size < 0
+        or path_size % TAPROOT_CONTROL_NODE_SIZE
+        or path_size > TAPROOT_CONTROL_NODE_SIZE * TAPROOT_CONTROL_MAX_NODE_COUNT
+    ):
+        return None
+    leaf_version = control[0] & TAPROOT_LEAF_MASK
+    if leaf_version != TAPROOT_LEAF_TAPSCRIPT:
+        return None
+    leaf_hash = tapleaf_hash(script, leaf_version)
+    node = leaf_hash
+    for start in range(TAPROOT_CONTROL_BASE_SIZE, len(control), TAPROOT_CONTROL_NODE_SIZE):
+        sibling = control[start : start + TAPROOT_CONTROL_NODE_SIZE]
+        # Branches hash their two children in lexicographic order
+        node = tagged_hash("TapBranch", min(node, sibling) + max(node, sibling))
+    internal_key = control[1:TAPROOT_CONTROL_BASE_SIZE]
+    tweaked = tweak_xonly_pubkey(internal_key, tagged_hash("TapTweak", internal_key + node))
+    if tweaked != (output_key, control[0] & 1):
+        return None
+    return leaf_hash
+
+
+def _witness_size(witness):
+    return len(compact_size(len(witness))) + sum(
+        len(compact_size(len(item))) + len(item) for item in witness
+    )
+
+
+def verify_script_path(tx, index, deferred=None):
+    """Verifies a P2TR script path spend (BIP341 and BIP342).
+
+    The last two witness items (after the annex) are the leaf script and
+    its control block. The script must be committed to by the output key
+    and is then run as a tapscript on the other items, which must leave a
+    single true element.
+
+    Args:
+      tx: The spending Transaction.
+      index: Index of the input.
+      deferred: Optional list collecting the signature checks of the script
+        instead of verifying them (see TaprootChecker).
+    """
+    METRICS.inc("taproot_script_path")
+    vin = tx.vin[index]
+    stack, annex = split_annex(vin.witness)
+    if vin.script_sig:
+        return False
+    script, control = stack[-2], stack[-1]
+    leaf_hash = script_path_leaf(vin.prevout.script_pubkey[2:], script, control)
+    if leaf_hash is None:
+        METRICS.inc("input_failures", template="p2tr", reason="script_path_commitment")
+        return False
+
+    stack = list(stack[:-2])
+    if len(stack) > MAX_STACK_SIZE or any(len(item) > MAX_SCRIPT_ELEMENT_SIZE for item in stack):
+        return False
+    budget = VALIDATION_WEIGHT_OFFSET + _witness_size(vin.witness)
+    checker = TaprootChecker(tx, index, leaf_hash, annex, budget, deferred)
+    try:
+        eval_script(script, stack, checker, "tapscript")
+    except (ScriptError, IndexError):
+        METRICS.inc("input_failures", template="p2tr", reason="tapscript")
+        return False
+    return len(stack) == 1 and cast_to_bool(stack[0])
+
+
+def verify_p2tr_input(tx, index):
+    if _is_script_path(tx.vin[index]):
+        return verify_script_path(tx, index)
+    check = key_path_signature(tx, index)
+    return check is not None and verify_schnorr(*check)
+
+
+def verify_p2tr_batch(items):
+    """Verifies the P2TR inputs of many transactions together.
+
+    The key path signatures and the tapscript signatures of the script
+    path spends of the whole batch go through a single
+    verify_schnorr_batch() call.
+
+    Args:
+      items: List of (tx, input index) spending P2TR outputs.
+
+    Returns:
+      One bool per item.
+    """
+    results = [False] * len(items)
+    checks = []
+    positions = []
+    for position, (tx, index) in enumerate(items):
+        if _is_script_path(tx.vin[index]):
+            deferred = []
+            if verify_script_path(tx, index, deferred):
+                results[position] = True
+                checks.extend(deferred)
+                positions.extend([position] * len(deferred))
+            continue
+        check = key_path_signature(tx, index)
+        if check is not None:
+            results[position] = True
+            checks.append(check)
+            positions.append(position)
+    for position, valid in zip(positions, verify_schnorr_batch(checks)):
+        if not valid:
+            results[position] = False
+    return results
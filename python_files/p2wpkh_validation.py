@@ -1,80 +1,77 @@
-import hashlib
-from ecdsa import VerifyingKey, SECP256k1
-
-
-def hash256(data):
-    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
-
-
-def verify_p2wpkh_transaction(transaction):
-    # Extract relevant data from the transaction
-    version = transaction["version"]
-    inputs = transaction["vin"]
-    outputs = transaction["vout"]
-    locktime = transaction["locktime"]
-
-    # Create the preimage
-    preimage = b""
-    preimage += version.to_bytes(4, byteorder="little")
-
-    # Hash256 of inputs (txid + vout)
-    input_data = b""
-    for input_tx in inputs:
-        input_data += bytes.fromhex(input_tx["txid"])[::-1]
-        input_data += input_tx["vout"].to_bytes(4, byteorder="little")
-    preimage += hash256(input_data)
-
-    # Hash256 of sequence
-    sequence_data = b""
-    for input_tx in inputs:
-        sequence_data += input_tx["sequence"].to_bytes(4, byteorder="little")
-    preimage += hash256(sequence_data)
-
-    # Inputs
-    for input_tx in inputs:
-        preimage += bytes.fromhex(input_tx["txid"])[::-1]
-        preimage += input_tx["vout"].to_bytes(4, byteorder="little")
-
-    # ScriptCode
-    scriptcode = b""
-    for input_tx in inputs:
-        public_key_hash = input_tx["prevout"]["scriptpubkey"][-42:-4]
-        scriptcode = b"\x19\x76\xa9\x14" + bytes.fromhex(public_key_hash) + b"\x88\xac"
-        preimage += scriptcode
-
-    # Amount
-    for input_tx in inputs:
-        amount = input_tx["prevout"]["value"]
-        preimage += amount.to_bytes(8, byteorder="little")
-
-    # Sequence
-    for input_tx in inputs:
-        preimage += input_tx["sequence"].to_bytes(4, byteorder="little")
-
-    # Hash256 of outputs
-    output_data = b""
-    for output in outputs:
-        output_data += output["value"].to_bytes(8, byteorder="little")
-        output_data += len(output["scriptpubkey"]).to_bytes(1, byteorder="little")
-        output_data += bytes.fromhex(output["scriptpubkey"])
-    preimage += hash256(output_data)
-
-    # Locktime
-    preimage += locktime.to_bytes(4, byteorder="little")
-
-    # Add SIGHASH_ALL (0x01)
-    preimage += b"\x01"
-
-    # Create the message
-    message = hash256(preimage)
-
-    # Verify the signature
-    for input_tx in inputs:
-        signature = bytes.fromhex(input_tx["witness"][0])
-        public_key = bytes.fromhex(input_tx["witness"][1])
-
-        verifying_key = VerifyingKey.from_string(public_key, curve=SECP256k1)
-        if not verifying_key.verify(signature, message):
-            return False
-
-    return True
+from sighash import get_sighash_cache
+from transaction import hash160
+from verifier import verify, verify_batch
+
+
+def p2wpkh_script_code(pubkey_hash):
+    # scriptCode of a P2WPKH input is the matching P2PKH scriptPubKey
+    return b"\x76\xa9\x14" + pubkey_hash + b"\x88\xac"
+
+
+def verify_p2wpkh_input(tx, index):
+    vin = tx.vin[index]
+    if vin.script_sig:
+        return False
+    return verify_p2wpkh_program(tx, index, vin.prevout.script_pubkey[2:])
+
+
+def p2wpkh_signature(tx, index, pubkey_hash):
+    """Extracts the signature check of an input spending a 20 byte v0 program.
+
+    Returns:
+      (pubkey, DER signature, BIP143 message), None when the witness can not
+      be valid.
+    """
+    vin = tx.vin[index]
+
+    # P2WPKH spends carry exactly <signature> <pubkey> in the witness
+    if len(vin.witness) != 2:
+        return None
+    signature, public_key = vin.witness
+    if not signature or hash160(public_key) != pubkey_hash:
+        return None
+
+    # The last byte of the signature is the sighash type
+    hash_type = signature[-1]
+    message = get_sighash_cache(tx).bip143_digest(
+        index, p2wpkh_script_code(pubkey_hash), vin.prevout.value, hash_type
+    )
+    return public_key, signature[:-1], message
+
+
+def verify_p2wpkh_program(tx, index, pubkey_hash):
+    """Checks the witness of an input against a 20 byte v0 program.
+
+    Shared by native P2WPKH and P2SH-P2WPKH, whose program comes from the
+    redeem script.
+    """
+    check = p2wpkh_signature(tx, index, pubkey_hash)
+    return check is not None and verify(*check)
+
+
+def verify_p2wpkh_batch(items):
+    """Verifies the P2WPKH inputs of many transactions together.
+
+    The signatures of the whole batch go through a single verify_batch()
+    call, which spreads them over a process pool when there are enough.
+
+    Args:
+      items: List of (tx, input index) spending P2WPKH outputs.
+
+    Returns:
+      One bool per item.
+    """
+    results = [False] * len(items)
+    checks = []
+    positions = []
+    for position, (tx, index) in enumerate(items):
+        vin = tx.vin[index]
+        if vin.script_sig:
+            continue
+        check = p2wpkh_signature(tx, index, vin.prevout.script_pubkey[2:])
+        if check is not None:
+            checks.append(check)
+            positions.append(position)
+    for position, valid in zip(positions, verify_batch(checks)):
+        results[position] = valid
+    return results
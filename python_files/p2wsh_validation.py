@@ -0,0 +1,52 @@
+from metrics import METRICS
+from script_validation import (
+    ScriptError,
+    TransactionChecker,
+    cached_multisig,
+    cast_to_bool,
+    check_multisig,
+    eval_script,
+    script_sha256,
+)
+
+
+def verify_p2wsh_input(tx, index):
+    vin = tx.vin[index]
+    if vin.script_sig:
+        return False
+    return verify_p2wsh_program(tx, index, vin.prevout.script_pubkey[2:])
+
+
+def verify_p2wsh_program(tx, index, script_hash):
+    """Checks the witness of an input against a 32 byte v0 program.
+
+    The last witness item is the witness script, committed to by its
+    SHA-256. Multisig witness scripts take the compiled route, anything else
+    runs through the interpreter with BIP143 signature hashes. Shared by
+    native P2WSH and P2SH-P2WSH, whose program comes from the redeem script.
+    """
+    vin = tx.vin[index]
+    if not vin.witness:
+        METRICS.inc("input_failures", template="p2wsh", reason="empty_witness")
+        return False
+    witness_script = vin.witness[-1]
+    if script_sha256(witness_script) != script_hash:
+        METRICS.inc("input_failures", template="p2wsh", reason="script_hash_mismatch")
+        return False
+
+    stack = list(vin.witness[:-1])
+    checker = TransactionChecker(tx, index, "witness_v0")
+    multisig = cached_multisig(witness_script)
+    if multisig is not None:
+        # <dummy> <sig>... with an empty dummy (BIP147) and nothing left over
+        num_signatures, public_keys = multisig
+        if len(stack) != num_signatures + 1 or stack[0] != b"":
+            return False
+        return check_multisig(stack[1:], public_keys, witness_script, checker)
+
+    try:
+        eval_script(witness_script, stack, checker, "witness_v0")
+    except (ScriptError, IndexError):
+        return False
+    # Segwit scripts must leave exactly one true element
+    return len(stack) == 1 and cast_to_bool(stack[0])
@@ -0,0 +1,113 @@
+from classifier import classify_script
+from script_validation import parse_pushes
+
+# Standardness limits of Bitcoin Core (policy/policy.h)
+MAX_STANDARD_TX_WEIGHT = 400000
+MAX_SCRIPT_SIZE = 10000
+MAX_OP_RETURN_RELAY = 83
+# Dust relay fee, in sat/vB
+DUST_RELAY_FEE = 3
+
+OP_RETURN = 0x6A
+WITNESS_TEMPLATES = ("p2wpkh", "p2wsh", "p2tr", "witness_unknown")
+
+
+def dust_threshold(script_pubkey):
+    """Smallest standard value of an output: what spending it would cost.
+
+    Returns:
+      The threshold in satoshis, 0 for OP_RETURN outputs.
+    """
+    if script_pubkey[:1] == bytes([OP_RETURN]):
+        return 0
+    # value + script size byte + script, plus the input spending it: outpoint,
+    # scriptSig size, sequence and a typical signature (witness discounted)
+    size = 8 + 1 + len(script_pubkey)
+    if classify_script(script_pubkey) in WITNESS_TEMPLATES:
+        size += 32 + 4 + 1 + 107 // 4 + 4
+    else:
+        size += 32 + 4 + 1 + 107 + 4
+    return size * DUST_RELAY_FEE
+
+
+def check_fee(tx):
+    # Outputs can not spend more than the inputs
+    return tx.fee >= 0
+
+
+def check_inputs(tx):
+    # At least one input and one output, no outpoint spent twice
+    if not tx.vin or not tx.vout:
+        return False
+    outpoints = {vin.outpoint for vin in tx.vin}
+    return len(outpoints) == len(tx.vin)
+
+
+def check_outputs(tx):
+    for vout in tx.vout:
+        script = vout.script_pubkey
+        if script[:1] == bytes([OP_RETURN]):
+            if len(script) > MAX_OP_RETURN_RELAY:
+                return False
+        elif len(script) > MAX_SCRIPT_SIZE or vout.value < dust_threshold(script):
+            return False
+    return True
+
+
+def check_size(tx):
+    return tx.weight <= MAX_STANDARD_TX_WEIGHT
+
+
+def _input_shape(vin):
+    # Does the scriptSig/witness have the shape the spent template expects?
+    template = classify_script(vin.prevout.script_pubkey)
+    if template in WITNESS_TEMPLATES:
+        if vin.script_sig or not vin.witness:
+            return False
+        return template != "p2wpkh" or len(vin.witness) == 2
+    if template == "p2sh":
+        # BIP16: push only, the last push is the redeem script
+        try:
+            return bool(parse_pushes(vin.script_sig))
+        except ValueError:
+            return False
+    if vin.witness:
+        # Legacy scripts have no witness to check
+        return False
+    if template == "p2pkh":
+        try:
+            return len(parse_pushes(vin.script_sig)) == 2
+        except ValueError:
+            return False
+    return True
+
+
+def check_input_shapes(tx):
+    for vin in tx.vin:
+        if vin.prevout is None or not _input_shape(vin):
+            return False
+    return True
+
+
+# Cheapest first. Tier 0 is check_transaction(), applied by the decoder
+# before a record exists; "script" (the signature checks of validation.py)
+# only runs once all of these pass.
+POLICY_TIERS = (
+    ("fee", check_fee),
+    ("inputs", check_inputs),
+    ("outputs", check_outputs),
+    ("size", check_size),
+    ("shape", check_input_shapes),
+)
+
+
+def policy_reject(tx):
+    """Runs the policy tiers in order, stopping at the first failure.
+
+    Returns:
+      The name of the tier rejecting tx, None when it passes all of them.
+    """
+    for name, check in POLICY_TIERS:
+        if not check(tx):
+            return name
+    return None
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import METRICS
+
+DEFAULT_THREADS = 4
+# Files read ahead of the consumer, and bytes they may hold
+DEFAULT_MAX_PENDING = 256
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+def list_json_files(folder):
+    # Sorted paths of the .json files of folder (one scandir, no stat)
+    return sorted(
+        entry.path
+        for entry in os.scandir(folder)
+        if entry.is_file() and entry.name.endswith(".json")
+    )
+
+
+def iter_json_files(folder):
+    # Paths of the .json files of folder in directory order, without
+    # holding the whole listing
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(".json"):
+                yield entry.path
+
+
+def _read(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def prefetch_files(
+    paths,
+    threads=DEFAULT_THREADS,
+    max_pending=DEFAULT_MAX_PENDING,
+    max_bytes=DEFAULT_MAX_BYTES,
+):
+    """Reads files on a thread pool ahead of the consumer.
+
+    File reads release the GIL, so the threads fill a bounded window while
+    the caller parses and validates. No new read starts while max_pending
+    files are waiting or while the ones already read hold max_bytes, which
+    keeps memory flat however large the folder is.
+
+    Args:
+      paths: Iterable of paths, consumed lazily.
+      threads: Reader threads.
+      max_pending: Files submitted and not yet consumed.
+      max_bytes: Bytes read and not yet consumed.
+
+    Yields:
+      (path, content or None when the file could not be read), in the order
+      of paths.
+    """
+    paths = iter(paths)
+    pending = deque()
+    lock = threading.Lock()
+    buffered = [0]
+
+    def read(path):
+        data = _read(path)
+        if data is not None:
+            with lock:
+                buffered[0] += len(data)
+        return data
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending and buffered[0] < max_bytes:
+                path = next(paths, None)
+                if path is None:
+                    exhausted = True
+                    break
+                pending.append((path, executor.submit(read, path)))
+            if not pending:
+                return
+
+            path, future = pending.popleft()
+            if future.done():
+                data = future.result()
+            else:
+                # The consumer is faster than the disk
+                started = time.perf_counter()
+                data = future.result()
+                METRICS.observe("reader_wait_seconds", time.perf_counter() - started)
+            if data is not None:
+                with lock:
+                    buffered[0] -= len(data)
+            yield path, data
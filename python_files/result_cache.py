@@ -0,0 +1,171 @@
+import sqlite3
+import struct
+
+from metrics import METRICS
+from transaction import WITNESS_SCALE_FACTOR
+
+# Bumped whenever a change to the parser or the validators can change a
+# stored verdict; the cache is emptied when the version differs
+VALIDATOR_VERSION = 6
+
+# Outpoint (txid LE + vout) followed by the sequence
+INPUT_SIZE = 40
+
+
+class CachedInput:
+    __slots__ = ("outpoint", "sequence")
+
+    def __init__(self, outpoint, sequence):
+        self.outpoint = outpoint
+        self.sequence = sequence
+
+    @property
+    def txid(self):
+        return self.outpoint[:32][::-1].hex()
+
+
+class CachedTransaction:
+    """Transaction restored from the result cache without parsing its JSON.
+
+    It carries what the block builder, the merkle trees and the outpoint
+    index read from a Transaction: ids, fee, weight and the spent outpoints.
+    """
+
+    __slots__ = ("txid_bytes", "wtxid_bytes", "fee", "weight", "vin")
+
+    def __init__(self, txid_bytes, wtxid_bytes, fee, weight, vin):
+        self.txid_bytes = txid_bytes
+        self.wtxid_bytes = wtxid_bytes
+        self.fee = fee
+        self.weight = weight
+        self.vin = vin
+
+    @property
+    def txid(self):
+        return self.txid_bytes[::-1].hex()
+
+    @property
+    def wtxid(self):
+        return self.wtxid_bytes[::-1].hex()
+
+    @property
+    def vsize(self):
+        return -(-self.weight // WITNESS_SCALE_FACTOR)
+
+
+class ResultCache:
+    """Verdicts of mempool files, keyed by the SHA-256 of their content.
+
+    A row holds the structural verdict, txid, wtxid, fee, weight, input
+    type mask, spent outpoints, the per input script verdicts and the
+    rejecting tier, so an unchanged file is neither parsed nor verified
+    again. Rows are written in batches by commit().
+    """
+
+    def __init__(self, path):
+        self.hits = 0
+        self.misses = 0
+        self._pending = []
+        self._db = sqlite3.connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        if row is None or row[0] != VALIDATOR_VERSION:
+            self._db.execute("DROP TABLE IF EXISTS results")
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (VALIDATOR_VERSION,)
+            )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, structural INTEGER, "
+            "txid BLOB, wtxid BLOB, fee INTEGER, weight INTEGER, mask INTEGER, inputs BLOB, "
+            "verdicts BLOB, valid INTEGER, rejected TEXT) WITHOUT ROWID"
+        )
+        self._db.commit()
+
+    def get(self, key, filename):
+        """Looks up the content hash of a file.
+
+        Returns:
+          None when the content is unknown, else a record dict like the ones
+          of ingest plus "valid"; its "tx" is None when the file failed the
+          structural check.
+        """
+        row = self._db.execute(
+            "SELECT structural, txid, wtxid, fee, weight, mask, inputs, valid, rejected "
+            "FROM results WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            METRICS.inc("result_cache", outcome="miss")
+            return None
+        self.hits += 1
+        METRICS.inc("result_cache", outcome="hit")
+
+        structural, txid, wtxid, fee, weight, mask, inputs, valid, rejected = row
+        if not structural:
+            return {
+                "filename": filename,
+                "txid": txid[::-1].hex() if txid is not None else None,
+                "mask": None,
+                "tx": None,
+                "valid": False,
+                "rejected": "structure",
+            }
+        vin = [
+            CachedInput(inputs[i : i + 36], struct.unpack_from("<I", inputs, i + 36)[0])
+            for i in range(0, len(inputs), INPUT_SIZE)
+        ]
+        tx = CachedTransaction(txid, wtxid, fee, weight, vin)
+        return {
+            "filename": filename,
+            "txid": tx.txid,
+            "mask": mask,
+            "tx": tx,
+            "key": key,
+            "valid": bool(valid),
+            "rejected": rejected,
+        }
+
+    def put_malformed(self, key, txid=None):
+        # The content failed the structural check; txid (hex) is kept when
+        # it could be computed, its descendants are left out of the block
+        txid_bytes = bytes.fromhex(txid)[::-1] if txid is not None else None
+        self._pending.append((key, 0, txid_bytes, None, None, None, None, None, None, 0, "structure"))
+
+    def put(self, record, verdicts):
+        # verdicts: one per input, see validation.batch_verdicts
+        tx = record["tx"]
+        inputs = b"".join(
+            vin.outpoint + struct.pack("<I", vin.sequence) for vin in tx.vin
+        )
+        self._pending.append(
+            (
+                record["key"],
+                1,
+                tx.txid_bytes,
+                tx.wtxid_bytes,
+                tx.fee,
+                tx.weight,
+                record["mask"],
+                inputs,
+                bytes(verdicts),
+                int(record["valid"]),
+                record.get("rejected"),
+            )
+        )
+
+    def commit(self):
+        if self._pending:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending,
+            )
+            self._db.commit()
+            self._pending = []
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
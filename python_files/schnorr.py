@@ -0,0 +1,271 @@
+import os
+from functools import lru_cache
+
+from transaction import tagged_hash
+
+# secp256k1: y^2 = x^3 + 7 over the field of FIELD_SIZE elements
+FIELD_SIZE = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+CURVE_ORDER = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+G = (
+    0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+    0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8,
+)
+
+# Below this many signatures a failed batch is checked one by one instead
+# of being split again
+MIN_BISECT = 4
+PUBKEY_CACHE_SIZE = 65536
+
+P = FIELD_SIZE
+
+
+# Points are affine (x, y) tuples or Jacobian (X, Y, Z) tuples with
+# x = X / Z^2 and y = Y / Z^3; None is the point at infinity
+
+
+def _double(p):
+    if p is None:
+        return None
+    x, y, z = p
+    if y == 0:
+        return None
+    yy = y * y % P
+    s = 4 * x * yy % P
+    m = 3 * x * x % P
+    x3 = (m * m - 2 * s) % P
+    return (x3, (m * (s - x3) - 8 * yy * yy) % P, 2 * y * z % P)
+
+
+def _add(p, q):
+    # Jacobian + Jacobian
+    if p is None:
+        return q
+    if q is None:
+        return p
+    x1, y1, z1 = p
+    x2, y2, z2 = q
+    z1z1 = z1 * z1 % P
+    z2z2 = z2 * z2 % P
+    u1 = x1 * z2z2 % P
+    u2 = x2 * z1z1 % P
+    s1 = y1 * z2 * z2z2 % P
+    s2 = y2 * z1 * z1z1 % P
+    if u1 == u2:
+        return _double(p) if s1 == s2 else None
+    h = u2 - u1
+    r = s2 - s1
+    hh = h * h % P
+    hhh = h * hh % P
+    v = u1 * hh % P
+    x3 = (r * r - hhh - 2 * v) % P
+    return (x3, (r * (v - x3) - s1 * hhh) % P, h * z1 * z2 % P)
+
+
+def _add_affine(p, x2, y2):
+    # Jacobian + affine, cheaper than _add
+    if p is None:
+        return (x2, y2, 1)
+    x1, y1, z1 = p
+    z1z1 = z1 * z1 % P
+    u2 = x2 * z1z1 % P
+    s2 = y2 * z1 * z1z1 % P
+    if x1 == u2:
+        return _double(p) if y1 == s2 else None
+    h = u2 - x1
+    r = s2 - y1
+    hh = h * h % P
+    hhh = h * hh % P
+    v = x1 * hh % P
+    x3 = (r * r - hhh - 2 * v) % P
+    return (x3, (r * (v - x3) - y1 * hhh) % P, h * z1 % P)
+
+
+def _to_affine(p):
+    if p is None:
+        return None
+    x, y, z = p
+    inverse = pow(z, -1, P)
+    inverse2 = inverse * inverse % P
+    return (x * inverse2 % P, y * inverse2 * inverse % P)
+
+
+def lift_x(x):
+    """BIP340 lift_x: the point with x coordinate x and an even y.
+
+    Returns:
+      The affine point, None when x is not on the curve.
+    """
+    if x >= P:
+        return None
+    c = (pow(x, 3, P) + 7) % P
+    y = pow(c, (P + 1) // 4, P)
+    if y * y % P != c:
+        return None
+    return (x, y if y & 1 == 0 else P - y)
+
+
+# The square root of lift_x is the most expensive step of a verification,
+# keys spending several inputs only pay it once
+_lift_pubkey = lru_cache(maxsize=PUBKEY_CACHE_SIZE)(lift_x)
+
+
+def _shamir(p1, k1, p2, k2):
+    # k1 * p1 + k2 * p2 with one shared doubling chain
+    both = _to_affine(_add_affine((p1[0], p1[1], 1), p2[0], p2[1]))
+    table = (None, p2, p1, both)
+    acc = None
+    for bit in range(max(k1.bit_length(), k2.bit_length()) - 1, -1, -1):
+        acc = _double(acc)
+        point = table[((k1 >> bit) & 1) << 1 | ((k2 >> bit) & 1)]
+        if point is not None:
+            acc = _add_affine(acc, point[0], point[1])
+    return acc
+
+
+def multi_scalar(pairs):
+    """Pippenger bucket method: sum of k * point over pairs.
+
+    Every window of c bits drops each point into the bucket of its digit
+    with a single addition, so n points cost about n * bits / c additions
+    instead of n separate multiplications.
+
+    Args:
+      pairs: List of (affine point, scalar).
+
+    Returns:
+      The Jacobian sum, None for the point at infinity.
+    """
+    pairs = [(point, k) for point, k in pairs if k]
+    if not pairs:
+        return None
+    c = max(1, min(16, len(pairs).bit_length() - 5))
+    mask = (1 << c) - 1
+    windows = (max(k.bit_length() for _, k in pairs) + c - 1) // c
+
+    acc = None
+    for window in range(windows - 1, -1, -1):
+        for _ in range(c):
+            acc = _double(acc)
+        shift = window * c
+        buckets = [None] * (mask + 1)
+        for (x, y), k in pairs:
+            digit = (k >> shift) & mask
+            if digit:
+                buckets[digit] = _add_affine(buckets[digit], x, y)
+        # sum of digit * bucket[digit] as a sum of running sums
+        running = None
+        total = None
+        for digit in range(mask, 0, -1):
+            running = _add(running, buckets[digit])
+            total = _add(total, running)
+        acc = _add(acc, total)
+    return acc
+
+
+def _parse(pubkey, signature, message):
+    # (P, R, s, e) of a signature, None when it can not be valid
+    if len(pubkey) != 32 or len(signature) != 64:
+        return None
+    point = _lift_pubkey(int.from_bytes(pubkey, "big"))
+    r = int.from_bytes(signature[:32], "big")
+    s = int.from_bytes(signature[32:], "big")
+    if point is None or r >= P or s >= CURVE_ORDER:
+        return None
+    e = int.from_bytes(
+        tagged_hash("BIP0340/challenge", signature[:32] + pubkey + message), "big"
+    ) % CURVE_ORDER
+    return point, r, s, e
+
+
+def _verify_parsed(parsed):
+    point, r, s, e = parsed
+    # R = s * G - e * P must have an even y and r as x coordinate
+    result = _to_affine(_shamir(G, s, point, CURVE_ORDER - e))
+    return result is not None and result[1] & 1 == 0 and result[0] == r
+
+
+def tweak_xonly(pubkey, tweak):
+    """BIP341 taproot tweak: the x-only key of lift_x(pubkey) + tweak * G.
+
+    Returns:
+      (32 byte x-only key, parity of its y), None when pubkey is not on the
+      curve, tweak is not below the curve order or the sum is infinity.
+    """
+    if len(pubkey) != 32:
+        return None
+    point = _lift_pubkey(int.from_bytes(pubkey, "big"))
+    t = int.from_bytes(tweak, "big")
+    if point is None or t >= CURVE_ORDER:
+        return None
+    result = _to_affine(_shamir(G, t, point, 1))
+    if result is None:
+        return None
+    return result[0].to_bytes(32, "big"), result[1] & 1
+
+
+def schnorr_verify(pubkey, signature, message):
+    """BIP340 verification of a 64 byte signature by a 32 byte x-only key."""
+    parsed = _parse(pubkey, signature, message)
+    return parsed is not None and _verify_parsed(parsed)
+
+
+def _batch_holds(lifted):
+    # Random linear combination of the verification equations:
+    # (sum a_i s_i) G == sum a_i R_i + sum a_i e_i P_i
+    pairs = []
+    keys = {}
+    total_s = 0
+    for i, (point, nonce, s, e) in enumerate(lifted):
+        # a_0 = 1, the others random 128 bit multipliers
+        a = 1 if i == 0 else int.from_bytes(os.urandom(16), "big")
+        total_s += a * s
+        pairs.append((nonce, a))
+        # Signatures by the same key share one point
+        keys[point] = (keys.get(point, 0) + a * e) % CURVE_ORDER
+    pairs.extend(keys.items())
+    pairs.append((G, -total_s % CURVE_ORDER))
+    return multi_scalar(pairs) is None
+
+
+def schnorr_verify_batch(items):
+    """Verifies many BIP340 signatures with one multi-scalar multiplication.
+
+    A failed batch is split in halves until the invalid signatures are
+    found, so the result is the same as verifying each one.
+
+    Args:
+      items: List of (32 byte x-only pubkey, 64 byte signature, message).
+
+    Returns:
+      A list of booleans in the same order as items.
+    """
+    results = [False] * len(items)
+    lifted = []
+    positions = []
+    for i, (pubkey, signature, message) in enumerate(items):
+        parsed = _parse(pubkey, signature, message)
+        if parsed is None:
+            continue
+        # R as a point; an r off the curve can not verify
+        point, r, s, e = parsed
+        nonce = lift_x(r)
+        if nonce is not None:
+            lifted.append((point, nonce, s, e))
+            positions.append(i)
+
+    def check(start, end):
+        if end - start <= MIN_BISECT:
+            for j in range(start, end):
+                point, nonce, s, e = lifted[j]
+                results[positions[j]] = _verify_parsed((point, nonce[0], s, e))
+            return
+        if _batch_holds(lifted[start:end]):
+            for j in range(start, end):
+                results[positions[j]] = True
+            return
+        middle = (start + end) // 2
+        check(start, middle)
+        check(middle, end)
+
+    check(0, len(lifted))
+    return results
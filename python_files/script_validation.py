@@ -0,0 +1,819 @@
+import hashlib
+from functools import lru_cache
+
+from sighash import get_sighash_cache, taproot_hash_type
+from transaction import hash160, hash256
+from verifier import verify, verify_schnorr
+
+
+OP_0 = 0x00
+OP_PUSHDATA1 = 0x4C
+OP_PUSHDATA2 = 0x4D
+OP_PUSHDATA4 = 0x4E
+OP_1NEGATE = 0x4F
+OP_1 = 0x51
+OP_16 = 0x60
+OP_NOP = 0x61
+OP_IF = 0x63
+OP_NOTIF = 0x64
+OP_VERIF = 0x65
+OP_VERNOTIF = 0x66
+OP_ELSE = 0x67
+OP_ENDIF = 0x68
+OP_VERIFY = 0x69
+OP_RETURN = 0x6A
+OP_TOALTSTACK = 0x6B
+OP_FROMALTSTACK = 0x6C
+OP_2DROP = 0x6D
+OP_2DUP = 0x6E
+OP_3DUP = 0x6F
+OP_2OVER = 0x70
+OP_2ROT = 0x71
+OP_2SWAP = 0x72
+OP_IFDUP = 0x73
+OP_DEPTH = 0x74
+OP_DROP = 0x75
+OP_DUP = 0x76
+OP_NIP = 0x77
+OP_OVER = 0x78
+OP_PICK = 0x79
+OP_ROLL = 0x7A
+OP_ROT = 0x7B
+OP_SWAP = 0x7C
+OP_TUCK = 0x7D
+OP_SIZE = 0x82
+OP_EQUAL = 0x87
+OP_EQUALVERIFY = 0x88
+OP_1ADD = 0x8B
+OP_1SUB = 0x8C
+OP_NEGATE = 0x8F
+OP_ABS = 0x90
+OP_NOT = 0x91
+OP_0NOTEQUAL = 0x92
+OP_ADD = 0x93
+OP_SUB = 0x94
+OP_BOOLAND = 0x9A
+OP_BOOLOR = 0x9B
+OP_NUMEQUAL = 0x9C
+OP_NUMEQUALVERIFY = 0x9D
+OP_NUMNOTEQUAL = 0x9E
+OP_LESSTHAN = 0x9F
+OP_GREATERTHAN = 0xA0
+OP_LESSTHANOREQUAL = 0xA1
+OP_GREATERTHANOREQUAL = 0xA2
+OP_MIN = 0xA3
+OP_MAX = 0xA4
+OP_WITHIN = 0xA5
+OP_RIPEMD160 = 0xA6
+OP_SHA1 = 0xA7
+OP_SHA256 = 0xA8
+OP_HASH160 = 0xA9
+OP_HASH256 = 0xAA
+OP_CODESEPARATOR = 0xAB
+OP_CHECKSIG = 0xAC
+OP_CHECKSIGVERIFY = 0xAD
+OP_CHECKMULTISIG = 0xAE
+OP_CHECKMULTISIGVERIFY = 0xAF
+OP_NOP1 = 0xB0
+OP_CHECKLOCKTIMEVERIFY = 0xB1
+OP_CHECKSEQUENCEVERIFY = 0xB2
+OP_NOP10 = 0xB9
+OP_CHECKSIGADD = 0xBA
+
+# Opcodes the interpreter knows, by value
+OP_CODES = {
+    value: name
+    for name, value in globals().items()
+    if name.startswith("OP_") and isinstance(value, int)
+}
+OP_CODES.update({value: f"OP_PUSHBYTES_{value}" for value in range(0x01, 0x4C)})
+OP_CODES.update({value: f"OP_PUSHNUM_{value - 0x50}" for value in range(OP_1, OP_16 + 1)})
+OP_CODES.update({value: f"OP_NOP{value - 0xAF}" for value in range(0xB3, OP_NOP10 + 1)})
+
+# OP_CAT and the other disabled opcodes: like OP_VERIF and OP_VERNOTIF they
+# fail the script even in a branch that is not executed
+DISABLED_OPCODES = frozenset(
+    (0x7E, 0x7F, 0x80, 0x81, 0x83, 0x84, 0x85, 0x86, 0x8D, 0x8E, 0x95, 0x96, 0x97, 0x98, 0x99)
+)
+
+# BIP342: in a tapscript these opcodes make the script succeed whatever
+# follows, they are kept for future soft forks
+OP_SUCCESS_OPCODES = frozenset(
+    (0x50, 0x62, 0x89, 0x8A, 0x8D, 0x8E)
+    + tuple(range(0x7E, 0x82))
+    + tuple(range(0x83, 0x87))
+    + tuple(range(0x95, 0x9A))
+    + tuple(range(0xBB, 0xFF))
+)
+
+MAX_SCRIPT_SIZE = 10000
+MAX_SCRIPT_ELEMENT_SIZE = 520
+MAX_OPS_PER_SCRIPT = 201
+MAX_STACK_SIZE = 1000
+MAX_PUBKEYS_PER_MULTISIG = 20
+LOCKTIME_THRESHOLD = 500000000
+SEQUENCE_LOCKTIME_DISABLE_FLAG = 1 << 31
+SEQUENCE_LOCKTIME_TYPE_FLAG = 1 << 22
+SEQUENCE_LOCKTIME_MASK = 0x0000FFFF
+# BIP342 signature budget: 50 plus the witness size, 50 per signature
+VALIDATION_WEIGHT_OFFSET = 50
+VALIDATION_WEIGHT_PER_SIGOP_PASSED = 50
+
+
+class ScriptError(Exception):
+    pass
+
+
+def parse_pushes(script):
+    # Splits a push-only script (scriptSig) into the data it pushes
+    items = []
+    i = 0
+    while i < len(script):
+        opcode = script[i]
+        i += 1
+        if opcode == 0x00:
+            items.append(b"")
+            continue
+        if opcode <= 0x4B:
+            size = opcode
+        elif opcode == 0x4C:
+            size = script[i]
+            i += 1
+        elif opcode == 0x4D:
+            size = int.from_bytes(script[i : i + 2], "little")
+            i += 2
+        elif opcode == 0x4E:
+            size = int.from_bytes(script[i : i + 4], "little")
+            i += 4
+        else:
+            raise ValueError(f"non push opcode {opcode:#04x} in push only script")
+        if i + size > len(script):
+            raise ValueError("push past the end of the script")
+        items.append(script[i : i + size])
+        i += size
+    return items
+
+
+def iter_script(script):
+    # Yields (opcode, pushed data or None, offset after the opcode)
+    i = 0
+    n = len(script)
+    while i < n:
+        opcode = script[i]
+        i += 1
+        data = None
+        if opcode <= OP_PUSHDATA4:
+            if opcode < OP_PUSHDATA1:
+                size = opcode
+            elif opcode == OP_PUSHDATA1:
+                size = script[i] if i < n else 0
+                i += 1
+            elif opcode == OP_PUSHDATA2:
+                size = int.from_bytes(script[i : i + 2], "little")
+                i += 2
+            else:
+                size = int.from_bytes(script[i : i + 4], "little")
+                i += 4
+            if i + size > n:
+                raise ScriptError("push past the end of the script")
+            data = script[i : i + size]
+            i += size
+        yield opcode, data, i
+
+
+def push_data(data):
+    # Minimal push of data, used to rebuild scripts
+    size = len(data)
+    if size < OP_PUSHDATA1:
+        return bytes([size]) + data
+    if size <= 0xFF:
+        return bytes([OP_PUSHDATA1, size]) + data
+    if size <= 0xFFFF:
+        return bytes([OP_PUSHDATA2]) + size.to_bytes(2, "little") + data
+    return bytes([OP_PUSHDATA4]) + size.to_bytes(4, "little") + data
+
+
+def is_push_only(script):
+    try:
+        return all(opcode <= OP_16 for opcode, _, _ in iter_script(script))
+    except ScriptError:
+        return False
+
+
+def decode_num(data, max_size=4):
+    if len(data) > max_size:
+        raise ScriptError("script number overflow")
+    if not data:
+        return 0
+    # Minimal encoding: no superfluous zero byte at the top
+    if data[-1] & 0x7F == 0 and (len(data) == 1 or not data[-2] & 0x80):
+        raise ScriptError("non minimal script number")
+    value = int.from_bytes(data, "little")
+    if data[-1] & 0x80:
+        return -(value & ~(0x80 << (8 * (len(data) - 1))))
+    return value
+
+
+def encode_num(value):
+    if value == 0:
+        return b""
+    negative = value < 0
+    value = abs(value)
+    out = bytearray()
+    while value:
+        out.append(value & 0xFF)
+        value >>= 8
+    if out[-1] & 0x80:
+        out.append(0x80 if negative else 0x00)
+    elif negative:
+        out[-1] |= 0x80
+    return bytes(out)
+
+
+def cast_to_bool(data):
+    for i, byte in enumerate(data):
+        if byte:
+            # Negative zero is false
+            return not (i == len(data) - 1 and byte == 0x80)
+    return False
+
+
+# Standard templates, recognized from the raw scriptPubKey bytes
+def is_p2pkh(script):
+    return (
+        len(script) == 25
+        and script[0] == OP_DUP
+        and script[1] == OP_HASH160
+        and script[2] == 20
+        and script[23] == OP_EQUALVERIFY
+        and script[24] == OP_CHECKSIG
+    )
+
+
+def is_p2sh(script):
+    return (
+        len(script) == 23
+        and script[0] == OP_HASH160
+        and script[1] == 20
+        and script[22] == OP_EQUAL
+    )
+
+
+def witness_program(script):
+    # (version, program) of a segwit scriptPubKey, None otherwise
+    if not 4 <= len(script) <= 42:
+        return None
+    version = script[0]
+    if version != OP_0 and not OP_1 <= version <= OP_16:
+        return None
+    if script[1] + 2 != len(script):
+        return None
+    return (0 if version == OP_0 else version - 0x50), script[2:]
+
+
+def match_template(script):
+    """Recognizes the standard scriptPubKey templates.
+
+    Args:
+      script: Raw scriptPubKey bytes.
+
+    Returns:
+      "p2pkh", "p2sh", "p2wpkh", "p2wsh", "p2tr", "witness_unknown" or None
+      for anything else.
+    """
+    if is_p2pkh(script):
+        return "p2pkh"
+    if is_p2sh(script):
+        return "p2sh"
+    program = witness_program(script)
+    if program is not None:
+        version, data = program
+        if version == 0 and len(data) == 20:
+            return "p2wpkh"
+        if version == 0 and len(data) == 32:
+            return "p2wsh"
+        if version == 1 and len(data) == 32:
+            return "p2tr"
+        return "witness_unknown"
+    return None
+
+
+def parse_multisig(script):
+    # (m, public keys) of OP_m <pubkey>... OP_n OP_CHECKMULTISIG, else None
+    if len(script) < 3 or script[-1] != OP_CHECKMULTISIG:
+        return None
+    m = script[0] - 0x50
+    n = script[-2] - 0x50
+    if not 1 <= m <= n <= 16:
+        return None
+    try:
+        public_keys = parse_pushes(script[1:-2])
+    except ValueError:
+        return None
+    if len(public_keys) != n:
+        return None
+    return m, public_keys
+
+
+# Redeem and witness scripts are parsed by the dispatch and again by their
+# validator, and a reused multisig is spent by several inputs, so their
+# hashes and parsed forms are cached by content
+SCRIPT_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=SCRIPT_CACHE_SIZE)
+def script_hash160(script):
+    # P2SH commitment of a redeem script
+    return hash160(script)
+
+
+@lru_cache(maxsize=SCRIPT_CACHE_SIZE)
+def script_sha256(script):
+    # P2WSH commitment of a witness script
+    return hashlib.sha256(script).digest()
+
+
+@lru_cache(maxsize=SCRIPT_CACHE_SIZE)
+def cached_multisig(script):
+    # parse_multisig() with the keys as a tuple, shared between callers
+    multisig = parse_multisig(script)
+    if multisig is None:
+        return None
+    return multisig[0], tuple(multisig[1])
+
+
+def find_and_delete(script, data):
+    # Removes every push of data from a legacy scriptCode
+    if not data:
+        return script
+    pattern = push_data(data)
+    out = bytearray()
+    start = 0
+    for _, _, end in iter_script(script):
+        if script[start:end] != pattern:
+            out += script[start:end]
+        start = end
+    return bytes(out)
+
+
+def eval_script(script, stack, checker, sigversion="base"):
+    """Runs a script on a stack.
+
+    Args:
+      script: Raw script bytes.
+      stack: List of byte strings, modified in place.
+      checker: Object with check_sig(signature, pubkey, script_code),
+        check_locktime(n) and check_sequence(n); for tapscript
+        check_schnorr_sig(signature, pubkey, codesep_pos) instead of
+        check_sig().
+      sigversion: "base" for legacy scripts, "witness_v0" for P2WSH,
+        "tapscript" for a P2TR script path leaf.
+
+    Raises:
+      ScriptError: When the script fails.
+    """
+    if sigversion == "tapscript":
+        # BIP342 drops the script size and operation count limits. An
+        # OP_SUCCESSx would make the spend valid unchecked: like Bitcoin
+        # Core's policy, such scripts are refused
+        for opcode, data, _ in iter_script(script):
+            if data is None and opcode in OP_SUCCESS_OPCODES:
+                raise ScriptError(f"op_success {opcode:#04x}")
+    elif len(script) > MAX_SCRIPT_SIZE:
+        raise ScriptError("script too large")
+
+    altstack = []
+    exec_stack = []
+    op_count = 0
+    code_start = 0
+    codesep_pos = 0xFFFFFFFF
+
+    def pop():
+        if not stack:
+            raise ScriptError("stack underflow")
+        return stack.pop()
+
+    def pop_num():
+        return decode_num(pop())
+
+    def need(count):
+        if len(stack) < count:
+            raise ScriptError("stack underflow")
+
+    for position, (opcode, data, offset) in enumerate(iter_script(script)):
+        executing = all(exec_stack)
+
+        if data is not None and len(data) > MAX_SCRIPT_ELEMENT_SIZE:
+            raise ScriptError("push too large")
+        if opcode > OP_16 and sigversion != "tapscript":
+            op_count += 1
+            if op_count > MAX_OPS_PER_SCRIPT:
+                raise ScriptError("too many operations")
+
+        if data is not None:
+            if executing:
+                stack.append(data)
+        elif opcode in (OP_VERIF, OP_VERNOTIF) or opcode in DISABLED_OPCODES:
+            # Checked before the conditionals: OP_VERIF and OP_VERNOTIF sit in
+            # their opcode range but are invalid executed or not
+            raise ScriptError(f"bad opcode {opcode:#04x}")
+        elif OP_IF <= opcode <= OP_ENDIF:
+            if opcode in (OP_IF, OP_NOTIF):
+                value = False
+                if executing:
+                    condition = pop()
+                    if sigversion != "base" and condition not in (b"", b"\x01"):
+                        raise ScriptError("non minimal if")
+                    value = cast_to_bool(condition)
+                    if opcode == OP_NOTIF:
+                        value = not value
+                exec_stack.append(value)
+            elif opcode == OP_ELSE:
+                if not exec_stack:
+                    raise ScriptError("unbalanced conditional")
+                exec_stack[-1] = not exec_stack[-1]
+            elif opcode == OP_ENDIF:
+                if not exec_stack:
+                    raise ScriptError("unbalanced conditional")
+                exec_stack.pop()
+            else:
+                raise ScriptError(f"bad opcode {opcode:#04x}")
+        elif not executing:
+            continue
+        elif opcode == OP_1NEGATE or OP_1 <= opcode <= OP_16:
+            stack.append(encode_num(-1 if opcode == OP_1NEGATE else opcode - 0x50))
+        elif opcode == OP_NOP or OP_NOP1 == opcode or 0xB3 <= opcode <= OP_NOP10:
+            pass
+        elif opcode == OP_CHECKLOCKTIMEVERIFY:
+            need(1)
+            if not checker.check_locktime(decode_num(stack[-1], 5)):
+                raise ScriptError("locktime requirement not satisfied")
+        elif opcode == OP_CHECKSEQUENCEVERIFY:
+            need(1)
+            if not checker.check_sequence(decode_num(stack[-1], 5)):
+                raise ScriptError("sequence requirement not satisfied")
+        elif opcode == OP_VERIFY:
+            if not cast_to_bool(pop()):
+                raise ScriptError("verify failed")
+        elif opcode == OP_RETURN:
+            raise ScriptError("op_return")
+        elif opcode == OP_TOALTSTACK:
+            altstack.append(pop())
+        elif opcode == OP_FROMALTSTACK:
+            if not altstack:
+                raise ScriptError("altstack underflow")
+            stack.append(altstack.pop())
+        elif opcode == OP_2DROP:
+            need(2)
+            del stack[-2:]
+        elif opcode == OP_2DUP:
+            need(2)
+            stack.extend(stack[-2:])
+        elif opcode == OP_3DUP:
+            need(3)
+            stack.extend(stack[-3:])
+        elif opcode == OP_2OVER:
+            need(4)
+            stack.extend(stack[-4:-2])
+        elif opcode == OP_2ROT:
+            need(6)
+            items = stack[-6:-4]
+            del stack[-6:-4]
+            stack.extend(items)
+        elif opcode == OP_2SWAP:
+            need(4)
+            stack[-4:] = stack[-2:] + stack[-4:-2]
+        elif opcode == OP_IFDUP:
+            need(1)
+            if cast_to_bool(stack[-1]):
+                stack.append(stack[-1])
+        elif opcode == OP_DEPTH:
+            stack.append(encode_num(len(stack)))
+        elif opcode == OP_DROP:
+            pop()
+        elif opcode == OP_DUP:
+            need(1)
+            stack.append(stack[-1])
+        elif opcode == OP_NIP:
+            need(2)
+            del stack[-2]
+        elif opcode == OP_OVER:
+            need(2)
+            stack.append(stack[-2])
+        elif opcode in (OP_PICK, OP_ROLL):
+            n = pop_num()
+            if n < 0 or n >= len(stack):
+                raise ScriptError("invalid stack index")
+            item = stack[-n - 1]
+            if opcode == OP_ROLL:
+                del stack[-n - 1]
+            stack.append(item)
+        elif opcode == OP_ROT:
+            need(3)
+            stack.append(stack.pop(-3))
+        elif opcode == OP_SWAP:
+            need(2)
+            stack[-2], stack[-1] = stack[-1], stack[-2]
+        elif opcode == OP_TUCK:
+            need(2)
+            stack.insert(-2, stack[-1])
+        elif opcode == OP_SIZE:
+            need(1)
+            stack.append(encode_num(len(stack[-1])))
+        elif opcode in (OP_EQUAL, OP_EQUALVERIFY):
+            equal = pop() == pop()
+            if opcode == OP_EQUALVERIFY:
+                if not equal:
+                    raise ScriptError("equalverify failed")
+            else:
+                stack.append(b"\x01" if equal else b"")
+        elif OP_1ADD <= opcode <= OP_0NOTEQUAL:
+            a = pop_num()
+            if opcode == OP_1ADD:
+                result = a + 1
+            elif opcode == OP_1SUB:
+                result = a - 1
+            elif opcode == OP_NEGATE:
+                result = -a
+            elif opcode == OP_ABS:
+                result = abs(a)
+            elif opcode == OP_NOT:
+                result = int(a == 0)
+            elif opcode == OP_0NOTEQUAL:
+                result = int(a != 0)
+            else:
+                raise ScriptError(f"disabled opcode {opcode:#04x}")
+            stack.append(encode_num(result))
+        elif OP_ADD <= opcode <= OP_MAX:
+            b = pop_num()
+            a = pop_num()
+            if opcode == OP_ADD:
+                result = a + b
+            elif opcode == OP_SUB:
+                result = a - b
+            elif opcode == OP_BOOLAND:
+                result = int(a != 0 and b != 0)
+            elif opcode == OP_BOOLOR:
+                result = int(a != 0 or b != 0)
+            elif opcode in (OP_NUMEQUAL, OP_NUMEQUALVERIFY):
+                result = int(a == b)
+            elif opcode == OP_NUMNOTEQUAL:
+                result = int(a != b)
+            elif opcode == OP_LESSTHAN:
+                result = int(a < b)
+            elif opcode == OP_GREATERTHAN:
+                result = int(a > b)
+            elif opcode == OP_LESSTHANOREQUAL:
+                result = int(a <= b)
+            elif opcode == OP_GREATERTHANOREQUAL:
+                result = int(a >= b)
+            elif opcode == OP_MIN:
+                result = min(a, b)
+            elif opcode == OP_MAX:
+                result = max(a, b)
+            else:
+                raise ScriptError(f"disabled opcode {opcode:#04x}")
+            if opcode == OP_NUMEQUALVERIFY:
+                if not result:
+                    raise ScriptError("numequalverify failed")
+            else:
+                stack.append(encode_num(result))
+        elif opcode == OP_WITHIN:
+            upper = pop_num()
+            lower = pop_num()
+            value = pop_num()
+            stack.append(encode_num(int(lower <= value < upper)))
+        elif opcode == OP_RIPEMD160:
+            stack.append(hashlib.new("ripemd160", pop()).digest())
+        elif opcode == OP_SHA1:
+            stack.append(hashlib.sha1(pop()).digest())
+        elif opcode == OP_SHA256:
+            stack.append(hashlib.sha256(pop()).digest())
+        elif opcode == OP_HASH160:
+            stack.append(hash160(pop()))
+        elif opcode == OP_HASH256:
+            stack.append(hash256(pop()))
+        elif opcode == OP_CODESEPARATOR:
+            code_start = offset
+            codesep_pos = position
+        elif opcode in (OP_CHECKSIG, OP_CHECKSIGVERIFY):
+            pubkey = pop()
+            signature = pop()
+            if sigversion == "tapscript":
+                valid = checker.check_schnorr_sig(signature, pubkey, codesep_pos)
+            else:
+                script_code = script[code_start:]
+                if sigversion == "base":
+                    script_code = find_and_delete(script_code, signature)
+                valid = bool(signature) and checker.check_sig(signature, pubkey, script_code)
+            if opcode == OP_CHECKSIGVERIFY:
+                if not valid:
+                    raise ScriptError("checksigverify failed")
+            else:
+                stack.append(b"\x01" if valid else b"")
+        elif opcode == OP_CHECKSIGADD and sigversion == "tapscript":
+            # <sig> <n> <pubkey> -> n + 1 for a valid signature, n for an
+            # empty one
+            need(3)
+            pubkey = pop()
+            n = pop_num()
+            signature = pop()
+            valid = checker.check_schnorr_sig(signature, pubkey, codesep_pos)
+            stack.append(encode_num(n + 1 if valid else n))
+        elif opcode in (OP_CHECKMULTISIG, OP_CHECKMULTISIGVERIFY):
+            if sigversion == "tapscript":
+                raise ScriptError("checkmultisig in tapscript")
+            key_count = pop_num()
+            if not 0 <= key_count <= MAX_PUBKEYS_PER_MULTISIG:
+                raise ScriptError("invalid pubkey count")
+            op_count += key_count
+            if op_count > MAX_OPS_PER_SCRIPT:
+                raise ScriptError("too many operations")
+            public_keys = [pop() for _ in range(key_count)][::-1]
+            sig_count = pop_num()
+            if not 0 <= sig_count <= key_count:
+                raise ScriptError("invalid signature count")
+            signatures = [pop() for _ in range(sig_count)][::-1]
+            # The extra element popped by the original off by one bug must be
+            # empty (BIP147)
+            if pop() != b"":
+                raise ScriptError("multisig dummy not null")
+            script_code = script[code_start:]
+            if sigversion == "base":
+                for signature in signatures:
+                    script_code = find_and_delete(script_code, signature)
+            valid = check_multisig(signatures, public_keys, script_code, checker)
+            if opcode == OP_CHECKMULTISIGVERIFY:
+                if not valid:
+                    raise ScriptError("checkmultisigverify failed")
+            else:
+                stack.append(b"\x01" if valid else b"")
+        else:
+            raise ScriptError(f"bad opcode {opcode:#04x}")
+
+        if len(stack) + len(altstack) > MAX_STACK_SIZE:
+            raise ScriptError("stack size limit")
+
+    if exec_stack:
+        raise ScriptError("unbalanced conditional")
+
+
+def check_multisig(signatures, public_keys, script_code, checker):
+    # signatures and public_keys are in script order (first pushed first).
+    # Signatures must match keys in that order and a key that fails is never
+    # tried again.
+    key_index = 0
+    for signature in signatures:
+        while True:
+            if len(public_keys) - key_index < 1:
+                return False
+            public_key = public_keys[key_index]
+            key_index += 1
+            if signature and checker.check_sig(signature, public_key, script_code):
+                break
+    return True
+
+
+class TransactionChecker:
+    """Signature, locktime and sequence checks of one transaction input.
+
+    Args:
+      tx: The spending Transaction.
+      index: Index of the input being verified.
+      sigversion: "base" (legacy sighash) or "witness_v0" (BIP143 sighash).
+    """
+
+    def __init__(self, tx, index, sigversion="base"):
+        self.tx = tx
+        self.index = index
+        self.sigversion = sigversion
+
+    def check_sig(self, signature, pubkey, script_code):
+        if not signature:
+            return False
+        sighash = get_sighash_cache(self.tx)
+        hash_type = signature[-1]
+        if self.sigversion == "witness_v0":
+            amount = self.tx.vin[self.index].prevout.value
+            message = sighash.bip143_digest(self.index, script_code, amount, hash_type)
+        else:
+            message = sighash.legacy_digest(self.index, script_code, hash_type)
+        return verify(pubkey, signature[:-1], message)
+
+    def check_locktime(self, locktime):
+        # BIP65
+        tx_locktime = self.tx.locktime
+        if locktime < 0:
+            return False
+        if (locktime < LOCKTIME_THRESHOLD) != (tx_locktime < LOCKTIME_THRESHOLD):
+            return False
+        if locktime > tx_locktime:
+            return False
+        return self.tx.vin[self.index].sequence != 0xFFFFFFFF
+
+    def check_sequence(self, sequence):
+        # BIP112
+        if sequence < 0:
+            return False
+        if sequence & SEQUENCE_LOCKTIME_DISABLE_FLAG:
+            return True
+        if self.tx.version < 2:
+            return False
+        tx_sequence = self.tx.vin[self.index].sequence
+        if tx_sequence & SEQUENCE_LOCKTIME_DISABLE_FLAG:
+            return False
+        mask = SEQUENCE_LOCKTIME_TYPE_FLAG | SEQUENCE_LOCKTIME_MASK
+        sequence &= mask
+        tx_sequence &= mask
+        if (sequence < SEQUENCE_LOCKTIME_TYPE_FLAG) != (tx_sequence < SEQUENCE_LOCKTIME_TYPE_FLAG):
+            return False
+        return sequence <= tx_sequence
+
+
+class TaprootChecker(TransactionChecker):
+    """Signature checks of a tapscript leaf (BIP342).
+
+    Args:
+      tx: The spending Transaction.
+      index: Index of the input being verified.
+      leaf_hash: TapLeaf hash of the executed script.
+      annex: The annex of the witness, if any.
+      budget: Signature validation budget, VALIDATION_WEIGHT_OFFSET plus the
+        serialized size of the witness.
+      deferred: When given, a list the (pubkey, signature, message) checks
+        are appended to instead of being verified, for a later batch. A
+        failing one would have failed the script, so the spend is valid if
+        the script succeeds and all of them verify.
+    """
+
+    def __init__(self, tx, index, leaf_hash, annex, budget, deferred=None):
+        super().__init__(tx, index, "tapscript")
+        self.leaf_hash = leaf_hash
+        self.annex = annex
+        self.budget = budget
+        self.deferred = deferred
+
+    def check_schnorr_sig(self, signature, pubkey, codesep_pos):
+        """BIP340 check of a tapscript signature.
+
+        Returns:
+          False for an empty signature, True for a valid one.
+
+        Raises:
+          ScriptError: For any other signature, an empty key, a key that is
+            not 32 bytes (refused by policy) or an exhausted budget.
+        """
+        if signature:
+            self.budget -= VALIDATION_WEIGHT_PER_SIGOP_PASSED
+            if self.budget < 0:
+                raise ScriptError("tapscript validation weight exceeded")
+        if not pubkey:
+            raise ScriptError("empty tapscript pubkey")
+        if len(pubkey) != 32:
+            raise ScriptError("unknown tapscript pubkey type")
+        if not signature:
+            return False
+        hash_type = taproot_hash_type(signature)
+        if hash_type is None:
+            raise ScriptError("invalid schnorr signature size")
+        message = get_sighash_cache(self.tx).taproot_digest(
+            self.index, hash_type, self.annex, self.leaf_hash, codesep_pos
+        )
+        if message is None:
+            raise ScriptError("invalid taproot sighash type")
+        if self.deferred is not None:
+            self.deferred.append((pubkey, signature[:64], message))
+        elif not verify_schnorr(pubkey, signature[:64], message):
+            raise ScriptError("schnorr signature failed")
+        return True
+
+
+def verify_script(script_sig, script_pubkey, checker):
+    """Generic evaluation of a legacy (non segwit) input.
+
+    Runs the scriptSig, then the scriptPubKey on the resulting stack, and for
+    P2SH the redeem script on top of it.
+
+    Returns:
+      True if the input is valid.
+    """
+    try:
+        if not is_push_only(script_sig) and is_p2sh(script_pubkey):
+            return False
+        stack = []
+        eval_script(script_sig, stack, checker)
+        p2sh_stack = list(stack)
+        eval_script(script_pubkey, stack, checker)
+        if not stack or not cast_to_bool(stack[-1]):
+            return False
+
+        if is_p2sh(script_pubkey):
+            if not p2sh_stack:
+                return False
+            redeem_script = p2sh_stack.pop()
+            eval_script(redeem_script, p2sh_stack, checker)
+            if not p2sh_stack or not cast_to_bool(p2sh_stack[-1]):
+                return False
+    except (ScriptError, IndexError):
+        return False
+    return True
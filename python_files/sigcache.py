@@ -0,0 +1,103 @@
+import hashlib
+import os
+import sqlite3
+from collections import OrderedDict
+
+
+DEFAULT_MAX_ENTRIES = 200000
+# Bumped when the entry keys change; the stored entries are dropped when
+# the version of the file differs
+ENTRY_VERSION = 2
+
+
+class SignatureCache:
+    """Bounded cache of signatures that already verified.
+
+    Like Bitcoin Core's sigcache only valid signatures are stored, under a
+    salted hash of (message, pubkey, signature), so a repeated check skips
+    the curve math. An optional sqlite file keeps the entries between runs.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = []
+        self._db = None
+        if path:
+            self._open(path)
+        else:
+            self.salt = os.urandom(32)
+
+    def _open(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value BLOB)")
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        if row is None or row[0] != ENTRY_VERSION:
+            self._db.execute("DROP TABLE IF EXISTS sigcache")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (ENTRY_VERSION,))
+        self._db.execute("CREATE TABLE IF NOT EXISTS sigcache (entry BLOB PRIMARY KEY)")
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'salt'").fetchone()
+        if row is None:
+            # The salt has to survive restarts for stored entries to match
+            self.salt = os.urandom(32)
+            self._db.execute("INSERT INTO meta VALUES ('salt', ?)", (self.salt,))
+            self._db.commit()
+        else:
+            self.salt = row[0]
+
+    def entry(self, message, pubkey, signature):
+        # Every field is length prefixed: pubkeys and DER signatures vary in
+        # size, so a plain concatenation could match two different triples
+        h = hashlib.sha256(self.salt)
+        for field in (message, pubkey, signature):
+            h.update(len(field).to_bytes(4, "little"))
+            h.update(field)
+        return h.digest()
+
+    def contains(self, entry):
+        if entry in self._entries:
+            self._entries.move_to_end(entry)
+            self.hits += 1
+            return True
+        if self._db is not None:
+            row = self._db.execute("SELECT 1 FROM sigcache WHERE entry = ?", (entry,)).fetchone()
+            if row is not None:
+                self._remember(entry)
+                self.hits += 1
+                return True
+        self.misses += 1
+        return False
+
+    def _remember(self, entry):
+        self._entries[entry] = None
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def add(self, entry):
+        self._remember(entry)
+        if self._db is not None:
+            self._pending.append((entry,))
+
+    def flush(self):
+        # Writes the entries added since the last flush to the sqlite file
+        if self._db is not None and self._pending:
+            self._db.executemany("INSERT OR IGNORE INTO sigcache VALUES (?)", self._pending)
+            # Keep the file bounded too, dropping the oldest rows first
+            self._db.execute(
+                "DELETE FROM sigcache WHERE rowid <= (SELECT MAX(rowid) FROM sigcache) - ?",
+                (self.max_entries,),
+            )
+            self._db.commit()
+            self._pending = []
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
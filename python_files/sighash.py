@@ -0,0 +1,342 @@
+import hashlib
+import struct
+
+from create_txid import compact_size
+from transaction import hash256, tagged_hash_state
+
+
+# BIP341: taproot signatures without a sighash byte mean SIGHASH_ALL
+SIGHASH_DEFAULT = 0x00
+SIGHASH_ALL = 0x01
+SIGHASH_NONE = 0x02
+SIGHASH_SINGLE = 0x03
+SIGHASH_ANYONECANPAY = 0x80
+
+ZERO_HASH = b"\x00" * 32
+# Digest signed by SIGHASH_SINGLE when there is no output at the input's index
+SINGLE_BUG_HASH = b"\x01" + b"\x00" * 31
+
+TAPROOT_HASH_TYPES = frozenset((0x00, 0x01, 0x02, 0x03, 0x81, 0x82, 0x83))
+
+
+def taproot_hash_type(signature):
+    # Sighash type of a BIP340 signature: 64 bytes mean SIGHASH_DEFAULT, 65
+    # bytes carry an explicit one that can not be the default; None otherwise
+    if len(signature) == 64:
+        return SIGHASH_DEFAULT
+    if len(signature) == 65 and signature[-1] != SIGHASH_DEFAULT:
+        return signature[-1]
+    return None
+
+
+class SighashCache:
+    """Per transaction state shared by the signature hashes of its inputs.
+
+    The BIP143 hashPrevouts, hashSequence and hashOutputs and the BIP341
+    sha_prevouts, sha_amounts, sha_scriptpubkeys, sha_sequences and
+    sha_outputs only depend on the transaction, so they are computed once
+    and every input only hashes its own fields on top of them. The BIP143
+    hashes are the second SHA-256 of the BIP341 ones.
+    """
+
+    __slots__ = (
+        "tx",
+        "_sha_prevouts",
+        "_sha_amounts",
+        "_sha_scriptpubkeys",
+        "_sha_sequences",
+        "_sha_outputs",
+        "_hash_prevouts",
+        "_hash_sequence",
+        "_hash_outputs",
+        "_prefix",
+        "_taproot_prefix",
+        "_legacy_inputs",
+        "_legacy_offsets",
+        "_legacy_outputs",
+    )
+
+    def __init__(self, tx):
+        self.tx = tx
+        self._sha_prevouts = None
+        self._sha_amounts = None
+        self._sha_scriptpubkeys = None
+        self._sha_sequences = None
+        self._sha_outputs = None
+        self._hash_prevouts = None
+        self._hash_sequence = None
+        self._hash_outputs = None
+        # sha256 midstates over version + hashPrevouts + hashSequence
+        self._prefix = {}
+        # Tagged hash midstates over the BIP341 transaction data, per hash type
+        self._taproot_prefix = {}
+        # Inputs with empty scriptSigs and the outputs + locktime used by
+        # every legacy SIGHASH_ALL digest of the transaction
+        self._legacy_inputs = None
+        self._legacy_offsets = None
+        self._legacy_outputs = None
+
+    def sha_prevouts(self):
+        if self._sha_prevouts is None:
+            self._sha_prevouts = _sha256(b"".join(vin.outpoint for vin in self.tx.vin))
+        return self._sha_prevouts
+
+    def sha_amounts(self):
+        if self._sha_amounts is None:
+            self._sha_amounts = _sha256(
+                b"".join(struct.pack("<q", vin.prevout.value) for vin in self.tx.vin)
+            )
+        return self._sha_amounts
+
+    def sha_scriptpubkeys(self):
+        if self._sha_scriptpubkeys is None:
+            self._sha_scriptpubkeys = _sha256(
+                b"".join(
+                    compact_size(len(vin.prevout.script_pubkey)) + vin.prevout.script_pubkey
+                    for vin in self.tx.vin
+                )
+            )
+        return self._sha_scriptpubkeys
+
+    def sha_sequences(self):
+        if self._sha_sequences is None:
+            self._sha_sequences = _sha256(
+                b"".join(struct.pack("<I", vin.sequence) for vin in self.tx.vin)
+            )
+        return self._sha_sequences
+
+    def sha_outputs(self):
+        if self._sha_outputs is None:
+            self._sha_outputs = _sha256(b"".join(vout.serialize() for vout in self.tx.vout))
+        return self._sha_outputs
+
+    def hash_prevouts(self):
+        if self._hash_prevouts is None:
+            self._hash_prevouts = _sha256(self.sha_prevouts())
+        return self._hash_prevouts
+
+    def hash_sequence(self):
+        if self._hash_sequence is None:
+            self._hash_sequence = _sha256(self.sha_sequences())
+        return self._hash_sequence
+
+    def hash_outputs(self):
+        if self._hash_outputs is None:
+            self._hash_outputs = _sha256(self.sha_outputs())
+        return self._hash_outputs
+
+    def _bip143_prefix(self, hash_type):
+        anyone_can_pay = hash_type & SIGHASH_ANYONECANPAY
+        base_type = hash_type & 0x1F
+        key = (anyone_can_pay, base_type in (SIGHASH_SINGLE, SIGHASH_NONE))
+        prefix = self._prefix.get(key)
+        if prefix is None:
+            hash_prevouts = ZERO_HASH if anyone_can_pay else self.hash_prevouts()
+            if anyone_can_pay or key[1]:
+                hash_sequence = ZERO_HASH
+            else:
+                hash_sequence = self.hash_sequence()
+            prefix = hashlib.sha256(
+                struct.pack("<I", self.tx.version) + hash_prevouts + hash_sequence
+            )
+            self._prefix[key] = prefix
+        return prefix
+
+    def bip143_digest(self, index, script_code, amount, hash_type=SIGHASH_ALL):
+        """Computes the BIP143 (segwit v0) signature hash of one input.
+
+        Args:
+          index: Index of the input being signed.
+          script_code: scriptCode of the input, without its length prefix.
+          amount: Value in satoshis of the output being spent.
+          hash_type: Sighash type taken from the end of the signature.
+
+        Returns:
+          The 32 byte message the signature commits to.
+        """
+        tx = self.tx
+        vin = tx.vin[index]
+        base_type = hash_type & 0x1F
+
+        if base_type not in (SIGHASH_SINGLE, SIGHASH_NONE):
+            hash_outputs = self.hash_outputs()
+        elif base_type == SIGHASH_SINGLE and index < len(tx.vout):
+            hash_outputs = hash256(tx.vout[index].serialize())
+        else:
+            hash_outputs = ZERO_HASH
+
+        h = self._bip143_prefix(hash_type).copy()
+        h.update(vin.outpoint)
+        h.update(compact_size(len(script_code)))
+        h.update(script_code)
+        h.update(struct.pack("<qI", amount, vin.sequence))
+        h.update(hash_outputs)
+        h.update(struct.pack("<II", tx.locktime, hash_type))
+        return hashlib.sha256(h.digest()).digest()
+
+    def _legacy_all_parts(self):
+        if self._legacy_inputs is None:
+            tx = self.tx
+            buf = bytearray(struct.pack("<I", tx.version))
+            buf += compact_size(len(tx.vin))
+            offsets = []
+            for vin in tx.vin:
+                offsets.append(len(buf))
+                buf += vin.outpoint
+                buf += b"\x00"
+                buf += struct.pack("<I", vin.sequence)
+            offsets.append(len(buf))
+            self._legacy_inputs = memoryview(bytes(buf))
+            self._legacy_offsets = offsets
+            self._legacy_outputs = (
+                compact_size(len(tx.vout))
+                + b"".join(vout.serialize() for vout in tx.vout)
+                + struct.pack("<I", tx.locktime)
+            )
+        return self._legacy_inputs, self._legacy_offsets, self._legacy_outputs
+
+    def _legacy_generic(self, index, script_code, hash_type):
+        # Slow path for SIGHASH_NONE, SIGHASH_SINGLE and ANYONECANPAY
+        tx = self.tx
+        base_type = hash_type & 0x1F
+        anyone_can_pay = hash_type & SIGHASH_ANYONECANPAY
+        if base_type == SIGHASH_SINGLE and index >= len(tx.vout):
+            return SINGLE_BUG_HASH
+
+        buf = bytearray(struct.pack("<I", tx.version))
+        inputs = [index] if anyone_can_pay else range(len(tx.vin))
+        buf += compact_size(len(inputs))
+        for i in inputs:
+            vin = tx.vin[i]
+            buf += vin.outpoint
+            if i == index:
+                buf += compact_size(len(script_code))
+                buf += script_code
+                buf += struct.pack("<I", vin.sequence)
+            else:
+                buf += b"\x00"
+                if base_type in (SIGHASH_NONE, SIGHASH_SINGLE):
+                    buf += b"\x00\x00\x00\x00"
+                else:
+                    buf += struct.pack("<I", vin.sequence)
+
+        if base_type == SIGHASH_NONE:
+            buf += b"\x00"
+        elif base_type == SIGHASH_SINGLE:
+            buf += compact_size(index + 1)
+            # Outputs before the signed one are blanked to value -1, no script
+            buf += b"\xff\xff\xff\xff\xff\xff\xff\xff\x00" * index
+            buf += tx.vout[index].serialize()
+        else:
+            buf += compact_size(len(tx.vout))
+            for vout in tx.vout:
+                buf += vout.serialize()
+
+        buf += struct.pack("<II", tx.locktime, hash_type)
+        return hash256(buf)
+
+    def legacy_digest(self, index, script_code, hash_type=SIGHASH_ALL):
+        """Computes the pre-segwit signature hash of one input.
+
+        Args:
+          index: Index of the input being signed.
+          script_code: Script executed for the input (the P2PKH scriptPubKey
+            or the P2SH redeem script).
+          hash_type: Sighash type taken from the end of the signature.
+
+        Returns:
+          The 32 byte message the signature commits to.
+        """
+        if hash_type & (0x1F | SIGHASH_ANYONECANPAY) != SIGHASH_ALL:
+            return self._legacy_generic(index, script_code, hash_type)
+
+        # SIGHASH_ALL: hash the shared stripped serialization around the
+        # scriptCode of this input, without building a new transaction copy
+        inputs, offsets, outputs = self._legacy_all_parts()
+        start = offsets[index] + 36
+        end = offsets[index + 1] - 4
+        h = hashlib.sha256(inputs[:start])
+        h.update(compact_size(len(script_code)))
+        h.update(script_code)
+        h.update(inputs[end:])
+        h.update(outputs)
+        h.update(struct.pack("<I", hash_type))
+        return hashlib.sha256(h.digest()).digest()
+
+    def _bip341_prefix(self, hash_type):
+        prefix = self._taproot_prefix.get(hash_type)
+        if prefix is None:
+            tx = self.tx
+            base_type = hash_type & 0x03
+            data = bytearray(b"\x00")  # epoch
+            data += struct.pack("<BII", hash_type, tx.version, tx.locktime)
+            if not hash_type & SIGHASH_ANYONECANPAY:
+                data += self.sha_prevouts()
+                data += self.sha_amounts()
+                data += self.sha_scriptpubkeys()
+                data += self.sha_sequences()
+            if base_type not in (SIGHASH_NONE, SIGHASH_SINGLE):
+                data += self.sha_outputs()
+            prefix = tagged_hash_state("TapSighash")
+            prefix.update(data)
+            self._taproot_prefix[hash_type] = prefix
+        return prefix
+
+    def taproot_digest(
+        self, index, hash_type=SIGHASH_DEFAULT, annex=None, leaf_hash=None, codesep_pos=0xFFFFFFFF
+    ):
+        """Computes the BIP341 (segwit v1) signature hash of one input.
+
+        Args:
+          index: Index of the input being signed.
+          hash_type: Sighash byte of the signature, SIGHASH_DEFAULT for a 64
+            byte signature.
+          annex: The annex of the witness (starting with 0x50), if any.
+          leaf_hash: Tapleaf hash of the executed script for a script path
+            spend, None for a key path spend.
+          codesep_pos: Opcode position of the last executed
+            OP_CODESEPARATOR of the script, 0xFFFFFFFF when there is none.
+
+        Returns:
+          The 32 byte message the signature commits to, None when hash_type
+          is not a valid taproot sighash type or SIGHASH_SINGLE has no
+          matching output.
+        """
+        if hash_type not in TAPROOT_HASH_TYPES:
+            return None
+        tx = self.tx
+        vin = tx.vin[index]
+        base_type = hash_type & 0x03
+        if base_type == SIGHASH_SINGLE and index >= len(tx.vout):
+            return None
+
+        h = self._bip341_prefix(hash_type).copy()
+        spend_type = (2 if leaf_hash is not None else 0) + (1 if annex is not None else 0)
+        h.update(bytes([spend_type]))
+        if hash_type & SIGHASH_ANYONECANPAY:
+            script_pubkey = vin.prevout.script_pubkey
+            h.update(vin.outpoint)
+            h.update(struct.pack("<q", vin.prevout.value))
+            h.update(compact_size(len(script_pubkey)))
+            h.update(script_pubkey)
+            h.update(struct.pack("<I", vin.sequence))
+        else:
+            h.update(struct.pack("<I", index))
+        if annex is not None:
+            h.update(_sha256(compact_size(len(annex)) + annex))
+        if base_type == SIGHASH_SINGLE:
+            h.update(_sha256(tx.vout[index].serialize()))
+        if leaf_hash is not None:
+            # key_version 0
+            h.update(leaf_hash + b"\x00" + struct.pack("<I", codesep_pos))
+        return h.digest()
+
+
+def _sha256(data):
+    return hashlib.sha256(data).digest()
+
+
+def get_sighash_cache(tx):
+    if tx._sighash is None:
+        tx._sighash = SighashCache(tx)
+    return tx._sighash
@@ -0,0 +1,164 @@
+import hashlib
+import mmap
+import os
+import struct
+
+from classifier import type_mask
+from create_txid import compact_size
+from transaction import Transaction, TxOut, read_bytes
+
+MAGIC = b"MEMPSNAP"
+FORMAT_VERSION = 2
+# magic, format version, number of transactions, number of rejected txids
+HEADER = struct.Struct("<8sIII")
+# Offset of the record, size of the serialized transaction, size of the
+# prevout section that follows it, flags
+INDEX_ENTRY = struct.Struct("<QIII")
+
+FLAG_VALID = 1
+
+
+def _prevout_section(tx):
+    # value, script and type of every prevout, then the type of every output
+    buf = bytearray()
+    for vin in tx.vin:
+        prevout = vin.prevout or TxOut(0, b"")
+        buf += struct.pack("<q", prevout.value)
+        buf += compact_size(len(prevout.script_pubkey)) + prevout.script_pubkey
+        buf += _type_bytes(prevout.script_type)
+    for vout in tx.vout:
+        buf += _type_bytes(vout.script_type)
+    return bytes(buf)
+
+
+def _type_bytes(script_type):
+    data = (script_type or "").encode()
+    return compact_size(len(data)) + data
+
+
+def write_snapshot(path, records, rejected=()):
+    """Packs the records of ingest into one snapshot file.
+
+    Layout: header, one fixed width index entry per transaction, the txids
+    of the files that failed the structural check (32 bytes, internal
+    order), then for every transaction its consensus serialization (witness
+    included) followed by its prevout section.
+
+    Args:
+      path: File to write.
+      records: Record dicts holding full Transaction objects, with "valid"
+        set by validate_records.
+      rejected: txids (hex) of the files failing the structural check.
+    """
+    blobs = []
+    for record in records:
+        tx = record["tx"]
+        blobs.append((tx.serialize(), _prevout_section(tx), FLAG_VALID if record["valid"] else 0))
+
+    rejected = sorted(bytes.fromhex(txid)[::-1] for txid in rejected)
+    offset = HEADER.size + INDEX_ENTRY.size * len(blobs) + 32 * len(rejected)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(blobs), len(rejected)))
+        for raw, prevouts, flags in blobs:
+            f.write(INDEX_ENTRY.pack(offset, len(raw), len(prevouts), flags))
+            offset += len(raw) + len(prevouts)
+        f.write(b"".join(rejected))
+        for raw, prevouts, _ in blobs:
+            f.write(raw)
+            f.write(prevouts)
+    os.replace(temporary, path)
+
+
+class Snapshot:
+    """Read only view of a snapshot file through mmap.
+
+    raw() slices a transaction out of the mapping without copying it, and
+    transaction() decodes one on demand, so loading the mempool costs one
+    open and no per file syscalls.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, version, self.count, self.rejected_count = HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} snapshot")
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return INDEX_ENTRY.unpack_from(self._view, HEADER.size + INDEX_ENTRY.size * index)
+
+    def raw(self, index):
+        # memoryview of the consensus serialization, valid until close()
+        offset, size, _, _ = self._entry(index)
+        return self._view[offset : offset + size]
+
+    def is_valid(self, index):
+        return bool(self._entry(index)[3] & FLAG_VALID)
+
+    def transaction(self, index):
+        offset, size, prevout_size, _ = self._entry(index)
+        raw = self._view[offset : offset + size]
+        tx, _ = Transaction.parse(raw)
+
+        # The serialization is already there: no need to rebuild it for the
+        # txid, wtxid and weight
+        serialized = bytes(raw)
+        tx._witness = serialized
+        if not tx.has_witness:
+            tx._legacy = serialized
+
+        section = self._view[offset + size : offset + size + prevout_size]
+        position = 0
+        for vin in tx.vin:
+            value = struct.unpack_from("<q", section, position)[0]
+            script_pubkey, position = read_bytes(section, position + 8)
+            script_type, position = read_bytes(section, position)
+            vin.prevout = TxOut(value, script_pubkey, script_type.decode() or None)
+        for vout in tx.vout:
+            script_type, position = read_bytes(section, position)
+            vout.script_type = script_type.decode() or None
+        return tx
+
+    def rejected_txids(self):
+        # txids of the files that failed the structural check
+        start = HEADER.size + INDEX_ENTRY.size * self.count
+        return {
+            bytes(self._view[offset : offset + 32])[::-1].hex()
+            for offset in range(start, start + 32 * self.rejected_count, 32)
+        }
+
+    def records(self):
+        # Same record dicts as ingest, with the stored verdict in "valid"
+        records = []
+        for index in range(self.count):
+            tx = self.transaction(index)
+            txid = tx.txid
+            records.append(
+                {
+                    # Mempool files are named after the SHA-256 of the txid
+                    "filename": hashlib.sha256(bytes.fromhex(txid)).hexdigest() + ".json",
+                    "txid": txid,
+                    "mask": type_mask(tx),
+                    "tx": tx,
+                    "valid": self.is_valid(index),
+                }
+            )
+        return records
+
+    def close(self):
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
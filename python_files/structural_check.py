@@ -1,42 +1,64 @@
 import json
 import os
-import shutil
 
+from metrics import METRICS
+from reader import list_json_files, prefetch_files
 
-def check_transaction(tx_data):
+
+class _Missing:
+    # Value of an absent field: falsy, like the None of dict.get()
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+
+MISSING = _Missing()
+
+
+def dict_field(data, name):
+    return data.get(name, MISSING)
+
+
+def check_transaction(tx_data, get=dict_field, missing=MISSING):
+    # get(data, name) reads a field of the decoded JSON, missing when it is
+    # absent (a falsy value); the msgspec decoder passes getattr() and
+    # msgspec.UNSET for its structs
 
     required_fields = ["version", "locktime", "vin", "vout"]
-    if not all(field in tx_data for field in required_fields):
+    if not all(get(tx_data, field) is not missing for field in required_fields):
         return False  # Missing fields
 
     # Basic checks for specific field types
-    if not isinstance(tx_data["version"], int):
+    if not isinstance(get(tx_data, "version"), int):
         return False
-    if not isinstance(tx_data["locktime"], int):
+    if not isinstance(get(tx_data, "locktime"), int):
         return False
 
     # Call the vin and vout checker functions
-    if not validate_vin(tx_data["vin"]):
+    if not validate_vin(get(tx_data, "vin"), get, missing):
         return False
-    if not validate_vout(tx_data["vout"]):
+    if not validate_vout(get(tx_data, "vout"), get):
         return False
 
     return True  # Passes basic checks
 
 
-def validate_vin(vin_list):
+def validate_vin(vin_list, get=dict_field, missing=MISSING):
     # Validates a list of vin elements with specific checks
     for vin in vin_list:
         # Check txid
-        if not vin.get("txid") or not isinstance(vin["txid"], str):
+        txid = get(vin, "txid")
+        if not txid or not isinstance(txid, str):
             return False, "txid is empty or invalid type"
 
         # Check vout
-        if not vin.get("vout") or not isinstance(vin["vout"], int):
+        vout = get(vin, "vout")
+        if not vout or not isinstance(vout, int):
             return False, "vout is empty or invalid type"
 
         # Check prevout
-        prevout = vin.get("prevout")
+        prevout = get(vin, "prevout")
         if not prevout:
             return False, "prevout is missing"
         required_prevout_fields = [
@@ -47,34 +69,35 @@ def validate_vin(vin_list):
             "value",
         ]
         for field in required_prevout_fields:
-            if field not in prevout:
+            if get(prevout, field) is missing:
                 return False, f"prevout is missing '{field}'"
 
         # Check scriptsig/scriptsig_asm and witness if applicable
-        scriptsig = vin.get("scriptsig")
-        scriptsig_asm = vin.get("scriptsig_asm")
+        scriptsig = get(vin, "scriptsig")
+        scriptsig_asm = get(vin, "scriptsig_asm")
 
         if not scriptsig and not scriptsig_asm:
             # Both empty, check for witness
-            if not vin.get("witness"):
+            if not get(vin, "witness"):
                 return (
                     False,
                     "Both scriptsig and scriptsig_asm are empty, and witness is missing",
                 )
 
         # Check is_coinbase
-        if not isinstance(vin.get("is_coinbase"), bool):
+        if not isinstance(get(vin, "is_coinbase"), bool):
             return False  # is_coinbase must be true or false
 
         # Check sequence
-        if not vin.get("sequence") or not isinstance(vin["sequence"], int):
+        sequence = get(vin, "sequence")
+        if not sequence or not isinstance(sequence, int):
             return False  # sequence is empty or invalid type
 
     # All checks passed
     return True
 
 
-def validate_vout(vout_list):
+def validate_vout(vout_list, get=dict_field):
     # Validates a list of vout elements with specific checks
     for vout in vout_list:
         # Check non-emptiness of fields
@@ -85,11 +108,13 @@ def validate_vout(vout_list):
             "scriptpubkey_address",
         ]
         for field in required_fields:
-            if not vout.get(field) or not isinstance(vout[field], str):
+            value = get(vout, field)
+            if not value or not isinstance(value, str):
                 return False, f"'{field}' is empty or invalid type"
 
         # Check value is non-empty integer
-        if not vout.get("value") or not isinstance(vout["value"], int):
+        value = get(vout, "value")
+        if not value or not isinstance(value, int):
             return False, "value is empty or invalid type"
 
     # All checks passed
@@ -97,60 +122,33 @@ def validate_vout(vout_list):
 
 
 def check_structure_transactions(mempool_folder, valid_folder):
-    for filename in os.listdir(mempool_folder):
-        if filename.endswith(".json"):
-            filepath = os.path.join(mempool_folder, filename)
-            try:
-                with open(filepath) as f:
-                    tx_data = json.load(f)
-                if check_transaction(tx_data):
-                    print(f"Transaction: {filename} - Valid Structure")
-                    # Move the valid transaction file to the mempool_valid folder
-                    shutil.copy(filepath, os.path.join(valid_folder, filename))
-                else:
-                    print(f"Transaction: {filename} - Missing or Invalid Fields")
-            except (FileNotFoundError, json.JSONDecodeError) as e:
-                print(f"Error processing {filename}: {e}")
-
-
-# validate the signature script
-def validate_signature_script(script):
-    """Validates a Bitcoin signature script.
-
-    Args:
-      script: The signature script to validate.
-
-    Returns:
-      True if the signature script is valid, False otherwise.
-    """
-
-    # Check if the script is empty.
-    if not script:
-        return False
-
-    # Check if the script is a valid push data script.
-    if script[0] >= 0x01 and script[0] <= 0x4B:
-        return True
-
-    # Check if the script is a valid opcode.
-    if script[0] in OP_CODES:
-        return True
-
-    # Check if the script is a valid combination of push data and opcodes.
-    for i in range(len(script)):
-        if script[i] >= 0x01 and script[i] <= 0x4B:
+    # Files are read ahead by a thread pool while this loop checks them
+    for filepath, data in prefetch_files(list_json_files(mempool_folder)):
+        filename = os.path.basename(filepath)
+        if data is None:
+            METRICS.inc("structure", verdict="error")
             continue
-
-        if script[i] not in OP_CODES:
-            return False
-
-    # The script is valid.
-    return True
-
-
-# Specify the input and output folders
-mempool_folder = "./mempool"
-valid_folder = "./mempool_valid"
-
-# Check the structure of transactions in the mempool folder
-check_structure_transactions(mempool_folder, valid_folder)
+        METRICS.inc("files_read")
+        METRICS.inc("bytes_read", len(data))
+        try:
+            tx_data = json.loads(data)
+        except json.JSONDecodeError:
+            METRICS.inc("structure", verdict="error")
+            continue
+        if check_transaction(tx_data):
+            METRICS.inc("structure", verdict="valid")
+            # Copy the valid transaction file to the mempool_valid folder
+            with open(os.path.join(valid_folder, filename), "wb") as f:
+                f.write(data)
+        else:
+            METRICS.inc("structure", verdict="invalid")
+
+
+if __name__ == "__main__":
+    # Specify the input and output folders
+    mempool_folder = "./mempool"
+    valid_folder = "./mempool_valid"
+
+    # Check the structure of transactions in the mempool folder
+    check_structure_transactions(mempool_folder, valid_folder)
+    print(METRICS.summary())
@@ -0,0 +1,380 @@
+import time
+
+from block_builder import MAX_TEMPLATE_WEIGHT, BlockTemplate
+from metrics import METRICS
+
+# Weight at the end of the greedy template that is given back to the
+# search: the first window, doubled up to the last one
+MIN_TAIL_WEIGHT = 10000
+TAIL_WEIGHT = 200000
+# Wall clock seconds the search may run for
+TAIL_BUDGET = 1.0
+# Closed subsets enumerated per cluster; bigger clusters only offer the
+# ancestor packages of their transactions
+MAX_CLUSTER_OPTIONS = 256
+# Rounding margin of the fractional bound
+BOUND_EPSILON = 1e-6
+
+
+class TailReport:
+    """Outcome of optimize_tail() against the greedy template."""
+
+    __slots__ = (
+        "baseline_fees",
+        "baseline_weight",
+        "fees",
+        "weight",
+        "candidates",
+        "nodes",
+        "seconds",
+        "complete",
+    )
+
+    def __init__(self, template):
+        self.baseline_fees = template.fees
+        self.baseline_weight = template.weight
+        self.fees = template.fees
+        self.weight = template.weight
+        self.candidates = 0
+        self.nodes = 0
+        self.seconds = 0.0
+        # True when the last window was searched to the end within the
+        # budget, with every cluster fully enumerated
+        self.complete = False
+
+    @property
+    def fee_gain(self):
+        return self.fees - self.baseline_fees
+
+    @property
+    def weight_gain(self):
+        return self.weight - self.baseline_weight
+
+
+def split_tail(transactions, tail_weight):
+    """Splits a greedy template before its last tail_weight WU.
+
+    The template adds parents first, so dropping any suffix never leaves a
+    child in the block without its parent.
+
+    Returns:
+      (kept prefix, dropped tail) lists of transactions.
+    """
+    cut = len(transactions)
+    freed = 0
+    while cut and freed + transactions[cut - 1].weight <= tail_weight:
+        cut -= 1
+        freed += transactions[cut].weight
+    return transactions[:cut], transactions[cut:]
+
+
+def _clusters(entries, candidates):
+    # Connected groups of candidates linked by a parent/child edge
+    seen = set()
+    clusters = []
+    for txid in candidates:
+        if txid in seen:
+            continue
+        seen.add(txid)
+        cluster = []
+        stack = [txid]
+        while stack:
+            current = stack.pop()
+            cluster.append(current)
+            entry = entries[current]
+            for other in entry.parents | entry.children:
+                if other in candidates and other not in seen:
+                    seen.add(other)
+                    stack.append(other)
+        clusters.append(cluster)
+    return clusters
+
+
+def _closed_subsets(entries, cluster):
+    """Ancestor closed subsets of a cluster, the empty one left out.
+
+    Returns:
+      (list of frozensets, True when the list is exhaustive).
+    """
+    members = set(cluster)
+    # Parents first: an ancestor always has fewer ancestors
+    ordered = sorted(cluster, key=lambda txid: len(entries[txid].ancestors))
+    subsets = [frozenset()]
+    for txid in ordered:
+        parents = entries[txid].parents & members
+        subsets += [subset | {txid} for subset in subsets if parents <= subset]
+        if len(subsets) > MAX_CLUSTER_OPTIONS:
+            packages = {frozenset(entries[t].ancestors & members) for t in cluster}
+            return list(packages), False
+    return subsets[1:], True
+
+
+def _upper_hull(options):
+    # Segments (weight, fee) of the upper convex hull of the options from
+    # (0, 0), in decreasing fee rate; options are sorted by weight
+    points = [(0, 0)]
+    for weight, fee in options:
+        while len(points) >= 2:
+            (w1, f1), (w2, f2) = points[-2], points[-1]
+            # Drop the last point when it lies under the new chord
+            if (f2 - f1) * (weight - w1) <= (fee - f1) * (w2 - w1):
+                points.pop()
+            else:
+                break
+        points.append((weight, fee))
+    return [(w2 - w1, f2 - f1) for (w1, f1), (w2, f2) in zip(points, points[1:])]
+
+
+class TailSearch:
+    """Branch and bound over the packages that can refill the tail.
+
+    Candidates linked by a parent/child edge form a cluster, and each
+    cluster is one choice: one of its ancestor closed subsets, or nothing,
+    which makes the refill a multiple choice knapsack. Clusters are visited
+    by the best fee rate they offer, their options largest fee first. A
+    branch is cut when the fractional bound of the open clusters can not
+    beat the best set so far. The bound fills the room with the segments of
+    the upper convex hull of every cluster's options, so a child paying for
+    its parent (CPFP) is never counted without the parent.
+
+    Args:
+      graph: The MempoolGraph the template was selected from.
+      prefix: Transactions kept in the block.
+      capacity: Weight left for the tail.
+    """
+
+    def __init__(self, graph, prefix, capacity):
+        entries = graph.entries
+        self.entries = entries
+        self.capacity = capacity
+        kept = {tx.txid for tx in prefix}
+        self.spent = {vin.outpoint for tx in prefix for vin in tx.vin}
+
+        # Transactions whose package fits and does not spend an outpoint of
+        # the prefix; a conflict rules out all the descendants too
+        conflicting = {
+            txid
+            for txid, entry in entries.items()
+            if txid not in kept and any(vin.outpoint in self.spent for vin in entry.tx.vin)
+        }
+        candidates = set()
+        for txid, entry in entries.items():
+            if txid in kept or not entry.ancestors.isdisjoint(conflicting):
+                continue
+            if sum(entries[a].weight for a in entry.ancestors if a not in kept) <= capacity:
+                candidates.add(txid)
+        self.candidates = len(candidates)
+
+        # Per cluster: the options (fee, weight, txids) no lighter option
+        # beats on fees, and the segments of their hull
+        self.exhaustive = True
+        clusters = []
+        for cluster in _clusters(entries, candidates):
+            subsets, exhaustive = _closed_subsets(entries, cluster)
+            self.exhaustive &= exhaustive
+            options = []
+            for subset in subsets:
+                weight = sum(entries[t].weight for t in subset)
+                if weight <= capacity:
+                    options.append((sum(entries[t].fee for t in subset), weight, tuple(subset)))
+            options.sort(key=lambda option: (option[1], -option[0]))
+            pareto = []
+            for option in options:
+                if not pareto or option[0] > pareto[-1][0]:
+                    pareto.append(option)
+            if not pareto:
+                continue
+            segments = _upper_hull([(weight, fee) for fee, weight, _ in pareto])
+            clusters.append((segments[0][1] / segments[0][0], pareto[::-1], segments))
+        clusters.sort(key=lambda cluster: -cluster[0])
+        self.options = [options for _, options, _ in clusters]
+
+        # Every hull segment as (-fee rate, cluster position, weight, fee);
+        # the segments of one cluster keep their order
+        self.segments = sorted(
+            (-fee / weight, position, weight, fee)
+            for position, (_, _, segments) in enumerate(clusters)
+            for weight, fee in segments
+        )
+        # Segment index of each cluster's first segment: all the segments
+        # before it belong to earlier clusters
+        self.first_segment = [0] * (len(clusters) + 1)
+        self.first_segment[-1] = len(self.segments)
+        seen = set()
+        for index, (_, position, _, _) in enumerate(self.segments):
+            if position not in seen:
+                seen.add(position)
+                self.first_segment[position] = index
+        # Lightest option from each cluster on: once it does not fit, the
+        # remaining clusters can be skipped
+        self.lightest = [capacity + 1] * (len(clusters) + 1)
+        for position in range(len(clusters) - 1, -1, -1):
+            self.lightest[position] = min(self.options[position][-1][1], self.lightest[position + 1])
+
+        self.fees = 0
+        self.used = 0
+        self.best_fees = -1
+        self.best_used = 0
+        self.best_set = []
+        self.nodes = 0
+
+    def offer(self, txids):
+        # Starts the search from a known feasible set (the greedy tail)
+        fees = sum(self.entries[txid].fee for txid in txids)
+        used = sum(self.entries[txid].weight for txid in txids)
+        if (fees, used) > (self.best_fees, self.best_used):
+            self.best_fees, self.best_used = fees, used
+            self.best_set = list(txids)
+
+    def _bound(self, depth):
+        # Fees so far plus the fractional knapsack of the hull segments of
+        # the clusters from depth on
+        room = self.capacity - self.used
+        total = self.fees
+        segments = self.segments
+        for index in range(self.first_segment[depth], len(segments)):
+            _, position, weight, fee = segments[index]
+            if position < depth:
+                continue
+            if weight <= room:
+                total += fee
+                room -= weight
+            else:
+                return total + fee * room / weight
+        return total
+
+    def _outpoints(self, txids):
+        # Outpoints spent by txids, None when one is spent twice
+        outpoints = [vin.outpoint for txid in txids for vin in self.entries[txid].tx.vin]
+        if len(set(outpoints)) != len(outpoints) or not self.spent.isdisjoint(outpoints):
+            return None
+        return outpoints
+
+    def _record(self, trail):
+        if (self.fees, self.used) > (self.best_fees, self.best_used):
+            self.best_fees, self.best_used = self.fees, self.used
+            self.best_set = [
+                txid for depth, choice, _ in trail for txid in self.options[depth][choice][2]
+            ]
+
+    def run(self, deadline):
+        """Searches until every branch is closed or the deadline passes.
+
+        The best set is kept up to date all along, so stopping early still
+        leaves a usable (anytime) result.
+
+        Returns:
+          True when the search completed, False when it ran out of time.
+        """
+        options = self.options
+        count = len(options)
+        # (cluster position, option index, outpoints) of the options taken;
+        # the clusters in between are left out
+        trail = []
+        depth = 0
+        start = 0
+        while True:
+            # Clusters whose lightest option does not fit are left out
+            room = self.capacity - self.used
+            while depth < count and options[depth][-1][1] > room:
+                depth = depth + 1 if self.lightest[depth] <= room else count
+
+            # Fees are integers: a better set has at least one more satoshi
+            # (less a margin for the rounding of the bound)
+            if depth < count and self._bound(depth) > self.best_fees + 1 - BOUND_EPSILON:
+                choice = None
+                for index in range(start, len(options[depth])):
+                    if options[depth][index][1] <= room:
+                        outpoints = self._outpoints(options[depth][index][2])
+                        if outpoints is not None:
+                            choice = index
+                            break
+                start = 0
+                if choice is not None:
+                    self.nodes += 1
+                    if time.perf_counter() > deadline:
+                        return False
+                    fee, weight, _ = options[depth][choice]
+                    self.fees += fee
+                    self.used += weight
+                    self.spent.update(outpoints)
+                    trail.append((depth, choice, outpoints))
+                    self._record(trail)
+                depth += 1
+                continue
+
+            # Backtrack: the latest option taken is replaced by the next one
+            # of its cluster, or by nothing
+            if not trail:
+                return True
+            depth, choice, outpoints = trail.pop()
+            fee, weight, _ = options[depth][choice]
+            self.fees -= fee
+            self.used -= weight
+            self.spent.difference_update(outpoints)
+            start = choice + 1
+
+
+def _refill(graph, template, tail_weight, deadline, max_weight):
+    # One search over the last tail_weight WU of template
+    prefix, tail = split_tail(template.transactions, tail_weight)
+    prefix_weight = sum(tx.weight for tx in prefix)
+    search = TailSearch(graph, prefix, max_weight - prefix_weight)
+    search.offer([tx.txid for tx in tail])
+    baseline = (search.best_fees, search.best_used)
+    finished = search.run(deadline)
+
+    if (search.best_fees, search.best_used) > baseline:
+        # Parents first: an ancestor always has fewer ancestors
+        refill = sorted(
+            (graph.entries[txid] for txid in search.best_set),
+            key=lambda entry: len(entry.ancestors),
+        )
+        template = BlockTemplate(
+            prefix + [entry.tx for entry in refill],
+            template.fees - baseline[0] + search.best_fees,
+            prefix_weight + search.best_used,
+        )
+    return template, search, finished
+
+
+def optimize_tail(graph, template, budget=TAIL_BUDGET, tail_weight=TAIL_WEIGHT, max_weight=MAX_TEMPLATE_WEIGHT):
+    """Refills the end of a greedy template with a better fitting set.
+
+    The end of the template is given back and a branch and bound picks the
+    packages (the dropped ones included) that fill the freed space with the
+    most fees. The window starts at MIN_TAIL_WEIGHT and doubles up to
+    tail_weight after every search that finishes, each one starting from
+    the result of the previous, so the result improves as long as the
+    budget lasts and is never worse than the greedy template.
+
+    Args:
+      graph: The MempoolGraph template was selected from.
+      template: A BlockTemplate from select_transactions().
+      budget: Seconds the search may run for.
+      tail_weight: Largest weight at the end of the template that can be
+        replaced.
+      max_weight: Weight limit of the template.
+
+    Returns:
+      (BlockTemplate, TailReport).
+    """
+    start = time.perf_counter()
+    report = TailReport(template)
+    window = min(MIN_TAIL_WEIGHT, tail_weight)
+    while True:
+        template, search, finished = _refill(graph, template, window, start + budget, max_weight)
+        report.candidates = search.candidates
+        report.nodes += search.nodes
+        if not finished or window >= tail_weight:
+            break
+        window = min(2 * window, tail_weight)
+    report.complete = finished and window >= tail_weight and search.exhaustive
+    report.seconds = time.perf_counter() - start
+    report.fees = template.fees
+    report.weight = template.weight
+
+    METRICS.set("tail_fee_gain", report.fee_gain)
+    METRICS.set("tail_weight_gain", report.weight_gain)
+    METRICS.inc("tail_search_nodes", report.nodes)
+    return template, report
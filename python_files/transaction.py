@@ -0,0 +1,308 @@
+import hashlib
+import struct
+
+from create_txid import compact_size
+
+
+WITNESS_SCALE_FACTOR = 4
+
+
+def hash256(data):
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def hash160(data):
+    return hashlib.new("ripemd160", hashlib.sha256(data).digest()).digest()
+
+
+# sha256 midstates over sha256(tag) || sha256(tag), one per BIP340 tag
+_TAG_PREFIXES = {}
+
+
+def tagged_hash_state(tag):
+    # sha256 object already fed with the BIP340 prefix of tag
+    prefix = _TAG_PREFIXES.get(tag)
+    if prefix is None:
+        tag_hash = hashlib.sha256(tag.encode()).digest()
+        prefix = _TAG_PREFIXES[tag] = hashlib.sha256(tag_hash + tag_hash)
+    return prefix.copy()
+
+
+def tagged_hash(tag, data):
+    # BIP340 tagged hash: sha256(sha256(tag) || sha256(tag) || data)
+    h = tagged_hash_state(tag)
+    h.update(data)
+    return h.digest()
+
+
+def read_compact_size(data, offset):
+    # Returns (size, offset of the byte after it)
+    first = data[offset]
+    if first < 253:
+        return first, offset + 1
+    if first == 253:
+        return struct.unpack_from("<H", data, offset + 1)[0], offset + 3
+    if first == 254:
+        return struct.unpack_from("<I", data, offset + 1)[0], offset + 5
+    return struct.unpack_from("<Q", data, offset + 1)[0], offset + 9
+
+
+def read_bytes(data, offset):
+    # Compact size prefixed byte string
+    size, offset = read_compact_size(data, offset)
+    end = offset + size
+    if end > len(data):
+        raise ValueError("truncated data")
+    return bytes(data[offset:end]), end
+
+
+class TxOut:
+    __slots__ = ("value", "script_pubkey", "script_type")
+
+    def __init__(self, value, script_pubkey, script_type=None):
+        self.value = value
+        self.script_pubkey = script_pubkey
+        self.script_type = script_type
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["value"],
+            bytes.fromhex(data["scriptpubkey"]),
+            data.get("scriptpubkey_type"),
+        )
+
+    def serialize(self):
+        return (
+            struct.pack("<q", self.value)
+            + compact_size(len(self.script_pubkey))
+            + self.script_pubkey
+        )
+
+
+class TxIn:
+    __slots__ = (
+        "prev_hash",
+        "prev_index",
+        "script_sig",
+        "sequence",
+        "witness",
+        "prevout",
+        "is_coinbase",
+    )
+
+    def __init__(
+        self,
+        prev_hash,
+        prev_index,
+        script_sig,
+        sequence,
+        witness=(),
+        prevout=None,
+        is_coinbase=False,
+    ):
+        # prev_hash is kept in internal (little endian) byte order
+        self.prev_hash = prev_hash
+        self.prev_index = prev_index
+        self.script_sig = script_sig
+        self.sequence = sequence
+        self.witness = witness
+        self.prevout = prevout
+        self.is_coinbase = is_coinbase
+
+    @classmethod
+    def from_dict(cls, data):
+        prevout = data.get("prevout")
+        return cls(
+            bytes.fromhex(data["txid"])[::-1],
+            data["vout"],
+            bytes.fromhex(data["scriptsig"]),
+            data["sequence"],
+            tuple(bytes.fromhex(item) for item in data.get("witness", ())),
+            TxOut.from_dict(prevout) if prevout else None,
+            data.get("is_coinbase", False),
+        )
+
+    @property
+    def txid(self):
+        return self.prev_hash[::-1].hex()
+
+    @property
+    def outpoint(self):
+        return self.prev_hash + struct.pack("<I", self.prev_index)
+
+
+class Transaction:
+    """A transaction decoded once from its JSON form.
+
+    Every hex field is turned into bytes by from_dict(). Serializations and
+    the values derived from them are computed on first use and cached.
+    """
+
+    __slots__ = (
+        "version",
+        "locktime",
+        "vin",
+        "vout",
+        "_legacy",
+        "_witness",
+        "_txid",
+        "_wtxid",
+        "_weight",
+        "_sighash",
+    )
+
+    def __init__(self, version, locktime, vin, vout):
+        self.version = version
+        self.locktime = locktime
+        self.vin = vin
+        self.vout = vout
+        self._legacy = None
+        self._witness = None
+        self._txid = None
+        self._wtxid = None
+        self._weight = None
+        self._sighash = None
+
+    def __getstate__(self):
+        # The sighash cache holds hashlib midstates, which cannot be pickled
+        return {name: getattr(self, name) for name in self.__slots__ if name != "_sighash"}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._sighash = None
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["version"],
+            data["locktime"],
+            [TxIn.from_dict(vin) for vin in data["vin"]],
+            [TxOut.from_dict(vout) for vout in data["vout"]],
+        )
+
+    @classmethod
+    def parse(cls, data):
+        """Decodes a consensus serialized transaction.
+
+        Args:
+          data: bytes, or a memoryview (of an mmap for instance); the scripts
+            and witness items are copied out of it.
+
+        Returns:
+          (Transaction without prevouts, offset of the byte after it)
+        """
+        version = struct.unpack_from("<I", data, 0)[0]
+        offset = 4
+        segwit = data[4] == 0 and data[5] == 1
+        if segwit:
+            offset = 6
+
+        count, offset = read_compact_size(data, offset)
+        vin = []
+        for _ in range(count):
+            prev_hash = bytes(data[offset : offset + 32])
+            prev_index = struct.unpack_from("<I", data, offset + 32)[0]
+            script_sig, offset = read_bytes(data, offset + 36)
+            sequence = struct.unpack_from("<I", data, offset)[0]
+            offset += 4
+            is_coinbase = prev_hash == bytes(32) and prev_index == 0xFFFFFFFF
+            vin.append(TxIn(prev_hash, prev_index, script_sig, sequence, is_coinbase=is_coinbase))
+
+        count, offset = read_compact_size(data, offset)
+        vout = []
+        for _ in range(count):
+            value = struct.unpack_from("<q", data, offset)[0]
+            script_pubkey, offset = read_bytes(data, offset + 8)
+            vout.append(TxOut(value, script_pubkey))
+
+        if segwit:
+            for item in vin:
+                count, offset = read_compact_size(data, offset)
+                witness = []
+                for _ in range(count):
+                    element, offset = read_bytes(data, offset)
+                    witness.append(element)
+                item.witness = tuple(witness)
+
+        locktime = struct.unpack_from("<I", data, offset)[0]
+        return cls(version, locktime, vin, vout), offset + 4
+
+    @property
+    def has_witness(self):
+        return any(vin.witness for vin in self.vin)
+
+    def serialize_legacy(self):
+        if self._legacy is None:
+            buf = bytearray(struct.pack("<I", self.version))
+            buf += compact_size(len(self.vin))
+            for vin in self.vin:
+                buf += vin.prev_hash
+                buf += struct.pack("<I", vin.prev_index)
+                buf += compact_size(len(vin.script_sig))
+                buf += vin.script_sig
+                buf += struct.pack("<I", vin.sequence)
+            buf += compact_size(len(self.vout))
+            for vout in self.vout:
+                buf += vout.serialize()
+            buf += struct.pack("<I", self.locktime)
+            self._legacy = bytes(buf)
+        return self._legacy
+
+    def serialize(self):
+        # Full serialization, with marker, flag and witnesses for segwit
+        if self._witness is None:
+            legacy = self.serialize_legacy()
+            if not self.has_witness:
+                self._witness = legacy
+            else:
+                # Reuse the legacy body and only append the witness stacks
+                buf = bytearray(legacy[:4])
+                buf += b"\x00\x01"
+                buf += legacy[4:-4]
+                for vin in self.vin:
+                    buf += compact_size(len(vin.witness))
+                    for item in vin.witness:
+                        buf += compact_size(len(item))
+                        buf += item
+                buf += legacy[-4:]
+                self._witness = bytes(buf)
+        return self._witness
+
+    @property
+    def txid_bytes(self):
+        if self._txid is None:
+            self._txid = hash256(self.serialize_legacy())
+        return self._txid
+
+    @property
+    def wtxid_bytes(self):
+        if self._wtxid is None:
+            self._wtxid = hash256(self.serialize())
+        return self._wtxid
+
+    @property
+    def txid(self):
+        return self.txid_bytes[::-1].hex()
+
+    @property
+    def wtxid(self):
+        return self.wtxid_bytes[::-1].hex()
+
+    @property
+    def weight(self):
+        if self._weight is None:
+            base = len(self.serialize_legacy())
+            total = len(self.serialize())
+            self._weight = base * (WITNESS_SCALE_FACTOR - 1) + total
+        return self._weight
+
+    @property
+    def vsize(self):
+        return -(-self.weight // WITNESS_SCALE_FACTOR)
+
+    @property
+    def fee(self):
+        total_in = sum(vin.prevout.value for vin in self.vin if vin.prevout)
+        return total_in - sum(vout.value for vout in self.vout)
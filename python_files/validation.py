@@ -0,0 +1,193 @@
+import time
+
+from classifier import route_inputs
+from metrics import METRICS
+from p2pkh_validation import validate_p2pkh_batch, validate_p2pkh_input
+from p2sh_validation import validate_p2sh_input
+from p2tr_validation import verify_p2tr_batch, verify_p2tr_input
+from p2wpkh_validation import verify_p2wpkh_batch, verify_p2wpkh_input
+from p2wsh_validation import verify_p2wsh_input
+from policy import policy_reject
+from script_validation import (
+    TransactionChecker,
+    cached_multisig,
+    parse_pushes,
+    verify_script,
+    witness_program,
+)
+
+
+def validate_p2sh(tx, index):
+    # Multisig and wrapped segwit redeem scripts take the compiled routes,
+    # anything else legacy goes through the interpreter
+    try:
+        pushes = parse_pushes(tx.vin[index].script_sig)
+    except ValueError:
+        return False
+    if not pushes:
+        return False
+    redeem_script = pushes[-1]
+    if cached_multisig(redeem_script) is not None or witness_program(redeem_script) is not None:
+        return validate_p2sh_input(tx, index)
+    return validate_generic(tx, index)
+
+
+def validate_generic(tx, index):
+    vin = tx.vin[index]
+    if vin.witness:
+        return False
+    checker = TransactionChecker(tx, index)
+    return verify_script(vin.script_sig, vin.prevout.script_pubkey, checker)
+
+
+def reject(tx, index):
+    return False
+
+
+# Pre-compiled check routine of every standard template. Only inputs that
+# match none of them run through the generic interpreter loop.
+TEMPLATE_VALIDATORS = {
+    "p2pkh": validate_p2pkh_input,
+    "p2sh": validate_p2sh,
+    "p2wpkh": verify_p2wpkh_input,
+    "p2tr": verify_p2tr_input,
+    "p2wsh": verify_p2wsh_input,
+    "witness_unknown": reject,
+    None: validate_generic,
+}
+
+
+# Verdict of each input in batch_verdicts()
+INVALID = 0
+VALID = 1
+UNCHECKED = 2
+
+# Cheapest first, multisig heavy templates last: once an input of a
+# transaction fails, its inputs routed to the later validators are skipped
+VALIDATION_ORDER = ("witness_unknown", None, "p2tr", "p2pkh", "p2wpkh", "p2sh", "p2wsh")
+
+# template -> function checking a whole list of (tx, input index) at once
+# and returning one bool per item. Templates without one get a call of
+# their TEMPLATE_VALIDATORS routine per input.
+BATCH_VALIDATORS = {
+    "p2tr": verify_p2tr_batch,
+    "p2pkh": validate_p2pkh_batch,
+    "p2wpkh": verify_p2wpkh_batch,
+}
+
+
+def _check_input(template, tx, index, profiler=None):
+    validator = TEMPLATE_VALIDATORS[template]
+    started = time.perf_counter()
+    valid = profiler.run(validator, tx, index) if profiler else validator(tx, index)
+    name = template or "generic"
+    METRICS.observe("input_validation_seconds", time.perf_counter() - started, template=name)
+    METRICS.inc("inputs", template=name, verdict="valid" if valid else "invalid")
+    return valid
+
+
+def validate_batch(template, items, profiler=None):
+    """Runs the validator of one template on a batch of inputs.
+
+    Args:
+      template: Key of TEMPLATE_VALIDATORS.
+      items: List of (tx, input index), all spending that template.
+      profiler: Optional metrics.SamplingProfiler.
+
+    Returns:
+      One bool per item.
+    """
+    batch = BATCH_VALIDATORS.get(template)
+    if batch is None:
+        return [_check_input(template, tx, index, profiler) for tx, index in items]
+
+    name = template or "generic"
+    started = time.perf_counter()
+    verdicts = profiler.run(batch, items) if profiler else batch(items)
+    METRICS.observe("batch_validation_seconds", time.perf_counter() - started, template=name)
+    valid = sum(map(bool, verdicts))
+    if valid:
+        METRICS.inc("inputs", valid, template=name, verdict="valid")
+    if valid < len(verdicts):
+        METRICS.inc("inputs", len(verdicts) - valid, template=name, verdict="invalid")
+    return verdicts
+
+
+def batch_verdicts(transactions, profiler=None):
+    """Validates the inputs of transactions, grouped by template.
+
+    route_inputs() sorts every input into the batch of its template, and the
+    batches run in VALIDATION_ORDER.
+
+    Returns:
+      For every transaction, one verdict per input: VALID, INVALID or
+      UNCHECKED when another of its inputs failed first.
+    """
+    verdicts = [[UNCHECKED] * len(tx.vin) for tx in transactions]
+    failed = [False] * len(transactions)
+    routes = route_inputs(transactions)
+    for template in VALIDATION_ORDER:
+        route = routes.get(template, ())
+        if template not in BATCH_VALIDATORS:
+            # One input at a time, so a failure also skips the inputs of the
+            # same transaction later in this batch
+            for position, index in route:
+                if not failed[position]:
+                    valid = _check_input(template, transactions[position], index, profiler)
+                    verdicts[position][index] = VALID if valid else INVALID
+                    failed[position] = not valid
+            continue
+        items = [(position, index) for position, index in route if not failed[position]]
+        if not items:
+            continue
+        results = validate_batch(
+            template, [(transactions[position], index) for position, index in items], profiler
+        )
+        for (position, index), valid in zip(items, results):
+            verdicts[position][index] = VALID if valid else INVALID
+            if not valid:
+                failed[position] = True
+    return verdicts
+
+
+def validate_records(records, cache=None, profiler=None):
+    """Sets record["valid"] and record["rejected"] for the records of ingest.
+
+    The policy tiers run first and the signatures of the transactions
+    passing them all are checked in per template batches. record["rejected"]
+    names the tier that failed ("script" for the signature checks), None for
+    a valid transaction.
+
+    Records restored from the result cache already carry their verdict;
+    the others are verified and, when a cache is given, added to it. A
+    metrics.SamplingProfiler can be given to profile some of the checks.
+
+    Returns:
+      The transactions with valid inputs.
+    """
+    pending = []
+    for record in records:
+        if record.get("valid") is not None:
+            continue
+        record["rejected"] = policy_reject(record["tx"])
+        if record["rejected"] is None:
+            pending.append(record)
+        else:
+            _finish(record, [], cache)
+
+    # Only the transactions passing every tier reach the signature checks
+    verdicts = batch_verdicts([record["tx"] for record in pending], profiler)
+    for record, tx_verdicts in zip(pending, verdicts):
+        if any(verdict != VALID for verdict in tx_verdicts):
+            record["rejected"] = "script"
+        _finish(record, tx_verdicts, cache)
+    return [record["tx"] for record in records if record["valid"]]
+
+
+def _finish(record, verdicts, cache):
+    record["valid"] = record["rejected"] is None
+    METRICS.inc("transactions", verdict="valid" if record["valid"] else "invalid")
+    if not record["valid"]:
+        METRICS.inc("rejected", tier=record["rejected"])
+    if cache is not None and "key" in record:
+        cache.put(record, verdicts)
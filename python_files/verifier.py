@@ -0,0 +1,433 @@
+import ctypes
+import ctypes.util
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from metrics import METRICS
+from schnorr import (
+    CURVE_ORDER,
+    PUBKEY_CACHE_SIZE,
+    schnorr_verify,
+    schnorr_verify_batch,
+    tweak_xonly,
+)
+from sigcache import SignatureCache
+
+# Below this many signatures a process pool costs more than it saves
+MIN_PARALLEL_BATCH = 256
+# Prepended to the keys of BIP340 signatures in the signature cache, so an
+# entry can never be mistaken for an ECDSA one
+SCHNORR_CACHE_TAG = b"schnorr"
+
+
+def der_low_s(signature):
+    # libsecp256k1 only accepts low S signatures, consensus accepts both, so
+    # high S values are flipped to N - S before verification
+    try:
+        if signature[0] != 0x30 or signature[2] != 0x02:
+            return signature
+        r_len = signature[3]
+        r = signature[4 : 4 + r_len]
+        if signature[4 + r_len] != 0x02:
+            return signature
+        s_len = signature[5 + r_len]
+        s = int.from_bytes(signature[6 + r_len : 6 + r_len + s_len], "big")
+    except IndexError:
+        return signature
+    if s <= CURVE_ORDER // 2:
+        return signature
+    s_bytes = (CURVE_ORDER - s).to_bytes(32, "big").lstrip(b"\x00")
+    if s_bytes[0] & 0x80:
+        s_bytes = b"\x00" + s_bytes
+    body = b"\x02" + bytes([r_len]) + r + b"\x02" + bytes([len(s_bytes)]) + s_bytes
+    return b"\x30" + bytes([len(body)]) + body
+
+
+class EcdsaBackend:
+    # Pure Python fallback, always available
+    name = "ecdsa"
+
+    def __init__(self):
+        from ecdsa import VerifyingKey, SECP256k1
+        from ecdsa.util import sigdecode_der
+
+        self._from_string = VerifyingKey.from_string
+        self._curve = SECP256k1
+        self._sigdecode = sigdecode_der
+        self.parse_public_key = lru_cache(maxsize=PUBKEY_CACHE_SIZE)(self._parse)
+
+    def _parse(self, pubkey):
+        try:
+            return self._from_string(pubkey, curve=self._curve)
+        except Exception:
+            return None
+
+    def verify(self, pubkey, signature, message):
+        key = self.parse_public_key(pubkey)
+        if key is None:
+            return False
+        try:
+            return key.verify_digest(signature, message, sigdecode=self._sigdecode)
+        except Exception:
+            return False
+
+    def verify_schnorr(self, pubkey, signature, message):
+        return schnorr_verify(pubkey, signature, message)
+
+    def verify_schnorr_batch(self, items):
+        # One multi-scalar multiplication for the whole batch instead of a
+        # pure Python double multiplication per signature
+        return schnorr_verify_batch(items)
+
+    def tweak_xonly(self, pubkey, tweak):
+        return tweak_xonly(pubkey, tweak)
+
+
+class CoincurveBackend:
+    name = "coincurve"
+
+    def __init__(self):
+        from coincurve import PublicKey, PublicKeyXOnly
+
+        self._public_key = PublicKey
+        self._xonly_key = PublicKeyXOnly
+        self.parse_public_key = lru_cache(maxsize=PUBKEY_CACHE_SIZE)(self._parse)
+        self.parse_xonly_key = lru_cache(maxsize=PUBKEY_CACHE_SIZE)(self._parse_xonly)
+
+    def _parse(self, pubkey):
+        try:
+            return self._public_key(pubkey)
+        except Exception:
+            return None
+
+    def _parse_xonly(self, pubkey):
+        try:
+            return self._xonly_key(pubkey)
+        except Exception:
+            return None
+
+    def verify(self, pubkey, signature, message):
+        key = self.parse_public_key(pubkey)
+        if key is None:
+            return False
+        try:
+            return key.verify(der_low_s(signature), message, hasher=None)
+        except Exception:
+            return False
+
+    def verify_schnorr(self, pubkey, signature, message):
+        key = self.parse_xonly_key(pubkey)
+        if key is None or len(signature) != 64:
+            return False
+        return key.verify(signature, message)
+
+    def verify_schnorr_batch(self, items):
+        # libsecp256k1 has no batch verification; one compiled check per
+        # signature is still much faster than a Python batch
+        return [self.verify_schnorr(*item) for item in items]
+
+    def tweak_xonly(self, pubkey, tweak):
+        # tweak_add() modifies the key, so the cached parsed key is not used
+        try:
+            key = self._xonly_key(pubkey)
+            key.tweak_add(tweak)
+        except Exception:
+            return None
+        return key.format(), int(key.parity)
+
+
+class LibsecpBackend:
+    # libsecp256k1 loaded directly through ctypes
+    name = "libsecp256k1"
+
+    SECP256K1_CONTEXT_VERIFY = 0x101
+
+    def __init__(self, path=None):
+        path = path or os.environ.get("SECP256K1_LIB") or ctypes.util.find_library("secp256k1")
+        if not path:
+            raise ImportError("libsecp256k1 not found")
+        lib = ctypes.CDLL(path)
+        lib.secp256k1_context_create.restype = ctypes.c_void_p
+        lib.secp256k1_context_create.argtypes = [ctypes.c_uint]
+        for name in ("secp256k1_ec_pubkey_parse", "secp256k1_ecdsa_signature_parse_der"):
+            getattr(lib, name).argtypes = [
+                ctypes.c_void_p,
+                ctypes.c_char_p,
+                ctypes.c_char_p,
+                ctypes.c_size_t,
+            ]
+        lib.secp256k1_ecdsa_verify.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_char_p,
+            ctypes.c_char_p,
+            ctypes.c_char_p,
+        ]
+        lib.secp256k1_ecdsa_signature_normalize.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_char_p,
+            ctypes.c_char_p,
+        ]
+        # The schnorrsig module is optional in libsecp256k1 builds
+        self._schnorr = hasattr(lib, "secp256k1_schnorrsig_verify")
+        if self._schnorr:
+            lib.secp256k1_xonly_pubkey_parse.argtypes = [
+                ctypes.c_void_p,
+                ctypes.c_char_p,
+                ctypes.c_char_p,
+            ]
+            # Taproot output key tweaks, from the extrakeys module the
+            # schnorrsig module depends on
+            lib.secp256k1_xonly_pubkey_tweak_add.argtypes = [
+                ctypes.c_void_p,
+                ctypes.c_char_p,
+                ctypes.c_char_p,
+                ctypes.c_char_p,
+            ]
+            lib.secp256k1_xonly_pubkey_serialize.argtypes = [
+                ctypes.c_void_p,
+                ctypes.c_char_p,
+                ctypes.c_char_p,
+            ]
+            lib.secp256k1_xonly_pubkey_from_pubkey.argtypes = [
+                ctypes.c_void_p,
+                ctypes.c_char_p,
+                ctypes.c_void_p,
+                ctypes.c_char_p,
+            ]
+            lib.secp256k1_schnorrsig_verify.argtypes = [
+                ctypes.c_void_p,
+                ctypes.c_char_p,
+                ctypes.c_char_p,
+                ctypes.c_size_t,
+                ctypes.c_char_p,
+            ]
+        self._lib = lib
+        self._ctx = lib.secp256k1_context_create(self.SECP256K1_CONTEXT_VERIFY)
+        self.parse_public_key = lru_cache(maxsize=PUBKEY_CACHE_SIZE)(self._parse)
+        self.parse_xonly_key = lru_cache(maxsize=PUBKEY_CACHE_SIZE)(self._parse_xonly)
+
+    def _parse(self, pubkey):
+        # secp256k1_pubkey is an opaque 64 byte structure
+        parsed = ctypes.create_string_buffer(64)
+        if not self._lib.secp256k1_ec_pubkey_parse(self._ctx, parsed, pubkey, len(pubkey)):
+            return None
+        return parsed.raw
+
+    def _parse_xonly(self, pubkey):
+        # secp256k1_xonly_pubkey is an opaque 64 byte structure too
+        parsed = ctypes.create_string_buffer(64)
+        if len(pubkey) != 32 or not self._lib.secp256k1_xonly_pubkey_parse(self._ctx, parsed, pubkey):
+            return None
+        return parsed.raw
+
+    def verify(self, pubkey, signature, message):
+        key = self.parse_public_key(pubkey)
+        if key is None or len(message) != 32:
+            return False
+        sig = ctypes.create_string_buffer(64)
+        lib = self._lib
+        if not lib.secp256k1_ecdsa_signature_parse_der(self._ctx, sig, signature, len(signature)):
+            return False
+        lib.secp256k1_ecdsa_signature_normalize(self._ctx, sig, sig)
+        return bool(lib.secp256k1_ecdsa_verify(self._ctx, sig, message, key))
+
+    def verify_schnorr(self, pubkey, signature, message):
+        if not self._schnorr:
+            return schnorr_verify(pubkey, signature, message)
+        key = self.parse_xonly_key(pubkey)
+        if key is None or len(signature) != 64:
+            return False
+        return bool(self._lib.secp256k1_schnorrsig_verify(self._ctx, signature, message, len(message), key))
+
+    def verify_schnorr_batch(self, items):
+        if not self._schnorr:
+            return schnorr_verify_batch(items)
+        return [self.verify_schnorr(*item) for item in items]
+
+    def tweak_xonly(self, pubkey, tweak):
+        if not self._schnorr:
+            return tweak_xonly(pubkey, tweak)
+        key = self.parse_xonly_key(pubkey)
+        if key is None or len(tweak) != 32:
+            return None
+        lib = self._lib
+        tweaked = ctypes.create_string_buffer(64)
+        if not lib.secp256k1_xonly_pubkey_tweak_add(self._ctx, tweaked, key, tweak):
+            return None
+        xonly = ctypes.create_string_buffer(64)
+        parity = ctypes.c_int()
+        lib.secp256k1_xonly_pubkey_from_pubkey(self._ctx, xonly, ctypes.byref(parity), tweaked)
+        output = ctypes.create_string_buffer(32)
+        lib.secp256k1_xonly_pubkey_serialize(self._ctx, output, xonly)
+        return output.raw, parity.value
+
+
+BACKENDS = {
+    "coincurve": CoincurveBackend,
+    "libsecp256k1": LibsecpBackend,
+    "ecdsa": EcdsaBackend,
+}
+
+_backend = None
+_sigcache = SignatureCache()
+
+
+def select_backend(name=None):
+    """Picks the signature verification backend.
+
+    Args:
+      name: One of BACKENDS. When omitted the VERIFIER_BACKEND environment
+        variable is used, otherwise the first compiled backend that loads,
+        falling back to the pure Python ecdsa package.
+
+    Returns:
+      The selected backend.
+    """
+    global _backend
+    name = name or os.environ.get("VERIFIER_BACKEND")
+    if name:
+        _backend = BACKENDS[name]()
+        return _backend
+    for backend in BACKENDS.values():
+        try:
+            _backend = backend()
+            return _backend
+        except (ImportError, OSError, AttributeError):
+            continue
+    raise ImportError("no secp256k1 backend available")
+
+
+def get_backend():
+    if _backend is None:
+        select_backend()
+    return _backend
+
+
+def tweak_xonly_pubkey(pubkey, tweak):
+    # BIP341 output key of an internal key and its TapTweak: (x-only key,
+    # parity) or None
+    return get_backend().tweak_xonly(pubkey, tweak)
+
+
+def get_signature_cache():
+    return _sigcache
+
+
+def set_signature_cache(cache):
+    # cache can be None to disable caching
+    global _sigcache
+    _sigcache = cache
+
+
+def verify(pubkey, signature, message):
+    # ECDSA check of a DER signature (without sighash byte) on a 32 byte digest
+    if _sigcache is None:
+        METRICS.inc("ecdsa_verifications")
+        return get_backend().verify(pubkey, signature, message)
+    entry = _sigcache.entry(message, pubkey, signature)
+    if _sigcache.contains(entry):
+        METRICS.inc("signature_cache_hits")
+        return True
+    METRICS.inc("ecdsa_verifications")
+    if not get_backend().verify(pubkey, signature, message):
+        return False
+    _sigcache.add(entry)
+    return True
+
+
+def verify_schnorr(pubkey, signature, message):
+    # BIP340 check of a 64 byte signature by a 32 byte x-only key
+    if _sigcache is None:
+        METRICS.inc("schnorr_verifications")
+        return get_backend().verify_schnorr(pubkey, signature, message)
+    entry = _sigcache.entry(message, SCHNORR_CACHE_TAG + pubkey, signature)
+    if _sigcache.contains(entry):
+        METRICS.inc("signature_cache_hits")
+        return True
+    METRICS.inc("schnorr_verifications")
+    if not get_backend().verify_schnorr(pubkey, signature, message):
+        return False
+    _sigcache.add(entry)
+    return True
+
+
+def verify_schnorr_batch(items):
+    """Verifies many BIP340 (pubkey, signature, message) triples at once.
+
+    Signatures already in the signature cache are answered first; the
+    backend checks the rest as one batch.
+
+    Returns:
+      A list of booleans in the same order as items.
+    """
+    results = [False] * len(items)
+    todo = []
+    entries = []
+    for i, (pubkey, signature, message) in enumerate(items):
+        if _sigcache is not None:
+            entry = _sigcache.entry(message, SCHNORR_CACHE_TAG + pubkey, signature)
+            if _sigcache.contains(entry):
+                METRICS.inc("signature_cache_hits")
+                results[i] = True
+                continue
+            entries.append(entry)
+        todo.append(i)
+
+    METRICS.inc("schnorr_verifications", len(todo))
+    verdicts = get_backend().verify_schnorr_batch([items[i] for i in todo])
+    for position, (i, valid) in enumerate(zip(todo, verdicts)):
+        results[i] = valid
+        if valid and _sigcache is not None:
+            _sigcache.add(entries[position])
+    return results
+
+
+def _verify_chunk(items):
+    backend = get_backend()
+    return [backend.verify(pubkey, signature, message) for pubkey, signature, message in items]
+
+
+def verify_batch(items, workers=None, chunksize=128):
+    """Verifies many (pubkey, signature, message) triples.
+
+    Args:
+      items: List of (pubkey, DER signature, 32 byte message) tuples.
+      workers: Size of the process pool, defaults to the number of cores.
+      chunksize: Number of signatures sent to a worker at once.
+
+    Returns:
+      A list of booleans in the same order as items.
+    """
+    items = list(items)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(items) < MIN_PARALLEL_BATCH:
+        return [verify(*item) for item in items]
+
+    # Cached signatures are answered here, only the rest goes to the pool
+    results = [False] * len(items)
+    todo = []
+    entries = []
+    for i, (pubkey, signature, message) in enumerate(items):
+        if _sigcache is not None:
+            entry = _sigcache.entry(message, pubkey, signature)
+            if _sigcache.contains(entry):
+                METRICS.inc("signature_cache_hits")
+                results[i] = True
+                continue
+            entries.append(entry)
+        todo.append(i)
+
+    METRICS.inc("ecdsa_verifications", len(todo))
+    chunks = [todo[i : i + chunksize] for i in range(0, len(todo), chunksize)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunk_results = executor.map(_verify_chunk, ([items[i] for i in chunk] for chunk in chunks))
+        for chunk, valid in zip(chunks, chunk_results):
+            for i, ok in zip(chunk, valid):
+                results[i] = ok
+    if _sigcache is not None:
+        for i, entry in zip(todo, entries):
+            if results[i]:
+                _sigcache.add(entry)
+    return results
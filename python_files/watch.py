@@ -0,0 +1,324 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from block_builder import BlockSelector, MempoolGraph
+from ingest import content_key, ingest_bytes, is_structural
+from metrics import METRICS
+from merkle import BlockMerkleTrees
+from mining import mine_block, write_block
+from outpoint_index import OutpointIndex
+from reader import prefetch_files
+from result_cache import ResultCache
+from tail_optimizer import TAIL_WEIGHT, optimize_tail
+from validation import validate_records
+from verifier import get_signature_cache
+
+
+# inotify(7) flags and event masks
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+# struct inotify_event without its name: wd, mask, cookie, len
+EVENT_HEADER = struct.Struct("iIII")
+
+# Events arriving this soon after the first one are handled together
+DEBOUNCE_SECONDS = 0.2
+
+
+class InotifyWatcher:
+    """Reports the files of a folder that were written, moved or deleted."""
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed", folder)
+
+    def _read(self, names):
+        # Returns False when the kernel queue overflowed (events were lost)
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return True
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    return False
+                if name:
+                    names.add(os.fsdecode(name))
+
+    def wait(self, timeout=None):
+        """Blocks until files change.
+
+        Returns:
+          The changed filenames, or None when everything must be rescanned.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        names = set()
+        if not self._read(names):
+            return None
+        time.sleep(DEBOUNCE_SECONDS)
+        if not self._read(names):
+            return None
+        return {name for name in names if name.endswith(".json")}
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    # Fallback without inotify: the watcher rescans the mtimes every interval
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def wait(self, timeout=None):
+        time.sleep(self.interval)
+        return None
+
+    def close(self):
+        pass
+
+
+def open_watcher(folder, interval, use_inotify=True):
+    if use_inotify:
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError):
+            # Not Linux, or no inotify instance left
+            pass
+    return PollingWatcher(interval)
+
+
+class MempoolWatcher:
+    """Keeps the block of a mempool folder up to date.
+
+    Only added or changed files are parsed and validated, removed files are
+    evicted from the outpoint index and the mempool graph, and the block
+    template only re-selects the packages the changes affect.
+    """
+
+    def __init__(
+        self,
+        mempool_folder,
+        cache_dir,
+        output,
+        workers=None,
+        metrics_file=None,
+        profiler=None,
+        tail_budget=0.0,
+        tail_weight=TAIL_WEIGHT,
+    ):
+        self.folder = mempool_folder
+        self.output = output
+        self.workers = workers
+        # Prometheus text file rewritten after every update
+        self.metrics_file = metrics_file
+        self.profiler = profiler
+        # Seconds optimize_tail() may spend on every new template, 0 for the
+        # greedy selection only
+        self.tail_budget = tail_budget
+        self.tail_weight = tail_weight
+        # Content hash -> verdicts, shared with the batch mode of main.py, so
+        # a restarted watcher only validates the files that really changed
+        self.cache = ResultCache(os.path.join(cache_dir, "results.sqlite"))
+        # Outpoint index of the last run; the first update drops the
+        # transactions whose files are gone
+        self.index_path = os.path.join(cache_dir, "outpoints.sqlite")
+        self.index = OutpointIndex.load(self.index_path)
+        self.index_pruned = False
+        self.graph = MempoolGraph(index=self.index)
+        # Keeps the selected packages and their scores between updates
+        self.selector = BlockSelector(self.graph)
+        # Merkle trees of the last block, only rehashed past the kept prefix
+        self.trees = BlockMerkleTrees(())
+        # filename -> (mtime_ns, size, content hash, txid or None) of the
+        # loaded files
+        self.files = {}
+        # txid -> Transaction for the transactions with valid inputs
+        self.valid = {}
+        self.invalid = set()
+
+    def scan(self):
+        # Files whose mtime or size differ from the loaded ones, or are gone
+        current = {}
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                current[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        changed = {
+            name
+            for name, stat in current.items()
+            if self.files.get(name, (None, None))[:2] != stat
+        }
+        changed.update(self.files.keys() - current.keys())
+        return changed
+
+    def _evict(self, txid):
+        # Returns True when transactions refused because of txid may now fit
+        self.index.remove(txid)
+        self.valid.pop(txid, None)
+        self.invalid.discard(txid)
+        if txid in self.graph:
+            self.graph.remove(txid)
+            return False
+        # Invalid or refused
+        return txid in self.graph.excluded
+
+    def update(self, filenames):
+        """Reprocesses the given files of the mempool folder.
+
+        Returns:
+          (files reprocessed, files validated)
+        """
+        added = []
+        validated = 0
+        readd = False
+
+        # Stat everything before the reads start, so a write racing with the
+        # read shows up as a newer mtime on the next scan
+        paths = sorted(os.path.join(self.folder, filename) for filename in filenames)
+        stats = {}
+        for path in paths:
+            try:
+                stats[path] = os.stat(path)
+            except OSError:
+                pass
+
+        for path, data in prefetch_files(paths):
+            filename = os.path.basename(path)
+            stat = stats.get(path)
+            if stat is None:
+                data = None
+            if data is not None:
+                METRICS.inc("files_read")
+                METRICS.inc("bytes_read", len(data))
+
+            old = self.files.pop(filename, None)
+            old_txid = old[3] if old is not None else None
+            if data is None:
+                # Removed
+                if old_txid is not None:
+                    readd |= self._evict(old_txid)
+                continue
+
+            key = content_key(data)
+            if old is not None and old[2] == key:
+                # Touched but not modified
+                self.files[filename] = (stat.st_mtime_ns, stat.st_size, key, old_txid)
+                continue
+            if old_txid is not None:
+                readd |= self._evict(old_txid)
+
+            record = self.cache.get(key, filename)
+            if record is None:
+                record = ingest_bytes(filename, data)
+                METRICS.inc("structure", verdict="valid" if is_structural(record) else "invalid")
+                if is_structural(record):
+                    record["key"] = key
+                    validate_records([record], self.cache, self.profiler)
+                    validated += 1
+                else:
+                    self.cache.put_malformed(key, record["txid"] if record is not None else None)
+            txid = record["txid"] if record is not None else None
+            self.files[filename] = (stat.st_mtime_ns, stat.st_size, key, txid)
+            if txid is None:
+                continue
+            if record["tx"] is None:
+                # Failed the structural check: its descendants are refused
+                self.invalid.add(txid)
+                self.graph.exclude(txid)
+                continue
+            self.index.add(record)
+            if record["valid"]:
+                self.valid[txid] = record["tx"]
+                added.append(record["tx"])
+            else:
+                self.invalid.add(txid)
+                self.graph.exclude(txid)
+
+        if not self.index_pruned:
+            self.index.retain({entry[3] for entry in self.files.values()})
+            self.index_pruned = True
+        if readd:
+            # An invalid transaction left: its refused descendants get
+            # another chance
+            self.graph.excluded = set(self.invalid)
+            self.graph.add_all(
+                tx for txid, tx in self.valid.items() if txid not in self.graph
+            )
+        else:
+            self.graph.add_all(added)
+        return len(filenames), validated
+
+    def refresh(self):
+        # Selects, mines and writes the block of the current graph
+        with METRICS.timer("stage_seconds", stage="select"):
+            template = self.selector.select()
+        if self.tail_budget > 0:
+            with METRICS.timer("stage_seconds", stage="tail"):
+                template, _ = optimize_tail(self.graph, template, self.tail_budget, self.tail_weight)
+        with METRICS.timer("stage_seconds", stage="mine"):
+            block = mine_block(template, workers=self.workers, trees=self.trees)
+        write_block(block, self.output)
+        self.cache.commit()
+        if self.index.dirty:
+            self.index.save(self.index_path)
+        sigcache = get_signature_cache()
+        if sigcache is not None:
+            sigcache.flush()
+        return template
+
+    def sync(self, filenames):
+        started = time.perf_counter()
+        with METRICS.timer("stage_seconds", stage="update"):
+            changed, validated = self.update(filenames)
+        template = self.refresh()
+
+        METRICS.inc("watch_updates")
+        METRICS.inc("watch_files_changed", changed)
+        METRICS.set("indexed_transactions", len(self.index))
+        METRICS.set("graph_transactions", len(self.graph))
+        METRICS.set("block_transactions", len(template.transactions))
+        METRICS.set("block_fees", template.fees)
+        if self.metrics_file:
+            METRICS.write_prometheus(self.metrics_file)
+        print(
+            f"{changed} files changed, {validated} validated: "
+            f"{len(template.transactions)} transactions, {template.fees} sats "
+            f"({time.perf_counter() - started:.2f}s)"
+        )
+
+    def run(self, interval=2.0, use_inotify=True):
+        """Loads the mempool folder, then follows its changes forever."""
+        watcher = open_watcher(self.folder, interval, use_inotify)
+        try:
+            self.sync(self.scan())
+            while True:
+                changed = watcher.wait()
+                if changed is None:
+                    changed = self.scan()
+                if changed:
+                    self.sync(changed)
+        finally:
+            watcher.close()
@@ -0,0 +1,25 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEMPOOL = os.path.join(ROOT, "mempool")
+
+# The modules import each other by their bare names, like main.py runs them
+sys.path.insert(0, os.path.join(ROOT, "python_files"))
+
+from transaction import Transaction  # noqa: E402
+
+
+def load_transaction(name):
+    # A transaction of the mempool folder (file name without .json),
+    # prevouts included
+    with open(os.path.join(MEMPOOL, f"{name}.json")) as f:
+        return Transaction.from_dict(json.load(f))
+
+
+@pytest.fixture
+def mempool_tx():
+    return load_transaction
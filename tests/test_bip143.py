@@ -0,0 +1,67 @@
+from p2wpkh_validation import p2wpkh_signature
+from sighash import SIGHASH_ALL, get_sighash_cache
+from transaction import Transaction
+from verifier import verify
+
+# BIP143 native P2WPKH example: unsigned transaction, input 1 spends 6 BTC
+BIP143_P2WPKH_TX = (
+    "0100000002fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f"
+    "0000000000eeffffffef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57"
+    "b90ec68a0100000000ffffffff02202cb206000000001976a9148280b37df378db99f66f85"
+    "c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2"
+    "f0167faa815988ac11000000"
+)
+BIP143_P2WPKH_SCRIPT_CODE = "76a9141d0f172a0ecb48aee1be1f2687d2963ae33f71a188ac"
+BIP143_P2WPKH_SIGHASH = "c37af31116d1b27caf68aae9e3ac82f1477929014d5b917657d0eb49478cb670"
+BIP143_P2WPKH_PUBKEY = "025476c2e83188368da1ff3e292e7acafcdb3566bb0ad253f62fc70f07aeee6357"
+BIP143_P2WPKH_SIGNATURE = (
+    "304402203609e17b84f6a7d30c80bfa610b5b4542f32a8a0d5447a12fb1366d7f01cc44a"
+    "0220573a954c4518331561406f90300e8f3358f51928d43c212a8caed02de67eebee"
+)
+
+# BIP143 P2SH-P2WPKH example: input 0 spends 10 BTC
+BIP143_P2SH_P2WPKH_TX = (
+    "0100000001db6b1b20aa0fd7b23880be2ecbd4a98130974cf4748fb66092ac4d3ceb1a5477"
+    "0100000000feffffff02b8b4eb0b000000001976a914a457b684d7f0d539a46a45bbc043f3"
+    "5b59d0d96388ac0008af2f000000001976a914fd270b1ee6abcaea97fea7ad0402e8bd8ad6"
+    "d77c88ac92040000"
+)
+BIP143_P2SH_P2WPKH_SCRIPT_CODE = "76a91479091972186c449eb1ded22b78e40d009bdf008988ac"
+BIP143_P2SH_P2WPKH_SIGHASH = "64f3b0f4dd2bb3aa1ce8566d220cc74dda9df97d8490cc81d89d735c92e59fb6"
+
+# Mempool inputs signed by real wallets: (file name, input index); the
+# digests are right when the signatures verify
+P2WPKH_INPUTS = [
+    # SIGHASH_ALL
+    ("000cb561188c762c81f76976f816829424e2af9e0e491c617b7bf41038df3d35", 0),
+    # SIGHASH_ALL | ANYONECANPAY
+    ("0bfa0482c989e84f5d83e338cff2adaa9bd0bb99e4e276ed7dc913be76f8c543", 0),
+    # SIGHASH_SINGLE | ANYONECANPAY
+    ("004c2dec582638c26fed3d55b2fee8bbf1c2d4b70449b0a3f03faa105ad03f15", 1),
+]
+
+
+def test_bip143_native_p2wpkh():
+    tx, _ = Transaction.parse(bytes.fromhex(BIP143_P2WPKH_TX))
+    digest = get_sighash_cache(tx).bip143_digest(
+        1, bytes.fromhex(BIP143_P2WPKH_SCRIPT_CODE), 600000000, SIGHASH_ALL
+    )
+    assert digest.hex() == BIP143_P2WPKH_SIGHASH
+    assert verify(
+        bytes.fromhex(BIP143_P2WPKH_PUBKEY), bytes.fromhex(BIP143_P2WPKH_SIGNATURE), digest
+    )
+
+
+def test_bip143_p2sh_p2wpkh():
+    tx, _ = Transaction.parse(bytes.fromhex(BIP143_P2SH_P2WPKH_TX))
+    digest = get_sighash_cache(tx).bip143_digest(
+        0, bytes.fromhex(BIP143_P2SH_P2WPKH_SCRIPT_CODE), 1000000000, SIGHASH_ALL
+    )
+    assert digest.hex() == BIP143_P2SH_P2WPKH_SIGHASH
+
+
+def test_bip143_mempool_signatures(mempool_tx):
+    for name, index in P2WPKH_INPUTS:
+        tx = mempool_tx(name)
+        check = p2wpkh_signature(tx, index, tx.vin[index].prevout.script_pubkey[2:])
+        assert verify(*check), name
@@ -0,0 +1,139 @@
+import random
+import struct
+
+from block_builder import (
+    MAX_BLOCK_WEIGHT,
+    MAX_TEMPLATE_WEIGHT,
+    MempoolGraph,
+    build_graph,
+    select_transactions,
+)
+
+
+class FakeInput:
+    def __init__(self, txid, vout, sequence=0xFFFFFFFF):
+        self.txid = txid
+        self.outpoint = bytes.fromhex(txid)[::-1] + struct.pack("<I", vout)
+        self.sequence = sequence
+
+
+class FakeTransaction:
+    # What the graph and the selection read of a Transaction
+
+    def __init__(self, txid, fee, weight, spends=()):
+        self.txid = txid
+        self.fee = fee
+        self.weight = weight
+        self.vin = [FakeInput(parent, vout) for parent, vout in spends]
+
+
+def txid(n):
+    return f"{n:064x}"
+
+
+def confirmed(n):
+    # An outpoint of a transaction that is not in the mempool
+    return (f"{n:064x}".replace("0", "f", 1), 0)
+
+
+def selected(template):
+    return [tx.txid for tx in template.transactions]
+
+
+def assert_valid_block(graph, template):
+    # Parents first, no outpoint spent twice, every transaction in the graph
+    seen = set()
+    spent = set()
+    for tx in template.transactions:
+        assert tx.txid in graph
+        for vin in tx.vin:
+            assert vin.txid not in graph or vin.txid in seen
+            assert vin.outpoint not in spent
+            spent.add(vin.outpoint)
+        seen.add(tx.txid)
+
+
+def test_child_pays_for_parent():
+    parent = FakeTransaction(txid(1), 100, 400, [confirmed(1)])
+    child = FakeTransaction(txid(2), 20000, 400, [(txid(1), 0)])
+    middle = FakeTransaction(txid(3), 8000, 400, [confirmed(2)])
+    template = select_transactions(build_graph([child, middle, parent]))
+    # The package parent + child pays 25.1 sat/WU, more than middle's 20
+    assert selected(template) == [txid(1), txid(2), txid(3)]
+    assert template.fees == 28100
+    assert template.weight == 1200
+
+
+def test_parent_pulled_in_by_child_is_not_selected_twice():
+    parent = FakeTransaction(txid(1), 4000, 400, [confirmed(1)])
+    children = [
+        FakeTransaction(txid(2 + i), 1000 * (i + 1), 400, [(txid(1), i)]) for i in range(3)
+    ]
+    template = select_transactions(build_graph(children + [parent]))
+    assert selected(template) == [txid(1), txid(4), txid(3), txid(2)]
+
+
+def test_package_over_the_weight_limit_is_skipped():
+    parent = FakeTransaction(txid(1), 100, 600, [confirmed(1)])
+    child = FakeTransaction(txid(2), 50000, 600, [(txid(1), 0)])
+    light = FakeTransaction(txid(3), 1000, 400, [confirmed(2)])
+    template = select_transactions(build_graph([parent, child, light]), max_weight=1000)
+    assert selected(template) == [txid(3), txid(1)]
+
+
+
+def test_default_limit_leaves_room_for_header_and_coinbase():
+    fits = FakeTransaction(txid(1), 10000, MAX_TEMPLATE_WEIGHT, [confirmed(1)])
+    too_heavy = FakeTransaction(txid(2), 20000, MAX_BLOCK_WEIGHT - 1000, [confirmed(2)])
+    assert selected(select_transactions(build_graph([too_heavy]))) == []
+    assert selected(select_transactions(build_graph([fits, too_heavy]))) == [txid(1)]
+
+def test_conflicting_spends():
+    first = FakeTransaction(txid(1), 5000, 400, [confirmed(1)])
+    second = FakeTransaction(txid(2), 3000, 400, [confirmed(1)])
+    template = select_transactions(build_graph([first, second]))
+    assert selected(template) == [txid(1)]
+
+
+def test_excluded_parent_drops_descendants():
+    # The parent failed validation (or the structural check): its child and
+    # grandchild spend outputs that do not exist
+    child = FakeTransaction(txid(2), 9000, 400, [(txid(1), 0)])
+    grandchild = FakeTransaction(txid(3), 9000, 400, [(txid(2), 0)])
+    other = FakeTransaction(txid(4), 100, 400, [confirmed(1)])
+    graph = build_graph([grandchild, child, other], excluded_txids={txid(1)})
+    assert selected(select_transactions(graph)) == [txid(4)]
+    assert {txid(2), txid(3)} <= graph.excluded
+
+
+def test_exclusion_after_the_children_arrived():
+    graph = MempoolGraph()
+    graph.add(FakeTransaction(txid(2), 9000, 400, [(txid(1), 0)]))
+    graph.add(FakeTransaction(txid(3), 9000, 400, [(txid(2), 0)]))
+    graph.exclude(txid(1))
+    assert len(graph) == 0
+    assert selected(select_transactions(graph)) == []
+
+
+def random_mempool(rng, count):
+    # Chains and trees of transactions, with a few double spends
+    transactions = []
+    for n in range(count):
+        spends = [confirmed(n)]
+        if transactions and rng.random() < 0.6:
+            for parent in rng.sample(transactions, min(len(transactions), rng.randint(1, 2))):
+                spends.append((parent.txid, rng.randint(0, 1)))
+        if n and rng.random() < 0.05:
+            spends.append(confirmed(rng.randrange(n)))
+        weight = rng.randint(200, 4000)
+        transactions.append(FakeTransaction(txid(n), rng.randint(0, 20) * weight, weight, spends))
+    return transactions
+
+
+def test_random_mempool_blocks_are_valid():
+    rng = random.Random(7)
+    graph = build_graph(random_mempool(rng, 300))
+    template = select_transactions(graph, max_weight=200000)
+    assert_valid_block(graph, template)
+    assert template.weight <= 200000
+    assert template.fees == sum(tx.fee for tx in template.transactions)
@@ -0,0 +1,69 @@
+import os
+
+from classifier import (
+    MIXED,
+    P2PKH,
+    P2TR,
+    P2WPKH,
+    classify_script,
+    mask_names,
+    route_inputs,
+    type_mask,
+)
+from conftest import MEMPOOL, load_transaction
+from script_validation import match_template
+
+# Mempool transactions: two P2TR inputs, one P2WPKH input
+P2TR_TX = "001035505afbf143e51bd667099190943a38eee20092bb691e72eaa44992b2f7"
+P2WPKH_TX = "000cb561188c762c81f76976f816829424e2af9e0e491c617b7bf41038df3d35"
+P2PKH_SCRIPT = bytes.fromhex("76a914" + "11" * 20 + "88ac")
+
+# Scripts with the size and first bytes of a template, but not the rest
+LOOKALIKES = [
+    # OP_DUP OP_HASH160 <20> ... OP_CHECKSIGVERIFY
+    bytes.fromhex("76a914" + "11" * 20 + "88ad"),
+    # OP_DUP OP_HASH160 <21 bytes> OP_CHECKSIG
+    bytes.fromhex("76a915" + "11" * 21 + "ac"),
+    # OP_HASH160 <20> OP_EQUALVERIFY
+    bytes.fromhex("a914" + "11" * 20 + "88"),
+    # Witness version 2, 32 bytes
+    bytes.fromhex("5220" + "11" * 32),
+    b"",
+    b"\x6a",
+]
+
+
+def test_same_templates_as_match_template():
+    scripts = list(LOOKALIKES)
+    for name in sorted(os.listdir(MEMPOOL))[:300]:
+        tx = load_transaction(name[: -len(".json")])
+        scripts.extend(vin.prevout.script_pubkey for vin in tx.vin)
+        scripts.extend(vout.script_pubkey for vout in tx.vout)
+    for script in scripts:
+        assert classify_script(script) == match_template(script), script.hex()
+    assert {classify_script(script) for script in LOOKALIKES} == {None, "witness_unknown"}
+
+
+def test_type_mask(mempool_tx):
+    assert type_mask(mempool_tx(P2TR_TX)) == P2TR
+    assert mask_names(type_mask(mempool_tx(P2WPKH_TX))) == ["p2wpkh"]
+
+    tx = mempool_tx(P2TR_TX)
+    tx.vin[1].prevout.script_pubkey = P2PKH_SCRIPT
+    assert type_mask(tx) == P2PKH | P2TR | MIXED
+    assert mask_names(type_mask(tx)) == ["p2pkh", "p2tr", "mixed"]
+
+    tx.vin = []
+    assert type_mask(tx) == 0
+
+
+def test_route_inputs(mempool_tx):
+    mixed = mempool_tx(P2TR_TX)
+    mixed.vin[0].prevout.script_pubkey = P2PKH_SCRIPT
+    transactions = [mempool_tx(P2WPKH_TX), mixed, mempool_tx(P2TR_TX)]
+    assert route_inputs(transactions) == {
+        "p2wpkh": [(0, 0)],
+        "p2pkh": [(1, 0)],
+        "p2tr": [(1, 1), (2, 0), (2, 1)],
+    }
+    assert type_mask(transactions[0]) == P2WPKH
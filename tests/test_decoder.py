@@ -0,0 +1,110 @@
+import copy
+import json
+
+import pytest
+
+from conftest import MEMPOOL
+from decoder import DECODERS
+
+# Two inputs, so a check that stops after the first one shows
+BASE = "001035505afbf143e51bd667099190943a38eee20092bb691e72eaa44992b2f7"
+
+
+def available_decoders():
+    decoders = []
+    for decoder in DECODERS.values():
+        try:
+            decoders.append(decoder())
+        except ImportError:
+            pass
+    return decoders
+
+
+def base_transaction():
+    with open(f"{MEMPOOL}/{BASE}.json") as f:
+        return json.load(f)
+
+
+def drop(data, *path):
+    *parents, name = path
+    for key in parents:
+        data = data[key]
+    del data[name]
+
+
+def put(data, value, *path):
+    *parents, name = path
+    for key in parents:
+        data = data[key]
+    data[name] = value
+
+
+# (description, edit of the base transaction, passes check_transaction())
+CASES = [
+    ("unchanged", lambda tx: None, True),
+    ("no locktime", lambda tx: drop(tx, "locktime"), False),
+    ("string version", lambda tx: put(tx, "2", "version"), False),
+    ("boolean version", lambda tx: put(tx, True, "version"), True),
+    ("first input without is_coinbase", lambda tx: drop(tx, "vin", 0, "is_coinbase"), False),
+    ("first input with sequence 0", lambda tx: put(tx, 0, "vin", 0, "sequence"), False),
+    ("second input with sequence 0", lambda tx: put(tx, 0, "vin", 1, "sequence"), False),
+    # validate_vin() returns a truthy tuple for these, which ends the check
+    # with a pass before the second input is looked at
+    (
+        "first prevout without address, second input with sequence 0",
+        lambda tx: (
+            drop(tx, "vin", 0, "prevout", "scriptpubkey_address"),
+            put(tx, 0, "vin", 1, "sequence"),
+        ),
+        True,
+    ),
+    (
+        "first input vout 0, second input without is_coinbase",
+        lambda tx: (put(tx, 0, "vin", 0, "vout"), drop(tx, "vin", 1, "is_coinbase")),
+        True,
+    ),
+    (
+        "first input without scriptsig_asm and witness, second with sequence 0",
+        lambda tx: (
+            put(tx, [], "vin", 0, "witness"),
+            drop(tx, "vin", 0, "scriptsig_asm"),
+            put(tx, 0, "vin", 1, "sequence"),
+        ),
+        True,
+    ),
+    # validate_vout() never fails
+    ("output without asm", lambda tx: drop(tx, "vout", 0, "scriptpubkey_asm"), True),
+]
+
+
+@pytest.mark.parametrize("description, edit, passes", CASES, ids=[case[0] for case in CASES])
+def test_decoders_agree(description, edit, passes):
+    tx_data = copy.deepcopy(base_transaction())
+    edit(tx_data)
+    data = json.dumps(tx_data).encode()
+    verdicts = {}
+    for decoder in available_decoders():
+        tx = decoder.decode(data)
+        verdicts[decoder.name] = tx.txid if tx is not None else None
+    assert len(set(verdicts.values())) == 1, verdicts
+    assert (next(iter(verdicts.values())) is not None) == passes
+
+
+def test_input_without_prevout_is_refused():
+    # Past an early exit of validate_vin(): the prevout is still needed
+    tx_data = base_transaction()
+    put(tx_data, 0, "vin", 0, "vout")
+    drop(tx_data, "vin", 1, "prevout")
+    data = json.dumps(tx_data).encode()
+    assert all(decoder.decode(data) is None for decoder in available_decoders())
+
+
+def test_same_transactions_as_json():
+    with open(f"{MEMPOOL}/{BASE}.json", "rb") as f:
+        data = f.read()
+    transactions = [decoder.decode(data) for decoder in available_decoders()]
+    assert len(transactions) == len(DECODERS)
+    for tx in transactions[1:]:
+        assert tx.wtxid == transactions[0].wtxid
+        assert tx.fee == transactions[0].fee
+        assert [vin.is_coinbase for vin in tx.vin] == [vin.is_coinbase for vin in transactions[0].vin]
@@ -0,0 +1,40 @@
+from p2pkh_validation import p2pkh_signature
+from sighash import SIGHASH_ALL, SIGHASH_SINGLE, get_sighash_cache
+from verifier import verify
+
+# Mempool inputs signed by real wallets: (file name, input index); the
+# digests are right when the signatures verify
+P2PKH_INPUTS = [
+    # SIGHASH_ALL
+    ("00d12b523d8b7ad90e2269767478764c243625539dc59bcd457d14ca1aa4e38c", 0),
+    # SIGHASH_ALL | ANYONECANPAY
+    ("204ac1129b8c7dd69d0459f57521bf88acbdeb6d57caa84a0b8a391826faf155", 0),
+]
+# Two inputs and a single output
+SINGLE_OUTPUT_TX = "001035505afbf143e51bd667099190943a38eee20092bb691e72eaa44992b2f7"
+
+
+def test_legacy_mempool_signatures(mempool_tx):
+    for name, index in P2PKH_INPUTS:
+        check = p2pkh_signature(mempool_tx(name), index)
+        assert verify(*check), name
+
+
+def test_legacy_all_matches_generic_serialization(mempool_tx):
+    # The SIGHASH_ALL fast path splices the scriptCode into a shared
+    # serialization; it must hash the same bytes as the generic copy
+    tx = mempool_tx(P2PKH_INPUTS[0][0])
+    cache = get_sighash_cache(tx)
+    script_code = tx.vin[0].prevout.script_pubkey
+    assert cache.legacy_digest(0, script_code) == cache._legacy_generic(
+        0, script_code, SIGHASH_ALL
+    )
+
+
+def test_legacy_single_without_matching_output(mempool_tx):
+    # SIGHASH_SINGLE on an input with no output of the same index signs the
+    # number one (the consensus "SIGHASH_SINGLE bug")
+    tx = mempool_tx(SINGLE_OUTPUT_TX)
+    assert len(tx.vin) == 2 and len(tx.vout) == 1
+    digest = get_sighash_cache(tx).legacy_digest(1, b"", SIGHASH_SINGLE)
+    assert digest == (1).to_bytes(32, "little")
@@ -0,0 +1,88 @@
+import hashlib
+import random
+
+from merkle import BlockMerkleTrees, MerkleTree, merkle_root
+
+# Block 100000: txids (RPC byte order) and merkle root
+BLOCK_100000_TXIDS = [
+    "8c14f0db3df150123e6f3dbbf30f8b955a8249b62ac1d1ff16284aefa3d06d87",
+    "fff2525b8931402dd09222c50775608f75787bd2b87e56995a7bdd30f79702c4",
+    "6359f0868171b1d194cbee1af2f16ea598ae8fad666d9b012c8ed2b79a236ec4",
+    "e9a66845e05d5abc0ad04ec80f774a7e585c6e8db975962d069a522137b80c1d",
+]
+BLOCK_100000_MERKLE_ROOT = "f3e94742aca4b5ef85488dc37c06c3282295ffec960994b2c0d5ac2a25a95766"
+
+
+class FakeTransaction:
+    def __init__(self, n):
+        self.txid_bytes = hashlib.sha256(b"txid%d" % n).digest()
+        self.wtxid_bytes = hashlib.sha256(b"wtxid%d" % n).digest()
+
+
+def reference_root(leaves):
+    # Level by level, from scratch
+    if not leaves:
+        return bytes(32)
+    level = list(leaves)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [
+            hashlib.sha256(hashlib.sha256(level[i] + level[i + 1]).digest()).digest()
+            for i in range(0, len(level), 2)
+        ]
+    return level[0]
+
+
+def leaves(rng, count):
+    return [rng.randbytes(32) for _ in range(count)]
+
+
+def test_block_100000():
+    txids = [bytes.fromhex(txid)[::-1] for txid in BLOCK_100000_TXIDS]
+    assert merkle_root(txids)[::-1].hex() == BLOCK_100000_MERKLE_ROOT
+
+
+def test_roots_of_every_size():
+    rng = random.Random(1)
+    for count in range(20):
+        hashes = leaves(rng, count)
+        assert merkle_root(hashes) == reference_root(hashes), count
+
+
+def test_set_leaf_and_splice():
+    rng = random.Random(2)
+    for _ in range(50):
+        hashes = leaves(rng, rng.randint(1, 40))
+        tree = MerkleTree(hashes)
+
+        index = rng.randrange(len(hashes))
+        hashes[index] = rng.randbytes(32)
+        tree.set_leaf(index, hashes[index])
+        assert tree.root == reference_root(hashes)
+
+        # Shorter and longer tails, down to a single leaf
+        start = rng.randint(1, len(hashes))
+        hashes[start:] = leaves(rng, rng.randint(0, 40))
+        tree.splice(start, hashes[start:])
+        assert tree.root == reference_root(hashes)
+        assert len(tree.levels[-1]) == 1
+
+
+def test_block_trees_update_keeps_the_common_prefix():
+    transactions = [FakeTransaction(n) for n in range(30)]
+    coinbase = FakeTransaction(-1)
+    trees = BlockMerkleTrees(transactions[:20], coinbase)
+
+    # The first 12 transactions stay, then others follow
+    block = transactions[:12] + transactions[25:] + transactions[15:18]
+    assert trees.update(block) == 12
+    fresh = BlockMerkleTrees(block, coinbase)
+    assert trees.merkle_root == fresh.merkle_root
+    assert trees.witness_root == fresh.witness_root
+
+    coinbase = FakeTransaction(-2)
+    trees.set_coinbase(coinbase)
+    assert trees.merkle_root == BlockMerkleTrees(block, coinbase).merkle_root
+    # The coinbase is a zero leaf of the witness tree
+    assert trees.witness_root == fresh.witness_root
@@ -0,0 +1,61 @@
+import struct
+
+from block_builder import BlockTemplate
+from merkle import merkle_root
+from mining import (
+    CHECK_INTERVAL,
+    DIFFICULTY_TARGET,
+    _search_range,
+    build_header,
+    mine_block,
+    search_nonce,
+    witness_commitment_script,
+)
+from transaction import hash256
+
+# An easy target: one header hash in 16 is below it
+EASY_TARGET = 1 << 252
+
+# Mempool transaction mined in a block of its own
+TRANSACTION = "00d12b523d8b7ad90e2269767478764c243625539dc59bcd457d14ca1aa4e38c"
+
+
+def header_value(header, nonce):
+    return int.from_bytes(hash256(header[:76] + struct.pack("<I", nonce)), "little")
+
+
+def test_midstate_search_finds_the_first_nonce():
+    header = build_header(bytes(range(32)), 1700000000)
+    nonce, tried = _search_range(header, 0, 1000, EASY_TARGET)
+    assert header_value(header, nonce) < EASY_TARGET
+    assert all(header_value(header, n) >= EASY_TARGET for n in range(nonce))
+    assert tried == nonce + 1
+
+
+def test_search_stops_at_the_end_of_its_range_or_when_told():
+    class Stop:
+        def is_set(self):
+            return True
+
+    header = build_header(bytes(32), 1700000000)
+    assert _search_range(header, 5, 105, 0) == (None, 100)
+    # The stop flag is read every CHECK_INTERVAL nonces
+    assert _search_range(header, 0, 10 * CHECK_INTERVAL, 0, Stop()) == (None, CHECK_INTERVAL)
+
+
+def test_workers_share_the_nonce_space():
+    header = build_header(bytes(range(32)), 1700000000)
+    nonce, tried = search_nonce(header, EASY_TARGET, workers=2)
+    assert header_value(header, nonce) < EASY_TARGET
+    assert tried >= 1
+
+
+def test_mined_block(mempool_tx):
+    tx = mempool_tx(TRANSACTION)
+    block = mine_block(BlockTemplate([tx], tx.fee, tx.weight), timestamp=1700000000, workers=1)
+    assert int(block.block_hash, 16) < DIFFICULTY_TARGET
+    assert block.header[36:68] == merkle_root([block.coinbase.txid_bytes, tx.txid_bytes])
+    assert block.txids() == [block.coinbase.txid, tx.txid]
+    # Witness commitment of the coinbase (zero leaf) and the transaction
+    witness_root = merkle_root([bytes(32), tx.wtxid_bytes])
+    assert block.coinbase.vout[1].script_pubkey == witness_commitment_script(witness_root)
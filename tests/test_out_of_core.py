@@ -0,0 +1,110 @@
+import os
+import random
+import shutil
+
+from conftest import MEMPOOL
+from out_of_core import (
+    TXID,
+    ShardedMempool,
+    load_selected,
+    merge_runs,
+    select_candidates,
+    spill_mempool,
+    write_run,
+)
+from test_block_template import FakeTransaction, confirmed, txid
+from test_watch import CHILD, OTHER, PARENT
+
+
+class ShardTransaction(FakeTransaction):
+    @property
+    def txid_bytes(self):
+        return bytes.fromhex(self.txid)[::-1]
+
+
+def record(tx, valid=True):
+    return {"filename": f"{tx.txid}.json", "txid": tx.txid, "mask": 0, "tx": tx, "valid": valid}
+
+
+def spilled(tmp_path, shards, rejected=()):
+    mempool = ShardedMempool(str(tmp_path))
+    for shard in shards:
+        mempool.add_shard([record(tx) for tx in shard], rejected)
+        rejected = ()
+    mempool.finish()
+    return mempool
+
+
+def txids(block):
+    return [candidate[0][::-1].hex() for candidate in block]
+
+
+def test_merge_runs_in_several_passes(tmp_path):
+    rng = random.Random(4)
+    runs = []
+    expected = []
+    for n in range(10):
+        records = sorted((rng.randbytes(32),) for _ in range(rng.randint(0, 50)))
+        expected.extend(records)
+        runs.append(str(tmp_path / f"{n}.run"))
+        write_run(runs[-1], TXID, records)
+    merged = list(merge_runs(runs, TXID, lambda record: record[0], str(tmp_path), fan_in=3))
+    assert merged == sorted(expected)
+    # The runs merged in the first passes are gone
+    assert not any(os.path.exists(run) for run in runs)
+
+
+def test_shards_are_merged_by_fee_rate(tmp_path):
+    rng = random.Random(6)
+    transactions = [
+        ShardTransaction(txid(n), rng.randint(0, 5000), rng.randint(200, 1000), [confirmed(n)])
+        for n in range(40)
+    ]
+    mempool = spilled(tmp_path, [transactions[i : i + 7] for i in range(0, 40, 7)])
+    rates = [candidate[1] / candidate[2] for candidate in mempool.candidates()]
+    assert len(rates) == 40 and rates == sorted(rates, reverse=True)
+    candidate = next(iter(mempool.candidates()))
+    tx = transactions[int(candidate[0][::-1].hex(), 16)]
+    assert mempool.name(candidate) == f"{tx.txid}.json"
+    assert mempool.outpoints(candidate) == [vin.outpoint for vin in tx.vin]
+    assert all(mempool.is_mempool_txid(tx.txid_bytes) for tx in transactions)
+    assert not mempool.is_mempool_txid(bytes.fromhex(txid(40))[::-1])
+    mempool.close()
+
+
+def test_children_wait_for_their_parents(tmp_path):
+    parent = ShardTransaction(txid(1), 800, 400, [confirmed(1)])
+    # Seen first, but needs the parent
+    child = ShardTransaction(txid(2), 4000, 400, [(txid(1), 0)])
+    other = ShardTransaction(txid(3), 2000, 400, [confirmed(2)])
+    # Spends the outpoint of other, at a lower fee rate
+    conflict = ShardTransaction(txid(4), 1000, 400, [confirmed(2)])
+    # Its parent failed the structural check
+    orphan = ShardTransaction(txid(5), 9000, 400, [(txid(6), 0)])
+    # Parent and child in different shards
+    mempool = spilled(tmp_path, [[child, conflict], [orphan, parent, other]], rejected={txid(6)})
+    block, fees, weight = select_candidates(mempool)
+    assert txids(block) == [txid(3), txid(1), txid(2)]
+    assert (fees, weight) == (6800, 1200)
+    mempool.close()
+
+
+def test_spilled_mempool_folder(tmp_path):
+    folder = tmp_path / "mempool"
+    folder.mkdir()
+    for name in (CHILD, PARENT, OTHER):
+        shutil.copy(os.path.join(MEMPOOL, f"{name}.json"), folder)
+    spill = tmp_path / "spill"
+    spill.mkdir()
+    # One file per shard: the child and its parent are validated apart
+    mempool = spill_mempool(str(folder), str(spill), shard_size=1, workers=1)
+    assert (mempool.transactions, mempool.valid) == (3, 3)
+    block, fees, weight = select_candidates(mempool)
+    template = load_selected(mempool, str(folder), block)
+    names = [os.path.splitext(mempool.name(candidate))[0] for candidate in block]
+    mempool.close()
+
+    assert sorted(names) == sorted((CHILD, PARENT, OTHER))
+    assert names.index(PARENT) < names.index(CHILD)
+    assert [tx.txid for tx in template.transactions] == txids(block)
+    assert (template.fees, template.weight) == (fees, weight)
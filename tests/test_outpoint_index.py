@@ -0,0 +1,123 @@
+import random
+import sqlite3
+
+from block_builder import build_graph, select_transactions
+from outpoint_index import OutpointIndex
+from test_block_template import (
+    FakeInput,
+    FakeTransaction,
+    confirmed,
+    random_mempool,
+    selected,
+    txid,
+)
+
+
+def record(tx):
+    return {"txid": tx.txid, "filename": f"{tx.txid}.json", "tx": tx}
+
+
+def indexed(transactions):
+    index = OutpointIndex()
+    for tx in transactions:
+        index.add(record(tx))
+    return index
+
+
+def replaceable(n, fee, spends):
+    tx = FakeTransaction(txid(n), fee, 400)
+    tx.vin = [FakeInput(parent, vout, sequence=0xFFFFFFFD) for parent, vout in spends]
+    return tx
+
+
+def mempool():
+    parent = FakeTransaction(txid(1), 1000, 400, [confirmed(1)])
+    child = FakeTransaction(txid(2), 9000, 400, [(txid(1), 0)])
+    # Both spend output 1 of the parent; only the second signals RBF
+    first = FakeTransaction(txid(3), 2000, 400, [(txid(1), 1)])
+    second = replaceable(4, 3000, [(txid(1), 1), confirmed(2)])
+    return [parent, child, first, second]
+
+
+def test_lookups():
+    index = indexed(mempool())
+    assert index.parents(txid(2)) == {txid(1)}
+    assert index.parents(txid(1)) == set()
+    assert index.children(txid(1)) == {txid(2), txid(3), txid(4)}
+    assert index.conflicts(txid(3)) == {txid(4)}
+    assert index.rbf_candidates(txid(3)) == {txid(4)}
+    assert index.rbf_candidates(txid(4)) == set()
+    assert index.spenders_of(txid(1), 1) == [txid(3), txid(4)]
+    assert len(index.double_spends()) == 1
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "outpoints.sqlite")
+    index = indexed(mempool())
+    index.save(path)
+    loaded = OutpointIndex.load(path)
+    assert not loaded.dirty
+    assert sorted(loaded.entries) == sorted(index.entries)
+    for tx in mempool():
+        assert loaded.parents(tx.txid) == index.parents(tx.txid)
+        assert loaded.children(tx.txid) == index.children(tx.txid)
+        assert loaded.conflicts(tx.txid) == index.conflicts(tx.txid)
+        assert loaded.entries[tx.txid].rbf == index.entries[tx.txid].rbf
+        assert loaded.entries[tx.txid].fee == tx.fee
+
+
+def test_warm_run_only_writes_the_changes(tmp_path):
+    path = str(tmp_path / "outpoints.sqlite")
+    transactions = mempool()
+    indexed(transactions).save(path)
+
+    index = OutpointIndex.load(path)
+    assert not any(index.add(record(tx)) for tx in transactions)
+    assert not index.dirty
+    # One file gone, one new
+    new = FakeTransaction(txid(5), 500, 400, [(txid(2), 0)])
+    index.add(record(new))
+    index.retain({tx.txid for tx in transactions[1:]} | {new.txid})
+    assert index.changed == {txid(1), txid(5)}
+    assert index.parents(txid(2)) == set()
+    index.save(path)
+
+    loaded = OutpointIndex.load(path)
+    assert sorted(loaded.entries) == sorted([txid(2), txid(3), txid(4), txid(5)])
+    assert loaded.parents(txid(5)) == {txid(2)}
+
+
+def test_other_version_is_ignored(tmp_path):
+    path = str(tmp_path / "outpoints.sqlite")
+    indexed(mempool()).save(path)
+    db = sqlite3.connect(path)
+    db.execute("UPDATE meta SET value = value + 1 WHERE name = 'version'")
+    db.commit()
+    db.close()
+    index = OutpointIndex.load(path)
+    assert len(index) == 0 and index.dirty
+    assert len(OutpointIndex.load(str(tmp_path / "missing.sqlite"))) == 0
+
+
+def test_graph_on_the_mempool_index():
+    # The index also holds transactions left out of the graph; the graph
+    # and the selection only look at the ones it contains
+    transactions = random_mempool(random.Random(3), 200)
+    invalid = {tx.txid for tx in transactions[::17]}
+    valid = [tx for tx in transactions if tx.txid not in invalid]
+    shared = build_graph(valid, invalid, indexed(transactions))
+    own = build_graph(valid, invalid)
+    assert sorted(shared.entries) == sorted(own.entries)
+    for entry in own.entries.values():
+        assert shared.entries[entry.txid].ancestors == entry.ancestors
+    assert selected(select_transactions(shared, 100000)) == selected(
+        select_transactions(own, 100000)
+    )
+
+
+def test_conflict_with_a_transaction_outside_the_graph():
+    # The invalid conflicting spend is in the index, not in the graph: it
+    # must not keep the valid one out
+    first, second = mempool()[2:]
+    graph = build_graph([first], {second.txid}, indexed([first, second]))
+    assert selected(select_transactions(graph)) == [first.txid]
@@ -0,0 +1,66 @@
+from p2sh_validation import validate_p2sh_input
+from p2wsh_validation import verify_p2wsh_input
+from script_validation import cached_multisig, script_sha256
+
+# Mempool inputs: (file name, input index)
+P2WSH_MULTISIG = ("0136f8e20b42cf02779feef9f0f2925b5006c9b5d73df15bcbc054e6310cde27", 0)
+# A witness script that is not a multisig, run by the interpreter
+P2WSH_SCRIPT = ("024a0301e7e8ef9c311a9c1761cad1418446bec51ce2832c91b08326fe4e999b", 0)
+P2SH_P2WPKH = ("019731eeb5a97dee2f5ee4e3dcfe9fdb27602a64d7a305727b616585197f521a", 0)
+P2SH_P2WSH = ("0d9ef76964c23e940ebcddde868c1089dfdb52147364da01ee92438dfb7c9375", 1)
+
+VALIDATORS = [
+    (P2WSH_MULTISIG, verify_p2wsh_input),
+    (P2WSH_SCRIPT, verify_p2wsh_input),
+    (P2SH_P2WPKH, validate_p2sh_input),
+    (P2SH_P2WSH, validate_p2sh_input),
+]
+
+
+def test_mempool_spends(mempool_tx):
+    for (name, index), validate in VALIDATORS:
+        assert validate(mempool_tx(name), index), name
+
+        # Another output amount changes the BIP143 digest
+        tx = mempool_tx(name)
+        tx.vout[0].value += 1
+        assert not validate(tx, index), name
+
+
+def test_witness_script_must_match_the_program(mempool_tx):
+    for (name, index), validate in VALIDATORS:
+        if name == P2SH_P2WPKH[0]:
+            continue
+        tx = mempool_tx(name)
+        witness = list(tx.vin[index].witness)
+        witness[-1] += b"\x75"
+        tx.vin[index].witness = tuple(witness)
+        assert not validate(tx, index), name
+
+
+def test_multisig_dummy_must_be_empty(mempool_tx):
+    name, index = P2WSH_MULTISIG
+    tx = mempool_tx(name)
+    witness = list(tx.vin[index].witness)
+    witness[0] = b"\x00"
+    tx.vin[index].witness = tuple(witness)
+    assert not verify_p2wsh_input(tx, index)
+
+
+def test_nested_scriptsig_is_only_the_redeem_script(mempool_tx):
+    for name, index in (P2SH_P2WPKH, P2SH_P2WSH):
+        tx = mempool_tx(name)
+        tx.vin[index].script_sig = b"\x00" + tx.vin[index].script_sig
+        assert not validate_p2sh_input(tx, index), name
+
+
+def test_witness_scripts_are_parsed_once(mempool_tx):
+    name, index = P2WSH_MULTISIG
+    witness_script = mempool_tx(name).vin[index].witness[-1]
+    # Equal scripts of another transaction share the cached entries
+    copy = bytes(bytearray(witness_script))
+    assert cached_multisig(copy) is cached_multisig(witness_script)
+    script_sha256(witness_script)
+    hits = script_sha256.cache_info().hits
+    script_sha256(copy)
+    assert script_sha256.cache_info().hits == hits + 1
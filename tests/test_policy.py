@@ -0,0 +1,68 @@
+import policy
+import validation
+from policy import dust_threshold, policy_reject
+
+# Mempool transactions: one P2WPKH input, and one P2PKH input
+P2WPKH_TX = "000cb561188c762c81f76976f816829424e2af9e0e491c617b7bf41038df3d35"
+P2PKH_TX = "00d12b523d8b7ad90e2269767478764c243625539dc59bcd457d14ca1aa4e38c"
+
+
+def test_dust_thresholds():
+    # Bitcoin Core's 294 and 546 satoshis at 3 sat/vB
+    assert dust_threshold(b"\x00\x14" + bytes(20)) == 294
+    assert dust_threshold(b"\x76\xa9\x14" + bytes(20) + b"\x88\xac") == 546
+    assert dust_threshold(b"\x6a\x04" + bytes(4)) == 0
+
+
+def test_every_tier(mempool_tx, monkeypatch):
+    assert policy_reject(mempool_tx(P2WPKH_TX)) is None
+    assert policy_reject(mempool_tx(P2PKH_TX)) is None
+
+    tx = mempool_tx(P2WPKH_TX)
+    tx.vout[0].value += tx.fee + 1
+    assert policy_reject(tx) == "fee"
+
+    tx = mempool_tx(P2WPKH_TX)
+    tx.vin.append(tx.vin[0])
+    assert policy_reject(tx) == "inputs"
+
+    tx = mempool_tx(P2WPKH_TX)
+    tx.vout[0].value = dust_threshold(tx.vout[0].script_pubkey) - 1
+    assert policy_reject(tx) == "outputs"
+
+    tx = mempool_tx(P2WPKH_TX)
+    monkeypatch.setattr(policy, "MAX_STANDARD_TX_WEIGHT", tx.weight - 1)
+    assert policy_reject(tx) == "size"
+    monkeypatch.undo()
+
+    # A scriptSig on a segwit spend, a witness on a legacy one
+    tx = mempool_tx(P2WPKH_TX)
+    tx.vin[0].script_sig = b"\x00"
+    assert policy_reject(tx) == "shape"
+    tx = mempool_tx(P2PKH_TX)
+    tx.vin[0].witness = (b"\x01",)
+    assert policy_reject(tx) == "shape"
+
+
+def test_first_failing_tier_is_reported(mempool_tx):
+    tx = mempool_tx(P2WPKH_TX)
+    tx.vin[0].script_sig = b"\x00"
+    tx.vout[0].value += tx.fee + 1
+    assert policy_reject(tx) == "fee"
+
+
+def test_rejected_transactions_skip_the_signature_checks(mempool_tx, monkeypatch):
+    checked = []
+
+    def batch_verdicts(transactions, profiler=None):
+        checked.extend(tx.txid for tx in transactions)
+        return [[validation.VALID] * len(tx.vin) for tx in transactions]
+
+    monkeypatch.setattr(validation, "batch_verdicts", batch_verdicts)
+    overspending = mempool_tx(P2WPKH_TX)
+    overspending.vout[0].value += overspending.fee + 1
+    good = mempool_tx(P2PKH_TX)
+    records = [{"txid": tx.txid, "tx": tx} for tx in (overspending, good)]
+    assert validation.validate_records(records) == [good]
+    assert checked == [good.txid]
+    assert [record["rejected"] for record in records] == ["fee", None]
@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import result_cache
+from conftest import MEMPOOL
+from ingest import ingest_mempool
+from metrics import METRICS
+from result_cache import CachedTransaction, ResultCache
+from validation import validate_records
+
+FILES = sorted(os.listdir(MEMPOOL))[:24]
+
+
+@pytest.fixture
+def folder(tmp_path):
+    # A few mempool files, one failing the structural check and one that is
+    # not JSON
+    mempool = tmp_path / "mempool"
+    mempool.mkdir()
+    for filename in FILES:
+        shutil.copy(os.path.join(MEMPOOL, filename), mempool)
+    # The check stops at an input spending output 0, this one does not
+    with open(os.path.join(MEMPOOL, FILES[1])) as f:
+        tx_data = json.load(f)
+    tx_data["vin"][0]["sequence"] = 0
+    (mempool / "refused.json").write_text(json.dumps(tx_data))
+    (mempool / "garbage.json").write_text("not json")
+    return mempool
+
+
+def run(folder, cache_path, workers):
+    # One pass of main.py: ingest, validate, store the verdicts
+    METRICS.reset()
+    cache = ResultCache(str(cache_path))
+    rejected = set()
+    records = ingest_mempool(str(folder), workers, cache=cache, rejected=rejected)
+    validate_records(records, cache)
+    cache.close()
+    verdicts = {record["txid"]: (record["valid"], record["rejected"]) for record in records}
+    return records, verdicts, rejected
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_warm_run_hits(folder, tmp_path, workers):
+    cache_path = tmp_path / "results.sqlite"
+    records, verdicts, rejected = run(folder, cache_path, workers)
+    files = len(FILES) + 2
+    assert len(records) == len(FILES)
+    assert len(rejected) == 1
+    assert METRICS.value("result_cache", outcome="miss") == files
+    # The cache key and the parsed content come from one read of each file
+    assert METRICS.value("files_read") == files
+    assert METRICS.value("bytes_read") == sum(f.stat().st_size for f in folder.iterdir())
+
+    warm_records, warm_verdicts, warm_rejected = run(folder, cache_path, workers)
+    assert METRICS.value("result_cache", outcome="hit") == files
+    assert METRICS.value("files_read") == files
+    assert warm_verdicts == verdicts
+    assert warm_rejected == rejected
+    assert all(isinstance(record["tx"], CachedTransaction) for record in warm_records)
+    by_txid = {record["txid"]: record["tx"] for record in records}
+    for record in warm_records:
+        tx = by_txid[record["txid"]]
+        assert (record["tx"].fee, record["tx"].weight) == (tx.fee, tx.weight)
+        assert [vin.outpoint for vin in record["tx"].vin] == [vin.outpoint for vin in tx.vin]
+
+
+def test_changed_content_misses(folder, tmp_path):
+    cache_path = tmp_path / "results.sqlite"
+    run(folder, cache_path, 1)
+    with open(folder / FILES[2], "a") as f:
+        f.write("\n")
+    run(folder, cache_path, 1)
+    assert METRICS.value("result_cache", outcome="miss") == 1
+
+
+def test_new_validator_version_empties_the_cache(folder, tmp_path, monkeypatch):
+    cache_path = tmp_path / "results.sqlite"
+    run(folder, cache_path, 1)
+    monkeypatch.setattr(result_cache, "VALIDATOR_VERSION", result_cache.VALIDATOR_VERSION + 1)
+    run(folder, cache_path, 1)
+    assert METRICS.value("result_cache", outcome="hit") == 0
+    run(folder, cache_path, 1)
+    assert METRICS.value("result_cache", outcome="miss") == 0
@@ -0,0 +1,123 @@
+import pytest
+
+from p2sh_validation import validate_p2sh_input
+from script_validation import (
+    OP_0,
+    OP_1,
+    OP_ELSE,
+    OP_ENDIF,
+    OP_IF,
+    OP_NOTIF,
+    OP_VERIF,
+    OP_VERNOTIF,
+    ScriptError,
+    TransactionChecker,
+    eval_script,
+    match_template,
+    parse_multisig,
+    verify_script,
+)
+
+OP_RESERVED = 0x50
+OP_2 = 0x52
+OP_3 = 0x53
+OP_CAT = 0x7E
+OP_MUL = 0x95
+
+# Legacy P2SH multisig input of the mempool folder
+P2SH_MULTISIG = ("0dd03993f8318d968b7b6fdf843682e9fd89258c186187688511243345c2009f", 0)
+
+
+def run(*opcodes):
+    stack = []
+    eval_script(bytes(opcodes), stack, checker=None)
+    return stack
+
+
+def test_if_else_branches():
+    assert run(OP_1, OP_IF, OP_2, OP_ELSE, OP_3, OP_ENDIF) == [b"\x02"]
+    assert run(OP_0, OP_IF, OP_2, OP_ELSE, OP_3, OP_ENDIF) == [b"\x03"]
+    assert run(OP_0, OP_NOTIF, OP_2, OP_ENDIF) == [b"\x02"]
+    # Nested in a branch that is not executed
+    assert run(OP_0, OP_IF, OP_1, OP_IF, OP_2, OP_ENDIF, OP_ELSE, OP_3, OP_ENDIF) == [b"\x03"]
+
+
+def test_unbalanced_conditionals():
+    with pytest.raises(ScriptError):
+        run(OP_ENDIF)
+    with pytest.raises(ScriptError):
+        run(OP_ELSE)
+
+
+def test_verif_fails_in_unexecuted_branch():
+    for opcode in (OP_VERIF, OP_VERNOTIF):
+        with pytest.raises(ScriptError):
+            run(OP_0, OP_IF, opcode, OP_ENDIF, OP_1)
+
+
+def test_disabled_opcodes_fail_in_unexecuted_branch():
+    for opcode in (OP_CAT, OP_MUL):
+        with pytest.raises(ScriptError):
+            run(OP_0, OP_IF, opcode, OP_ENDIF, OP_1)
+
+
+def test_reserved_opcode_only_fails_when_executed():
+    assert run(OP_0, OP_IF, OP_RESERVED, OP_ENDIF, OP_1) == [b"\x01"]
+    with pytest.raises(ScriptError):
+        run(OP_1, OP_IF, OP_RESERVED, OP_ENDIF)
+
+
+def test_witness_if_must_be_minimal():
+    with pytest.raises(ScriptError):
+        eval_script(bytes((OP_IF, OP_1, OP_ENDIF)), [b"\x02"], None, "witness_v0")
+
+
+def test_p2sh_multisig(mempool_tx):
+    name, index = P2SH_MULTISIG
+    tx = mempool_tx(name)
+    vin = tx.vin[index]
+    assert verify_script(vin.script_sig, vin.prevout.script_pubkey, TransactionChecker(tx, index))
+
+    # Another output amount changes every legacy sighash
+    tx = mempool_tx(name)
+    tx.vout[0].value += 1
+    vin = tx.vin[index]
+    assert not verify_script(
+        vin.script_sig, vin.prevout.script_pubkey, TransactionChecker(tx, index)
+    )
+
+
+def test_match_template():
+    program = bytes(range(32))
+    assert match_template(bytes.fromhex("76a914") + program[:20] + bytes.fromhex("88ac")) == "p2pkh"
+    assert match_template(bytes.fromhex("a914") + program[:20] + b"\x87") == "p2sh"
+    assert match_template(b"\x00\x14" + program[:20]) == "p2wpkh"
+    assert match_template(b"\x00\x20" + program) == "p2wsh"
+    assert match_template(b"\x51\x20" + program) == "p2tr"
+    assert match_template(b"\x52\x02\x00\x01") == "witness_unknown"
+    # A P2PKH with another last opcode, a push-only script
+    assert match_template(bytes.fromhex("76a914") + program[:20] + bytes.fromhex("88ad")) is None
+    assert match_template(b"\x01\x01") is None
+
+
+def test_parse_multisig():
+    keys = [bytes([2]) + bytes([n]) * 32 for n in range(3)]
+    script = bytes((OP_2,)) + b"".join(bytes((33,)) + key for key in keys) + bytes((OP_3, 0xAE))
+    assert parse_multisig(script) == (2, keys)
+    # m above n, a key count that does not match n
+    assert parse_multisig(bytes((OP_3,)) + script[1:-2] + bytes((OP_2, 0xAE))) is None
+    assert parse_multisig(script[:-36] + bytes((OP_3, 0xAE))) is None
+
+
+def test_multisig_fast_path_matches_interpreter(mempool_tx):
+    # The compiled P2SH multisig path must agree with the generic
+    # evaluation, on the valid input and on a tampered copy
+    name, index = P2SH_MULTISIG
+    for value in (0, 1):
+        tx = mempool_tx(name)
+        tx.vout[0].value += value
+        vin = tx.vin[index]
+        expected = verify_script(
+            vin.script_sig, vin.prevout.script_pubkey, TransactionChecker(tx, index)
+        )
+        assert validate_p2sh_input(tx, index) == expected == (value == 0)
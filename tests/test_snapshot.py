@@ -0,0 +1,61 @@
+import pytest
+
+from snapshot import Snapshot, write_snapshot
+from validation import VALID, batch_verdicts
+
+# Mempool files of every template: P2PKH, P2WPKH, P2SH multisig, P2TR key
+# and script path
+TRANSACTIONS = [
+    "00d12b523d8b7ad90e2269767478764c243625539dc59bcd457d14ca1aa4e38c",
+    "000cb561188c762c81f76976f816829424e2af9e0e491c617b7bf41038df3d35",
+    "0dd03993f8318d968b7b6fdf843682e9fd89258c186187688511243345c2009f",
+    "001035505afbf143e51bd667099190943a38eee20092bb691e72eaa44992b2f7",
+    "0026c0aa204a6da8916bf5849cff17d3c81b1a2b6f035045b5dc3263d8a448e2",
+]
+REJECTED = ["ab" * 32, "01" * 32]
+
+
+def records(mempool_tx):
+    found = []
+    for n, name in enumerate(TRANSACTIONS):
+        tx = mempool_tx(name)
+        found.append({"filename": f"{name}.json", "txid": tx.txid, "tx": tx, "valid": n != 1})
+    return found
+
+
+def test_round_trip(tmp_path, mempool_tx):
+    path = str(tmp_path / "mempool.snap")
+    written = records(mempool_tx)
+    write_snapshot(path, written, REJECTED)
+
+    with Snapshot(path) as snapshot:
+        assert len(snapshot) == len(written)
+        assert snapshot.rejected_txids() == set(REJECTED)
+        loaded = snapshot.records()
+        for index, (record, original) in enumerate(zip(loaded, written)):
+            tx, expected = record["tx"], original["tx"]
+            assert bytes(snapshot.raw(index)) == expected.serialize()
+            assert (record["txid"], tx.wtxid) == (expected.txid, expected.wtxid)
+            assert (tx.weight, tx.fee) == (expected.weight, expected.fee)
+            assert record["valid"] == original["valid"]
+            # Files are named after the SHA-256 of the txid
+            assert record["filename"] == original["filename"]
+            for vin, expected_vin in zip(tx.vin, expected.vin):
+                prevout, expected_prevout = vin.prevout, expected_vin.prevout
+                assert prevout.value == expected_prevout.value
+                assert prevout.script_pubkey == expected_prevout.script_pubkey
+                assert prevout.script_type == expected_prevout.script_type
+            assert [vout.script_type for vout in tx.vout] == [
+                vout.script_type for vout in expected.vout
+            ]
+
+        # Everything the signature checks read came back
+        verdicts = batch_verdicts([record["tx"] for record in loaded])
+        assert all(verdict == VALID for tx_verdicts in verdicts for verdict in tx_verdicts)
+
+
+def test_other_files_are_refused(tmp_path):
+    path = tmp_path / "mempool.snap"
+    path.write_bytes(b"NOTASNAP" + bytes(12))
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
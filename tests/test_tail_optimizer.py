@@ -0,0 +1,80 @@
+import itertools
+import random
+
+from block_builder import build_graph, select_transactions
+from tail_optimizer import optimize_tail, split_tail
+from test_block_template import (
+    FakeTransaction,
+    assert_valid_block,
+    confirmed,
+    random_mempool,
+    selected,
+    txid,
+)
+
+
+def best_block(graph, max_weight):
+    # Brute force over every subset of a small graph
+    best = 0
+    entries = list(graph.entries.values())
+    for size in range(1, len(entries) + 1):
+        for subset in itertools.combinations(entries, size):
+            txids = {entry.txid for entry in subset}
+            if sum(entry.weight for entry in subset) > max_weight:
+                continue
+            if any(not entry.parents <= txids for entry in subset):
+                continue
+            outpoints = [vin.outpoint for entry in subset for vin in entry.tx.vin]
+            if len(set(outpoints)) != len(outpoints):
+                continue
+            best = max(best, sum(entry.fee for entry in subset))
+    return best
+
+
+def test_split_tail_keeps_the_prefix():
+    transactions = [FakeTransaction(txid(n), 100, 300, [confirmed(n)]) for n in range(5)]
+    prefix, tail = split_tail(transactions, 700)
+    assert (len(prefix), len(tail)) == (3, 2)
+    assert split_tail(transactions, 10000) == ([], transactions)
+    assert split_tail(transactions, 100) == (transactions, [])
+
+
+def test_refill_beats_the_greedy_order():
+    # The best fee rate first leaves 400 WU unused; the two others fill the
+    # block with more fees
+    best_rate = FakeTransaction(txid(1), 700, 600, [confirmed(1)])
+    first = FakeTransaction(txid(2), 550, 500, [confirmed(2)])
+    second = FakeTransaction(txid(3), 550, 500, [confirmed(3)])
+    graph = build_graph([best_rate, first, second])
+    greedy = select_transactions(graph, max_weight=1000)
+    assert selected(greedy) == [txid(1)]
+
+    template, report = optimize_tail(graph, greedy, 5.0, tail_weight=1000, max_weight=1000)
+    assert sorted(selected(template)) == [txid(2), txid(3)]
+    assert (template.fees, template.weight) == (1100, 1000)
+    assert (report.fee_gain, report.weight_gain) == (400, 400)
+    assert report.complete
+
+
+def test_random_mempools_reach_the_optimum():
+    for seed in range(8):
+        graph = build_graph(random_mempool(random.Random(seed), 11))
+        max_weight = 8000
+        greedy = select_transactions(graph, max_weight=max_weight)
+        template, report = optimize_tail(
+            graph, greedy, 5.0, tail_weight=max_weight, max_weight=max_weight
+        )
+        assert report.complete
+        assert_valid_block(graph, template)
+        assert template.weight <= max_weight
+        assert template.fees == sum(tx.fee for tx in template.transactions)
+        assert template.fees == best_block(graph, max_weight), seed
+
+
+def test_never_worse_than_greedy_without_time():
+    graph = build_graph(random_mempool(random.Random(5), 300))
+    greedy = select_transactions(graph, max_weight=200000)
+    template, report = optimize_tail(graph, greedy, 0.0, tail_weight=100000, max_weight=200000)
+    assert template.fees >= greedy.fees
+    assert not report.complete
+    assert_valid_block(graph, template)
@@ -0,0 +1,297 @@
+import hashlib
+import os
+
+from conftest import MEMPOOL, load_transaction
+from p2tr_validation import (
+    key_path_signature,
+    tapleaf_hash,
+    verify_p2tr_batch,
+    verify_p2tr_input,
+)
+from schnorr import (
+    CURVE_ORDER,
+    G,
+    _to_affine,
+    multi_scalar,
+    schnorr_verify,
+    schnorr_verify_batch,
+    tweak_xonly,
+)
+from sighash import get_sighash_cache
+from transaction import tagged_hash
+from verifier import tweak_xonly_pubkey, verify_schnorr, verify_schnorr_batch
+
+# BIP340 test vectors: (x-only pubkey, message, signature, valid)
+BIP340_VECTORS = [
+    (
+        "F9308A019258C31049344F85F89D5229B531C845836F99B08601F113BCE036F9",
+        "0000000000000000000000000000000000000000000000000000000000000000",
+        "E907831F80848D1069A5371B402410364BDF1C5F8307B0084C55F1CE2DCA8215"
+        "25F66A4A85EA8B71E482A74F382D2CE5EBEEE8FDB2172F477DF4900D310536C0",
+        True,
+    ),
+    (
+        "DFF1D77F2A671C5F36183726DB2341BE58FEAE1DA2DECED843240F7B502BA659",
+        "243F6A8885A308D313198A2E03707344A4093822299F31D0082EFA98EC4E6C89",
+        "6896BD60EEAE296DB48A229FF71DFE071BDE413E6D43F917DC8DCF8C78DE3341"
+        "8906D11AC976ABCCB20B091292BFF4EA897EFCB639EA871CFA95F6DE339E4B0A",
+        True,
+    ),
+    # Signature of vector 1 with s increased by one
+    (
+        "DFF1D77F2A671C5F36183726DB2341BE58FEAE1DA2DECED843240F7B502BA659",
+        "243F6A8885A308D313198A2E03707344A4093822299F31D0082EFA98EC4E6C89",
+        "6896BD60EEAE296DB48A229FF71DFE071BDE413E6D43F917DC8DCF8C78DE3341"
+        "8906D11AC976ABCCB20B091292BFF4EA897EFCB639EA871CFA95F6DE339E4B0B",
+        False,
+    ),
+    # Message of vector 0 under the key of vector 1
+    (
+        "DFF1D77F2A671C5F36183726DB2341BE58FEAE1DA2DECED843240F7B502BA659",
+        "0000000000000000000000000000000000000000000000000000000000000000",
+        "6896BD60EEAE296DB48A229FF71DFE071BDE413E6D43F917DC8DCF8C78DE3341"
+        "8906D11AC976ABCCB20B091292BFF4EA897EFCB639EA871CFA95F6DE339E4B0A",
+        False,
+    ),
+]
+
+# Key path spends of the mempool folder: (file name, input index)
+P2TR_INPUTS = [
+    # SIGHASH_DEFAULT (64 byte signature)
+    ("001035505afbf143e51bd667099190943a38eee20092bb691e72eaa44992b2f7", 0),
+    # SIGHASH_ALL
+    ("01f174e18c8bca719432e5e1f5536dbbbb44f4f0b9d60e12a3f30344e25c37c6", 0),
+    # SIGHASH_ALL | ANYONECANPAY
+    ("5da40502e3620b0d83819e07f1047f8345d993f84236ed977119bebd1efc4719", 0),
+    # SIGHASH_SINGLE | ANYONECANPAY
+    ("032fa957d9a82d22f5f6df6644672809faad41bf02c3f08e797600b3d824fa8e", 2),
+]
+# Script path spends of input 0: a leaf with a signature and no path, the
+# same with a one node path, a leaf without any signature
+SCRIPT_PATH_INPUTS = [
+    "0026c0aa204a6da8916bf5849cff17d3c81b1a2b6f035045b5dc3263d8a448e2",
+    "0bacc356618723a367a5fd1e142625813e6df7921006f4baa87828b5e2cfa925",
+    "00300359b527c5f27f04f2ce4ce84a0a4c71a4e1e1b2fe8a2af43247bf02cb08",
+]
+
+INTERNAL_KEY = G[0].to_bytes(32, "big")
+OP_CODESEPARATOR = b"\xab"
+OP_CHECKSIG = b"\xac"
+OP_CHECKSIGADD = b"\xba"
+OP_NUMEQUAL = b"\x9c"
+
+
+def key_path_checks(count):
+    # The first key path signatures of the mempool folder
+    checks = []
+    for filename in sorted(os.listdir(MEMPOOL)):
+        tx = load_transaction(filename[: -len(".json")])
+        for index, vin in enumerate(tx.vin):
+            prevout = vin.prevout
+            if prevout is not None and prevout.script_type == "v1_p2tr":
+                check = key_path_signature(tx, index)
+                if check is not None:
+                    checks.append(check)
+        if len(checks) >= count:
+            return checks[:count]
+    return checks
+
+
+def corrupt(checks, every):
+    # Flips a bit of the message of one check out of every
+    return [
+        (pubkey, signature, bytes([message[0] ^ 1]) + message[1:] if i % every == 0 else message)
+        for i, (pubkey, signature, message) in enumerate(checks)
+    ]
+
+
+def flip(data, position):
+    return data[:position] + bytes([data[position] ^ 1]) + data[position + 1 :]
+
+
+def xonly(secret):
+    return _to_affine(multi_scalar([(G, secret)]))[0].to_bytes(32, "big")
+
+
+def sign(secret, message):
+    # BIP340 signature with a deterministic nonce, enough for tests
+    point = _to_affine(multi_scalar([(G, secret)]))
+    if point[1] & 1:
+        secret = CURVE_ORDER - secret
+    nonce = int.from_bytes(hashlib.sha256(secret.to_bytes(32, "big") + message).digest(), "big")
+    nonce_point = _to_affine(multi_scalar([(G, nonce)]))
+    if nonce_point[1] & 1:
+        nonce = CURVE_ORDER - nonce
+    r = nonce_point[0].to_bytes(32, "big")
+    e = int.from_bytes(
+        tagged_hash("BIP0340/challenge", r + point[0].to_bytes(32, "big") + message), "big"
+    )
+    return r + ((nonce + e * secret) % CURVE_ORDER).to_bytes(32, "big")
+
+
+def commit_leaf(tx, index, script, sibling=b""):
+    # Makes input index spend an output committing to script, next to a
+    # sibling leaf hash if given, and returns the TapLeaf hash
+    leaf_hash = tapleaf_hash(script)
+    root = leaf_hash
+    if sibling:
+        root = tagged_hash("TapBranch", min(leaf_hash, sibling) + max(leaf_hash, sibling))
+    output_key, parity = tweak_xonly(INTERNAL_KEY, tagged_hash("TapTweak", INTERNAL_KEY + root))
+    vin = tx.vin[index]
+    vin.prevout.script_pubkey = b"\x51\x20" + output_key
+    vin.witness = (script, bytes([0xC0 | parity]) + INTERNAL_KEY + sibling)
+    return leaf_hash
+
+
+def set_stack(tx, index, stack):
+    vin = tx.vin[index]
+    vin.witness = tuple(stack) + vin.witness[-2:]
+
+
+def test_bip340_vectors():
+    for pubkey, message, signature, valid in BIP340_VECTORS:
+        item = (bytes.fromhex(pubkey), bytes.fromhex(signature), bytes.fromhex(message))
+        assert schnorr_verify(*item) == valid
+        assert verify_schnorr(*item) == valid
+
+
+def test_batch_matches_single():
+    checks = key_path_checks(48)
+    assert len(checks) == 48
+    for items in (checks, corrupt(checks, 7), corrupt(checks, 1)):
+        expected = [schnorr_verify(*item) for item in items]
+        assert schnorr_verify_batch(items) == expected
+        assert verify_schnorr_batch(items) == expected
+    assert all(schnorr_verify_batch(checks))
+
+
+def test_batch_with_vectors():
+    items = [
+        (bytes.fromhex(pubkey), bytes.fromhex(signature), bytes.fromhex(message))
+        for pubkey, message, signature, _ in BIP340_VECTORS
+    ] * 4
+    assert schnorr_verify_batch(items) == [valid for *_, valid in BIP340_VECTORS] * 4
+
+
+def test_bip341_mempool_signatures(mempool_tx):
+    for name, index in P2TR_INPUTS:
+        check = key_path_signature(mempool_tx(name), index)
+        assert check is not None, name
+        assert verify_schnorr(*check), name
+
+
+def test_bip341_digest_commits_to_amounts(mempool_tx):
+    name, index = P2TR_INPUTS[0]
+    tx = mempool_tx(name)
+    tx.vin[index].prevout.value += 1
+    assert not verify_schnorr(*key_path_signature(tx, index))
+
+
+def test_tweak_matches_pure_python():
+    for secret in (1, 2, 0xDEADBEEF):
+        tweak = hashlib.sha256(secret.to_bytes(4, "big")).digest()
+        expected = tweak_xonly(xonly(secret), tweak)
+        assert expected is not None
+        assert tweak_xonly_pubkey(xonly(secret), tweak) == expected
+    assert tweak_xonly(b"\x00" * 32, tweak) is None
+
+
+def test_script_path_mempool_spends(mempool_tx):
+    items = [(mempool_tx(name), 0) for name in SCRIPT_PATH_INPUTS]
+    for tx, index in items:
+        assert verify_p2tr_input(tx, index)
+    assert verify_p2tr_batch(items) == [True] * len(items)
+
+
+def test_appended_item_is_not_a_free_pass(mempool_tx):
+    # A broken key path signature followed by any item used to be taken for
+    # an unchecked script path spend
+    name, index = P2TR_INPUTS[0]
+    tx = mempool_tx(name)
+    vin = tx.vin[index]
+    vin.witness = (flip(vin.witness[0], 0), b"\x00")
+    assert not verify_p2tr_input(tx, index)
+    assert verify_p2tr_batch([(tx, index)]) == [False]
+    vin.witness = (flip(vin.witness[0], 0), b"\x51", bytes([0xC0]) + INTERNAL_KEY)
+    assert not verify_p2tr_input(tx, index)
+
+
+def test_script_path_commitment(mempool_tx):
+    name = SCRIPT_PATH_INPUTS[1]
+    witness = mempool_tx(name).vin[0].witness
+    signature, script, control = witness
+    broken = [
+        # Output key parity, internal key, path node
+        (script, flip(control, 0)),
+        (script, flip(control, 5)),
+        (script, flip(control, 40)),
+        # Unknown leaf version, committed or not
+        (script, bytes([control[0] ^ 0x02]) + control[1:]),
+        # Path dropped, truncated or extended
+        (script, control[:33]),
+        (script, control[:-1]),
+        (script, control + bytes(32)),
+        # Another script
+        (flip(script, 1), control),
+    ]
+    for items in broken:
+        tx = mempool_tx(name)
+        tx.vin[0].witness = (signature,) + items
+        assert not verify_p2tr_input(tx, 0)
+
+
+def test_tapscript_signature(mempool_tx):
+    name = SCRIPT_PATH_INPUTS[0]
+    for signature in (b"", bytes(64), bytes(63), b"\x01"):
+        tx = mempool_tx(name)
+        set_stack(tx, 0, [signature])
+        assert not verify_p2tr_input(tx, 0)
+    # Checked on its own and deferred to the batch
+    tx = mempool_tx(name)
+    set_stack(tx, 0, [flip(tx.vin[0].witness[0], 10)])
+    assert not verify_p2tr_input(tx, 0)
+    assert verify_p2tr_batch([(mempool_tx(name), 0), (tx, 0)]) == [True, False]
+
+
+def test_checksigadd(mempool_tx):
+    keys = [xonly(secret) for secret in (11, 12)]
+    script = (
+        b"\x20" + keys[0] + OP_CHECKSIG + b"\x20" + keys[1] + OP_CHECKSIGADD + b"\x52" + OP_NUMEQUAL
+    )
+    tx = mempool_tx(SCRIPT_PATH_INPUTS[2])
+    leaf_hash = commit_leaf(tx, 0, script)
+    message = get_sighash_cache(tx).taproot_digest(0, leaf_hash=leaf_hash)
+    signatures = [sign(11, message), sign(12, message)]
+    # The last witness item is the top of the stack: the first key's
+    # signature comes last
+    set_stack(tx, 0, signatures[::-1])
+    assert verify_p2tr_input(tx, 0)
+    assert verify_p2tr_batch([(tx, 0)]) == [True]
+    set_stack(tx, 0, [b"", signatures[0]])
+    assert not verify_p2tr_input(tx, 0)
+    set_stack(tx, 0, [signatures[0], signatures[1]])
+    assert not verify_p2tr_input(tx, 0)
+    assert verify_p2tr_batch([(tx, 0)]) == [False]
+
+
+def test_codeseparator_position(mempool_tx):
+    # The message commits to the opcode position of the last executed
+    # OP_CODESEPARATOR
+    script = b"\x51\x75" + OP_CODESEPARATOR + b"\x20" + xonly(7) + OP_CHECKSIG
+    tx = mempool_tx(SCRIPT_PATH_INPUTS[2])
+    leaf_hash = commit_leaf(tx, 0, script)
+    cache = get_sighash_cache(tx)
+    set_stack(tx, 0, [sign(7, cache.taproot_digest(0, leaf_hash=leaf_hash, codesep_pos=2))])
+    assert verify_p2tr_input(tx, 0)
+    set_stack(tx, 0, [sign(7, cache.taproot_digest(0, leaf_hash=leaf_hash))])
+    assert not verify_p2tr_input(tx, 0)
+
+
+def test_op_success_is_refused(mempool_tx):
+    tx = mempool_tx(SCRIPT_PATH_INPUTS[2])
+    commit_leaf(tx, 0, b"\x51", sibling=tapleaf_hash(b"\x50"))
+    assert verify_p2tr_input(tx, 0)
+    for script in (b"\x50", b"\x00\x63\x50\x68\x51", b"\x7e"):
+        tx = mempool_tx(SCRIPT_PATH_INPUTS[2])
+        commit_leaf(tx, 0, script)
+        assert not verify_p2tr_input(tx, 0)
@@ -0,0 +1,73 @@
+import os
+import random
+import shutil
+
+from block_builder import BlockSelector, build_graph, select_transactions
+from conftest import MEMPOOL
+from test_block_template import assert_valid_block, random_mempool
+from watch import MempoolWatcher
+
+# A mempool transaction and its in-mempool parent, and an unrelated one
+CHILD = "0026c0aa204a6da8916bf5849cff17d3c81b1a2b6f035045b5dc3263d8a448e2"
+PARENT = "bc0ce2c0cd8a2486cad3c8ea46873e72c1dd04b8d82661825039a90428a62fe0"
+OTHER = "00d12b523d8b7ad90e2269767478764c243625539dc59bcd457d14ca1aa4e38c"
+
+
+def test_incremental_selection_matches_full_selection():
+    rng = random.Random(11)
+    transactions = {tx.txid: tx for tx in random_mempool(rng, 300)}
+    graph = build_graph(transactions.values())
+    selector = BlockSelector(graph, max_weight=200000)
+    selector.select()
+    removed = set()
+    for _ in range(40):
+        for gone in rng.sample(sorted(graph.entries), rng.choice((1, 5, 30))):
+            if gone in graph:
+                graph.remove(gone)
+                removed.add(gone)
+        back = rng.sample(sorted(removed), min(len(removed), rng.choice((0, 3, 30))))
+        graph.add_all(transactions[txid] for txid in back)
+        removed.difference_update(back)
+
+        template = selector.select()
+        assert_valid_block(graph, template)
+        full = select_transactions(graph, max_weight=200000)
+        assert (template.fees, template.weight) == (full.fees, full.weight)
+
+
+
+def copy(name, folder):
+    shutil.copy(os.path.join(MEMPOOL, f"{name}.json"), folder)
+
+
+def test_watcher_only_reprocesses_changed_files(tmp_path):
+    folder = tmp_path / "mempool"
+    folder.mkdir()
+    for name in (CHILD, PARENT, OTHER):
+        copy(name, folder)
+    watcher = MempoolWatcher(str(folder), str(tmp_path), str(tmp_path / "output.txt"), workers=1)
+    assert watcher.update(watcher.scan()) == (3, 3)
+    # Verdicts are written by refresh(), which also mines
+    watcher.cache.commit()
+    child, parent = (watcher.files[f"{name}.json"][3] for name in (CHILD, PARENT))
+    assert watcher.graph.entries[child].ancestors == {child, parent}
+
+    # Touched without a change: read again, not validated
+    os.utime(folder / f"{PARENT}.json", ns=(1, 1))
+    assert watcher.scan() == {f"{PARENT}.json"}
+    assert watcher.update(watcher.scan()) == (1, 0)
+    assert watcher.scan() == set()
+
+    # Mined parent: the child no longer needs it
+    os.remove(folder / f"{PARENT}.json")
+    watcher.update(watcher.scan())
+    assert parent not in watcher.graph and parent not in watcher.index
+    assert watcher.graph.entries[child].ancestors == {child}
+
+    # Back again, its verdict comes from the result cache
+    copy(PARENT, folder)
+    assert watcher.update(watcher.scan()) == (1, 0)
+    assert watcher.graph.entries[child].ancestors == {child, parent}
+    template = watcher.selector.select()
+    full = select_transactions(build_graph(watcher.valid.values()))
+    assert [tx.txid for tx in template.transactions] == [tx.txid for tx in full.transactions]